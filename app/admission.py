@@ -0,0 +1,328 @@
+import math
+import metrics
+import os
+import threading
+import time
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+# Admission control of the model calls: per-merchant and global token buckets, in requests and prompt tokens
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "false").lower() in ("1", "true", "yes")
+# Model calls per second (and burst) of a single merchant, "0" for no limit
+ADMISSION_MERCHANT_RPS = float(os.getenv("ADMISSION_MERCHANT_RPS", "2"))
+ADMISSION_MERCHANT_BURST = float(os.getenv("ADMISSION_MERCHANT_BURST", "10"))
+# Estimated prompt tokens per minute of a single merchant, "0" for no limit
+ADMISSION_MERCHANT_TPM = float(os.getenv("ADMISSION_MERCHANT_TPM", "0"))
+# Model calls per second (and burst) and prompt tokens per minute of the whole container (or deployment, with mongo)
+ADMISSION_GLOBAL_RPS = float(os.getenv("ADMISSION_GLOBAL_RPS", "20"))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "40"))
+ADMISSION_GLOBAL_TPM = float(os.getenv("ADMISSION_GLOBAL_TPM", "0"))
+# Calls allowed to wait for a token at the same time, and max seconds of a wait: beyond them calls are rejected
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+# "memory" (per container) or "mongo" (fixed-window counters shared by every container)
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+ADMISSION_COLLECTION = os.getenv("ADMISSION_COLLECTION", "admission_counters")
+# Seconds of a window of the shared counters
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "10"))
+
+# Merchant buckets kept in memory: beyond them the idle (full) buckets are dropped
+MAX_MERCHANT_BUCKETS = 4096
+
+
+class RateLimited(Exception):
+    """
+    A model call was not admitted: the limits are exhausted and the call could not wait for a token.
+    Not an LLMError: the request is answered with 429 instead of a model failure.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def estimate_prompt_tokens(system_prompt: str, prompt: str) -> int:
+    """
+    Rough estimate (4 characters per token) of the prompt tokens of a model call.
+    :param system_prompt: system message.
+    :param prompt: user message.
+    :return: estimated number of tokens.
+    """
+    return (len(system_prompt) + len(prompt) + 3) // 4
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens, refilled at `rate` tokens per second.
+    Not thread safe: the limiter takes its lock around every call.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        :param amount: tokens needed (capped to the capacity, so a large demand is delayed but never refused).
+        :param now: time.monotonic().
+        :return: seconds before the tokens are available, 0 if they are.
+        """
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+def _buckets(rps: float, burst: float, tpm: float) -> List[Tuple[TokenBucket, bool]]:
+    # (bucket, True if sized in prompt tokens)
+    buckets = []
+    if rps > 0:
+        buckets.append((TokenBucket(rps, max(1.0, burst)), False))
+    if tpm > 0:
+        buckets.append((TokenBucket(tpm / 60, tpm), True))
+    return buckets
+
+
+class LocalLimiter:
+    """
+    Per-container limits: a global bucket and one bucket per merchant, for requests and for prompt tokens.
+    A call takes a token from every bucket or from none of them.
+    """
+
+    def __init__(self, merchant_rps: float = ADMISSION_MERCHANT_RPS, merchant_burst: float = ADMISSION_MERCHANT_BURST,
+                 merchant_tpm: float = ADMISSION_MERCHANT_TPM, global_rps: float = ADMISSION_GLOBAL_RPS,
+                 global_burst: float = ADMISSION_GLOBAL_BURST, global_tpm: float = ADMISSION_GLOBAL_TPM):
+        self.merchant_limits = (merchant_rps, merchant_burst, merchant_tpm)
+        self.global_buckets = _buckets(global_rps, global_burst, global_tpm)
+        self.merchant_buckets: Dict[str, List[Tuple[TokenBucket, bool]]] = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, merchant_id: str, tokens: int) -> float:
+        """
+        :param merchant_id: merchant of the call.
+        :param tokens: estimated prompt tokens of the call.
+        :return: 0 if the call is admitted, else seconds before it could be.
+        """
+        with self._lock:
+            now = time.monotonic()
+            buckets = self.global_buckets + self._merchant_buckets(merchant_id, now)
+            wait = max((bucket.wait_time(tokens if sized_in_tokens else 1, now)
+                        for bucket, sized_in_tokens in buckets), default=0.0)
+            if wait == 0:
+                for bucket, sized_in_tokens in buckets:
+                    bucket.take(tokens if sized_in_tokens else 1)
+            return wait
+
+    def _merchant_buckets(self, merchant_id: str, now: float) -> List[Tuple[TokenBucket, bool]]:
+        buckets = self.merchant_buckets.get(merchant_id)
+        if buckets is None:
+            if len(self.merchant_buckets) >= MAX_MERCHANT_BUCKETS:
+                # a full bucket is the same as a new one
+                self.merchant_buckets = {
+                    key: value for key, value in self.merchant_buckets.items()
+                    if not all(bucket.is_full(now) for bucket, _ in value)
+                }
+            buckets = self.merchant_buckets[merchant_id] = _buckets(*self.merchant_limits)
+        return buckets
+
+
+class MongoLimiter:
+    """
+    Limits shared by every container: requests and prompt tokens are counted in fixed windows of `window` seconds,
+    one document per scope (global or merchant) and window, with an increment rolled back when over the limit.
+    A TTL index on "expiresAt" keeps the collection small but is not required for correctness.
+    If MongoDB fails, the in-process limits apply.
+    """
+
+    def __init__(self, collection, window: float = ADMISSION_WINDOW, fallback: Optional[LocalLimiter] = None,
+                 merchant_rps: float = ADMISSION_MERCHANT_RPS, merchant_tpm: float = ADMISSION_MERCHANT_TPM,
+                 global_rps: float = ADMISSION_GLOBAL_RPS, global_tpm: float = ADMISSION_GLOBAL_TPM):
+        """
+        :param collection: pymongo collection (or any compatible stand-in).
+        :param window: seconds of a window.
+        :param fallback: limiter used while MongoDB is unavailable.
+        """
+        self.collection = collection
+        self.window = window
+        self.fallback = fallback or LocalLimiter()
+        # (max requests, max prompt tokens) per window, 0 for no limit
+        self.merchant_limits = (merchant_rps * window, merchant_tpm * window / 60)
+        self.global_limits = (global_rps * window, global_tpm * window / 60)
+
+    def try_acquire(self, merchant_id: str, tokens: int) -> float:
+        """
+        :param merchant_id: merchant of the call.
+        :param tokens: estimated prompt tokens of the call.
+        :return: 0 if the call is admitted, else seconds before the next window.
+        """
+        now = time.time()
+        index = int(now // self.window)
+        wait = (index + 1) * self.window - now
+        acquired = []
+        try:
+            for scope, limits in (("global", self.global_limits), (f"merchant:{merchant_id}", self.merchant_limits)):
+                if not any(limits):
+                    continue
+                key = f"{scope}:{index}"
+                # a prompt larger than the window limit is delayed until a window is empty, never refused
+                amount = min(tokens, limits[1]) if limits[1] else tokens
+                counters = self._increment(key, 1, amount, index)
+                acquired.append((key, amount))
+                if (limits[0] and counters["requests"] > limits[0]) or (limits[1] and counters["tokens"] > limits[1]):
+                    for key, amount in acquired:
+                        self._increment(key, -1, -amount, index)
+                    return wait
+            return 0.0
+        except Exception as e:
+            print(f"Error while updating the admission counters: {e}")
+            return self.fallback.try_acquire(merchant_id, tokens)
+
+    def _increment(self, key: str, requests: int, tokens: int, index: int) -> Dict:
+        from pymongo import ReturnDocument
+
+        expires_at = datetime.fromtimestamp((index + 1) * self.window, timezone.utc) + timedelta(seconds=self.window)
+        return self.collection.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"requests": requests, "tokens": tokens}, "$setOnInsert": {"expiresAt": expires_at}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+
+
+class AdmissionController:
+    """
+    Admits the model calls through a limiter. A call over the limits waits for a token in a bounded queue,
+    or is rejected right away (RateLimited) when the queue is full or the wait would exceed
+    max_wait or the deadline of the call.
+    """
+
+    def __init__(self, limiter, max_queue: int = ADMISSION_MAX_QUEUE, max_wait: float = ADMISSION_MAX_WAIT):
+        """
+        :param limiter: LocalLimiter or MongoLimiter.
+        :param max_queue: max calls waiting at the same time.
+        :param max_wait: max seconds a call waits.
+        """
+        self.limiter = limiter
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def admit(self, merchant_id: str, tokens: int, deadline_at: float) -> None:
+        """
+        Return when the call is admitted.
+        :param merchant_id: merchant of the call.
+        :param tokens: estimated prompt tokens of the call.
+        :param deadline_at: time.monotonic() by which the call must be completed.
+        :raises RateLimited: if the call cannot be admitted in time.
+        """
+        wait = self.limiter.try_acquire(merchant_id, tokens)
+        if wait == 0:
+            return
+
+        wait_until = self._enqueue(wait, deadline_at)
+        try:
+            with metrics.stage("AdmissionWait"):
+                while wait > 0:
+                    self._check(wait, wait_until)
+                    time.sleep(wait)
+                    wait = self.limiter.try_acquire(merchant_id, tokens)
+        finally:
+            self._dequeue()
+
+    async def admit_async(self, merchant_id: str, tokens: int, deadline_at: float) -> None:
+        """
+        Async version of admit: the event loop keeps serving other requests while the call waits.
+        """
+        # imported here: main imports this module, and the Lambda init does not need asyncio
+        import asyncio
+
+        wait = await self._try_acquire_async(merchant_id, tokens)
+        if wait == 0:
+            return
+
+        wait_until = self._enqueue(wait, deadline_at)
+        try:
+            with metrics.stage("AdmissionWait"):
+                while wait > 0:
+                    self._check(wait, wait_until)
+                    await asyncio.sleep(wait)
+                    wait = await self._try_acquire_async(merchant_id, tokens)
+        finally:
+            self._dequeue()
+
+    async def _try_acquire_async(self, merchant_id: str, tokens: int) -> float:
+        if isinstance(self.limiter, MongoLimiter):
+            import asyncio
+
+            # the shared counters are blocking
+            return await asyncio.to_thread(self.limiter.try_acquire, merchant_id, tokens)
+        return self.limiter.try_acquire(merchant_id, tokens)
+
+    def _enqueue(self, wait: float, deadline_at: float) -> float:
+        wait_until = min(time.monotonic() + self.max_wait, deadline_at)
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self._reject(wait)
+            self._check(wait, wait_until)
+            self.waiting += 1
+        metrics.record("AdmissionQueued", 1)
+        return wait_until
+
+    def _dequeue(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    def _check(self, wait: float, wait_until: float) -> None:
+        if time.monotonic() + wait > wait_until:
+            self._reject(wait)
+
+    @staticmethod
+    def _reject(wait: float) -> None:
+        metrics.record("AdmissionRejected", 1)
+        raise RateLimited(wait)
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    Return the process-wide admission controller, configured from the ADMISSION_* environment variables.
+    :return: shared AdmissionController, None if admission control is disabled.
+    """
+    global _controller
+
+    if not ADMISSION_CONTROL:
+        return None
+
+    with _controller_lock:
+        if _controller is None:
+            limiter = LocalLimiter()
+            if ADMISSION_BACKEND == "mongo":
+                from fetch_menu import get_client
+                db = get_client()[os.getenv("DATABASE_NAME")]
+                limiter = MongoLimiter(db[ADMISSION_COLLECTION], fallback=limiter)
+            _controller = AdmissionController(limiter)
+        return _controller
+
+
+def retry_after_seconds(retry_after: float) -> int:
+    """
+    :param retry_after: seconds before the call could be admitted.
+    :return: value of the Retry-After header (whole seconds, at least 1).
+    """
+    return max(1, math.ceil(retry_after))
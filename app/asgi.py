@@ -0,0 +1,75 @@
+import local_env  # noqa: F401  (loads .env before the settings are read)
+import json
+import metrics
+
+from admission import RateLimited, retry_after_seconds
+from cache_watcher import start_watcher
+from async_pipeline import async_generate_questions, async_suggest_dishes, async_suggest_dishes_batch
+from main import CORS_HEADERS
+
+# ASGI application serving the async pipeline, e.g.: uvicorn asgi:app --port 8000 (from the app folder).
+# A single process serves concurrent requests on one event loop.
+
+HEADERS = [(name.lower().encode(), value.encode()) for name, value in CORS_HEADERS.items()]
+
+
+async def send_json(send, status: int, payload, headers=()) -> None:
+    data = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": HEADERS + list(headers) + [
+            (b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())
+        ],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                start_watcher()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "OPTIONS":
+        return await send_json(send, 200, {"message": "CORS preflight"})
+
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+
+    with metrics.request(scope["path"]):
+        try:
+            body = json.loads(b"".join(chunks) or b"{}")
+            merchant_id = body.get('merchant_id', {})
+            menu_id = body.get('menu_id', {})
+            language = body.get('language', {})
+            user_preferences = body.get('user_preferences', {})
+
+            if scope["path"] == '/generate-questions':
+                response = await async_generate_questions(merchant_id, menu_id, language)
+            elif scope["path"] == '/suggest-dishes':
+                response = await async_suggest_dishes(merchant_id, menu_id, language, user_preferences)
+            elif scope["path"] == '/suggest-dishes-batch':
+                response = await async_suggest_dishes_batch(merchant_id, menu_id, language, body.get('diners', []))
+            else:
+                return await send_json(send, 400, {'error': 'Invalid path'})
+
+            await send_json(send, 500 if 'error' in response else 200, response)
+        except RateLimited as e:
+            retry_after = retry_after_seconds(e.retry_after)
+            await send_json(send, 429, {'error': 'Too many requests', 'retry_after': retry_after},
+                            [(b"retry-after", str(retry_after).encode())])
+        except Exception as e:
+            await send_json(send, 500, {'error': str(e)})
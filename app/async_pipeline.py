@@ -0,0 +1,166 @@
+import asyncio
+import metrics
+
+import generate_questions as questions
+import suggest_dishes as suggestions
+import suggest_dishes_batch as batch
+
+from admission import RateLimited
+from fetch_menu import get_async_menu_fetcher
+from llm_client import LLMError, async_chat_completion, get_async_client, get_providers, primary_model
+from precomputed_questions import get_precomputed_response
+from response_cache import get_response_cache, make_key
+from suggestion_cache import set_suggestions
+from typing import Any, Coroutine, Dict, List, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# Keeps a reference to the background refresh tasks until they complete
+_background_tasks = set()
+
+
+def run(coroutine: Coroutine) -> Any:
+    """
+    Run a coroutine on the process-wide event loop, reused across Lambda invocations
+    so that the async MongoDB and OpenAI clients (bound to the loop) keep their connections.
+    :param coroutine: coroutine to run.
+    :return: result of the coroutine.
+    """
+    global _loop
+
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coroutine)
+
+
+async def warm_up_client() -> None:
+    """
+    Create (or reuse) the async client of the preferred provider while the menu is being fetched.
+    """
+    provider = get_providers()[0]
+    get_async_client(provider.api_key, provider.base_url)
+
+
+async def async_generate_questions(merchant_id: str, menu_id: str, language: str) -> Dict:
+    """
+    Async version of generate_questions: the menu fetch overlaps with the model client setup
+    and the model is called through the shared AsyncOpenAI clients.
+    :param merchant_id: merchant identifier.
+    :param menu_id: menu identifier (variant ID).
+    :param language: language used for the output.
+    :return: list of generated questions.
+    """
+    menu_data, _ = await asyncio.gather(
+        get_async_menu_fetcher().get_menu_by_id_async(merchant_id, menu_id),
+        warm_up_client(),
+    )
+
+    prepared = questions.prepare_menu_prompt(merchant_id, menu_data, language)
+    if 'error' in prepared:
+        return prepared
+
+    prompt = prepared['prompt']
+    response_cache = get_response_cache()
+    cache_key = make_key(primary_model(), prompt)
+
+    async def call_model(background: bool = False) -> Optional[str]:
+        try:
+            content = await async_chat_completion(questions.SYSTEM_PROMPT, prompt, merchant_id=merchant_id)
+        except (LLMError, RateLimited):
+            # a failed refresh keeps the stale response
+            if background:
+                return None
+            raise
+        if 'error' not in questions.post_process_questions(content):
+            await asyncio.to_thread(response_cache.set, cache_key, content)
+        return content
+
+    # precomputed questions and the persistent tier (SQLite or MongoDB) are blocking: read them in a worker thread
+    fresh = True
+    model_response = await asyncio.to_thread(
+        get_precomputed_response, merchant_id, prepared['menu_id'], language, cache_key
+    )
+    metrics.record_cache("Precomputed", model_response is not None)
+    if model_response is None:
+        model_response, fresh = await asyncio.to_thread(response_cache.get, cache_key)
+    if model_response is None:
+        try:
+            model_response = await call_model()
+        except LLMError as e:
+            return {"error": "No response from model", "details": str(e)}
+    elif not fresh:
+        # stale-while-revalidate
+        task = asyncio.create_task(call_model(background=True))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    metrics.debug("Model response", model_response)
+
+    return questions.post_process_questions(model_response)
+
+
+async def async_suggest_dishes(merchant_id: str, menu_id: str, language: str, user_preferences: Dict) -> Dict:
+    """
+    Async version of suggest_dishes: the menu fetch overlaps with the model client setup
+    and the model is called through the shared AsyncOpenAI clients.
+    :param merchant_id: Merchant ID.
+    :param menu_id: Menu (variant) ID.
+    :param language: language used for the output.
+    :param user_preferences: User preferences (questions and answers).
+    :return: Full dish objects matching suggestions.
+    """
+    menu_data, _ = await asyncio.gather(
+        get_async_menu_fetcher().get_menu_by_id_async(merchant_id, menu_id),
+        warm_up_client(),
+    )
+
+    prepared = suggestions.prepare_menu_prompt(merchant_id, menu_data, language, user_preferences)
+    if 'error' in prepared:
+        return prepared
+
+    if prepared['prompt'] is None:
+        return {"suggested_dishes": prepared['suggested_dishes']}
+
+    try:
+        model_response = await async_chat_completion(suggestions.SYSTEM_PROMPT, prepared['prompt'],
+                                                    merchant_id=merchant_id)
+    except LLMError as e:
+        return {"error": "No response from model", "details": str(e)}
+
+    metrics.debug("Model response", model_response)
+
+    result = suggestions.post_process_suggestions(prepared['menu'], model_response, prepared['constraints'])
+    if isinstance(result, dict) and 'suggested_dishes' in result:
+        set_suggestions(prepared['cache_key'], result['suggested_dishes'])
+    return result
+
+
+async def async_suggest_dishes_batch(merchant_id: str, menu_id: str, language: str, diners: List[Dict]) -> Dict:
+    """
+    Async version of suggest_dishes_batch.
+    :param merchant_id: Merchant ID.
+    :param menu_id: Menu (variant) ID.
+    :param language: language used for the output.
+    :param diners: List of {"id": optional diner identifier, "user_preferences": {...}}.
+    :return: {"diners": [{"id": ..., "suggested_dishes": [...]}, ...]}.
+    """
+    menu_data, _ = await asyncio.gather(
+        get_async_menu_fetcher().get_menu_by_id_async(merchant_id, menu_id),
+        warm_up_client(),
+    )
+
+    prepared = batch.prepare_batch_prompt(merchant_id, menu_data, language, diners)
+    if 'error' in prepared:
+        return prepared
+
+    model_response = None
+    if prepared['prompt'] is not None:
+        try:
+            model_response = await async_chat_completion(batch.SYSTEM_PROMPT, prepared['prompt'],
+                                                        merchant_id=merchant_id)
+        except LLMError as e:
+            return {"error": "No response from model", "details": str(e)}
+
+    metrics.debug("Model response", model_response)
+
+    return batch.post_process_batch(prepared, model_response)
@@ -0,0 +1,187 @@
+import local_env  # noqa: F401  (loads .env before the settings are read)
+import argparse
+import os
+import threading
+
+from fetch_menu import get_client, get_menu_fetcher, invalidate_menu
+from pymongo.errors import PyMongoError
+from typing import Callable, Dict, List, Optional, Set
+
+# Watch the menu collections from long running processes (stream_server.py, asgi.py) and invalidate the caches
+MENU_CACHE_WATCHER = os.getenv("MENU_CACHE_WATCHER", "false").lower() in ("1", "true", "yes")
+# Rebuild the menus of a changed merchant right away instead of on the next request
+MENU_CACHE_WATCHER_REBUILD = os.getenv("MENU_CACHE_WATCHER_REBUILD", "false").lower() in ("1", "true", "yes")
+# Seconds to wait before reconnecting after a change stream error
+MENU_CACHE_WATCHER_RETRY = float(os.getenv("MENU_CACHE_WATCHER_RETRY", "5"))
+
+WATCHED_COLLECTIONS = ["categories", "menu_variants", "users"]
+
+# Called with the merchant ID (None for every merchant) after its menus are invalidated
+_hooks: List[Callable[[Optional[str]], None]] = []
+
+_watcher: Optional["CacheWatcher"] = None
+_lock = threading.Lock()
+
+
+def register_invalidation_hook(hook: Callable[[Optional[str]], None]) -> None:
+    """
+    Register a function called after the menus of a merchant are invalidated,
+    for caches kept outside the menu cache.
+    :param hook: function receiving the merchant ID (None when every merchant is invalidated).
+    """
+    _hooks.append(hook)
+
+
+class CacheWatcher:
+    """
+    Follows a MongoDB change stream on the collections read by MenuFetcher and invalidates
+    the cached menus (and everything derived from them) of the merchants affected by each change.
+    Change streams need a replica set: a single node one (mongod --replSet rs0) is enough locally.
+    """
+
+    def __init__(self, db, rebuild: bool = MENU_CACHE_WATCHER_REBUILD):
+        """
+        :param db: MongoDB database.
+        :param rebuild: rebuild the menus of a changed merchant right away.
+        """
+        self.db = db
+        self.rebuild = rebuild
+        self.resume_token = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def merchants_for_change(self, change: Dict) -> Optional[Set[str]]:
+        """
+        Map a change event to the affected merchants.
+        :param change: change stream event.
+        :return: merchant IDs (empty if the change is irrelevant), None if every merchant must be invalidated.
+        """
+        collection = change.get("ns", {}).get("coll")
+        operation = change.get("operationType")
+        document_id = change.get("documentKey", {}).get("_id")
+
+        if operation not in ("insert", "update", "replace", "delete"):
+            # drop, rename, invalidate...
+            return None
+
+        if collection == "users":
+            if operation == "update":
+                fields = list(change.get("updateDescription", {}).get("updatedFields", {}))
+                fields += change.get("updateDescription", {}).get("removedFields", [])
+                if not any(field.startswith("merchantInfo") for field in fields):
+                    return set()
+            return {str(document_id)}
+
+        if collection == "menu_variants":
+            document = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+            if document and document.get("merchantID"):
+                return {str(document["merchantID"])}
+            # deleted variant without pre-image: the merchant is unknown
+            return None
+
+        if collection == "categories":
+            if operation == "insert":
+                # not part of a menu until a merchant references it
+                return set()
+            users = self.db["users"].find(
+                {"merchantInfo.categories": {"$in": [str(document_id), document_id]}}, {"_id": 1}
+            )
+            return {str(user["_id"]) for user in users}
+
+        return set()
+
+    def handle_change(self, change: Dict) -> Optional[Set[str]]:
+        """
+        Invalidate (and optionally rebuild) the caches of the merchants affected by a change.
+        :param change: change stream event.
+        :return: invalidated merchant IDs, None if every merchant was invalidated.
+        """
+        merchant_ids = self.merchants_for_change(change)
+
+        if merchant_ids is None:
+            invalidate_menu()
+            for hook in _hooks:
+                hook(None)
+            return None
+
+        for merchant_id in merchant_ids:
+            invalidate_menu(merchant_id)
+            for hook in _hooks:
+                hook(merchant_id)
+            if self.rebuild:
+                try:
+                    get_menu_fetcher().get_menu(merchant_id, use_cache=False)
+                except PyMongoError as e:
+                    print(f"Error while rebuilding the menus of {merchant_id}: {e}")
+        return merchant_ids
+
+    def watch(self) -> None:
+        """
+        Follow the change stream until stop() is called, resuming after errors.
+        Changes missed while disconnected are not replayed if the resume token is lost,
+        so every cache is invalidated when the stream is reopened without it.
+        """
+        pipeline = [{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}}}]
+        while not self._stop.is_set():
+            try:
+                with self.db.watch(pipeline, full_document="updateLookup", resume_after=self.resume_token,
+                                   max_await_time_ms=1000) as stream:
+                    if self.resume_token is None:
+                        invalidate_menu()
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            merchant_ids = self.handle_change(change)
+                            target = "every merchant" if merchant_ids is None else ", ".join(sorted(merchant_ids))
+                            if target:
+                                print(f"Menu cache invalidated for {target} "
+                                      f"({change.get('ns', {}).get('coll')} {change.get('operationType')})")
+                        self.resume_token = stream.resume_token
+            except PyMongoError as e:
+                print(f"Change stream error, reconnecting in {MENU_CACHE_WATCHER_RETRY}s: {e}")
+                self._stop.wait(MENU_CACHE_WATCHER_RETRY)
+
+    def start(self) -> None:
+        """
+        Run watch() in a daemon thread.
+        """
+        self._thread = threading.Thread(target=self.watch, name="menu-cache-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def start_watcher() -> Optional[CacheWatcher]:
+    """
+    Start the process-wide watcher once, if enabled with MENU_CACHE_WATCHER.
+    :return: running watcher, None if disabled.
+    """
+    global _watcher
+
+    if not MENU_CACHE_WATCHER:
+        return None
+
+    with _lock:
+        if _watcher is None:
+            _watcher = CacheWatcher(get_client()[os.getenv("DATABASE_NAME")])
+            _watcher.start()
+        return _watcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow the menu collections and log the invalidated merchants.")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the menus of every changed merchant")
+    args = parser.parse_args()
+
+    watcher = CacheWatcher(get_client()[os.getenv("DATABASE_NAME")], rebuild=args.rebuild)
+    try:
+        watcher.watch()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
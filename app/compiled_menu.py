@@ -0,0 +1,295 @@
+import difflib
+import metrics
+import re
+import sys
+
+from functools import lru_cache
+from fetch_menu import menu_cache
+from preference_filter import (ANIMAL_PRODUCT_INGREDIENTS, FISH_INGREDIENTS, MEAT_INGREDIENTS, DietaryConstraints,
+                               canonical_allergens, contains_any, matching_words, normalize)
+from prompt_encoder import EncodedMenu, count_tokens, encode_dish, encode_menu, encode_verbose_dish
+from response_cache import make_key
+from retrieval import BM25Index, estimate_tokens
+from singleflight import SingleFlight
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# Min similarity (0-1) for a suggested name to be matched to a dish name
+FUZZY_MATCH_CUTOFF = 0.85
+
+_NUMBER = re.compile(r"\d+")
+
+# Words of the vegetarian and vegan exclusions, looked up once per dish when the menu is compiled
+DIET_WORDS = frozenset(MEAT_INGREDIENTS) | frozenset(FISH_INGREDIENTS) | frozenset(ANIMAL_PRODUCT_INGREDIENTS)
+
+# Concurrent requests for a menu that is not compiled yet share one compilation
+_compile_flight = SingleFlight("CompileMenu")
+
+
+def dish_ref(position: int) -> str:
+    """
+    Short per-menu reference of a dish, sent in the prompt instead of the long database id.
+    :param position: position of the dish in the menu (starting from 0).
+    :return: reference (e.g. "d12").
+    """
+    return f"d{position + 1}"
+
+
+def _intern(value: Any) -> Any:
+    # names of ingredients, allergens and categories repeat across the dishes of a menu
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=4096)
+def _diet_terms(ingredient: str) -> FrozenSet[str]:
+    # the same ingredients recur across the dishes (and the menus) of a merchant
+    return frozenset(matching_words(ingredient, DIET_WORDS))
+
+
+class CompiledDish:
+    """
+    A dish of a compiled menu: the fields used by the prompts, the response returned to the client,
+    and everything the pre-filter and the prompt builders would otherwise recompute on every request.
+    """
+
+    __slots__ = (
+        "position", "ref", "id", "name", "description", "ingredients", "allergens", "price", "category",
+        "output", "canonical_allergens", "normalized_texts", "normalized_ingredients", "diet_terms",
+        "line", "ref_line", "line_tokens", "ref_line_tokens", "verbose_tokens", "estimated_tokens",
+    )
+
+    def __init__(self, position: int, item: Dict, category: Dict):
+        """
+        :param position: position of the dish in the menu.
+        :param item: menu item (with its ingredients).
+        :param category: category of the item.
+        """
+        self.position = position
+        self.ref = dish_ref(position)
+        self.id = item.get('id')
+        self.name = item.get('name', '')
+        self.description = item.get('description', '')
+        self.ingredients: Tuple[str, ...] = tuple(
+            _intern(ingredient.get('name', '')) for ingredient in item.get('ingredients', [])
+        )
+        self.allergens: Tuple[str, ...] = tuple(_intern(allergen) for allergen in item.get('allergens', []))
+        self.price = item.get('price')
+        self.category = _intern(category.get('name'))
+
+        # response returned by the suggestion endpoints
+        self.output = {
+            'id': str(item.get('_id')),
+            'name': item.get('name'),
+            'description': item.get('description'),
+            'ingredients': [
+                {'id': str(ingredient.get('_id')), 'name': ingredient.get('name')}
+                for ingredient in item.get('ingredients', [])
+            ],
+            'allergens': item.get('allergens', []),
+            'price': item.get('price'),
+            'categoryId': str(category.get('_id')),
+            'categoryName': category.get('name')
+        }
+
+        self.normalized_ingredients = tuple(normalize(ingredient) for ingredient in self.ingredients)
+        # allergens declared by the dish, and those implied by its ingredients (e.g. "latte", "noci")
+        self.canonical_allergens: FrozenSet[str] = frozenset().union(
+            *(canonical_allergens(text) for text in self.allergens + self.normalized_ingredients)
+        )
+        self.normalized_texts = tuple(normalize(allergen) for allergen in self.allergens) + self.normalized_ingredients
+        self.diet_terms: FrozenSet[str] = frozenset().union(
+            *(_diet_terms(ingredient) for ingredient in self.normalized_ingredients)
+        )
+        self.estimated_tokens = estimate_tokens(self)
+
+    def encode(self, allergen_codes: Dict[str, str]) -> None:
+        """
+        Render the prompt lines of the dish (with and without ref) and count their tokens.
+        :param allergen_codes: allergen -> short code, shared by the whole menu.
+        """
+        codes = [allergen_codes[allergen] for allergen in self.allergens if allergen in allergen_codes]
+        self.line = encode_dish(self.name, self.description, self.ingredients, codes)
+        self.ref_line = encode_dish(self.name, self.description, self.ingredients, codes, self.ref)
+        self.line_tokens = count_tokens(self.line)
+        self.ref_line_tokens = count_tokens(self.ref_line)
+        self.verbose_tokens = count_tokens(
+            encode_verbose_dish(self.name, self.description, self.ingredients, self.allergens)
+        )
+
+    def is_compatible(self, constraints: DietaryConstraints) -> bool:
+        """
+        Check the dish against the constraints.
+        :param constraints: dietary constraints.
+        :return: True if the dish can be suggested.
+        """
+        if constraints.allergens and self.canonical_allergens & constraints.allergens:
+            return False
+
+        if constraints.allergen_terms:
+            for text in self.normalized_texts:
+                if contains_any(text, constraints.allergen_terms):
+                    return False
+
+        if constraints.excluded_ingredients:
+            if constraints.excluded_ingredients <= DIET_WORDS:
+                return not self.diet_terms & constraints.excluded_ingredients
+            for ingredient in self.normalized_ingredients:
+                if contains_any(ingredient, constraints.excluded_ingredients):
+                    return False
+
+        return True
+
+
+class CompiledMenu:
+    """
+    Menu compiled once per version and shared by the prompt builders and the post-processing:
+    a table of dishes numbered in menu order (see dish_ref) with their prompt lines,
+    and the lookup indexes from the suggestions of the model (dish refs, ids or names) to the dishes.
+    """
+
+    def __init__(self, menu_data: Dict):
+        """
+        :param menu_data: Menu data (JSON structure).
+        """
+        self.menu_data = menu_data
+        self.id = menu_data.get('id')
+        self.dishes: List[CompiledDish] = []
+        self.by_key: Dict[str, int] = {}
+        self.by_name: Dict[str, int] = {}
+        self.names: List[str] = []
+        self._retrieval_index: Optional[BM25Index] = None
+        self._encoded: Dict[bool, EncodedMenu] = {}
+        self._content_hash: Optional[str] = None
+
+        for category in menu_data.get('categories', []):
+            for item in category.get('items', []):
+                position = len(self.dishes)
+                dish = CompiledDish(position, item, category)
+                self.dishes.append(dish)
+
+                self.by_key[dish.ref] = position
+                for key in (item.get('_id'), item.get('id')):
+                    if key is not None:
+                        self.by_key.setdefault(str(key), position)
+
+                name = normalize(item.get('name') or '')
+                if name and name not in self.by_name:
+                    self.by_name[name] = position
+                    self.names.append(name)
+
+        # allergen codes are numbered once for the menu, so a dish line is the same in every prompt
+        self.allergen_codes: Dict[str, str] = {}
+        for dish in self.dishes:
+            for allergen in dish.allergens:
+                if allergen and allergen not in self.allergen_codes:
+                    self.allergen_codes[allergen] = f"A{len(self.allergen_codes) + 1}"
+        self.legend_tokens = {
+            allergen: count_tokens(f"{code}={allergen}, ") for allergen, code in self.allergen_codes.items()
+        }
+        self.header_tokens: Dict[Optional[str], int] = {}
+        for dish in self.dishes:
+            dish.encode(self.allergen_codes)
+            if dish.category not in self.header_tokens:
+                self.header_tokens[dish.category] = count_tokens(f"## {dish.category}") + 1
+
+    def find(self, suggestion: str) -> Optional[int]:
+        """
+        Find the position of the dish matching a suggestion: ref or id first, then the normalized name,
+        then a similar name, only when it is the only one above FUZZY_MATCH_CUTOFF and has the same numbers
+        ("Pizza 12" never resolves to "Pizza 13").
+        :param suggestion: dish ref, id or name returned by the model.
+        :return: position of the dish, None if nothing matches.
+        """
+        suggestion = str(suggestion).strip().strip('#[]')
+        position = self.by_key.get(suggestion)
+        if position is not None:
+            return position
+
+        name = normalize(suggestion)
+        position = self.by_name.get(name)
+        if position is not None:
+            return position
+
+        matches = difflib.get_close_matches(name, self.names, n=2, cutoff=FUZZY_MATCH_CUTOFF)
+        if len(matches) != 1 or _NUMBER.findall(matches[0]) != _NUMBER.findall(name):
+            return None
+        return self.by_name[matches[0]]
+
+    def resolve(self, suggestions: List[str], constraints: Optional[DietaryConstraints] = None) -> List[Dict]:
+        """
+        Resolve the suggestions to complete dishes, in suggestion order and without duplicates.
+        :param suggestions: dish refs, ids or names.
+        :param constraints: Dietary constraints, incompatible dishes are skipped.
+        :return: List of complete dishes (with all original fields).
+        """
+        resolved = []
+        seen = set()
+        for suggestion in suggestions:
+            position = self.find(suggestion)
+            if position is None or position in seen:
+                continue
+            seen.add(position)
+
+            dish = self.dishes[position]
+            if constraints and not dish.is_compatible(constraints):
+                continue
+            resolved.append(dish.output)
+        return resolved
+
+    def compatible_dishes(self, constraints: DietaryConstraints) -> List[CompiledDish]:
+        """
+        Drop the dishes that are incompatible with the constraints.
+        :param constraints: dietary constraints.
+        :return: compatible dishes, in menu order.
+        """
+        if constraints.is_empty():
+            return self.dishes
+        return [dish for dish in self.dishes if dish.is_compatible(constraints)]
+
+    def retrieval_index(self) -> BM25Index:
+        """
+        :return: BM25 index of the dishes, built on first use.
+        """
+        if self._retrieval_index is None:
+            self._retrieval_index = BM25Index(self.dishes)
+        return self._retrieval_index
+
+    def content_hash(self) -> str:
+        """
+        :return: hash of the menu content, computed on first use.
+        """
+        if self._content_hash is None:
+            self._content_hash = make_key(self.menu_data)
+        return self._content_hash
+
+    def encoded(self, include_refs: bool = False) -> EncodedMenu:
+        """
+        :param include_refs: prefix every dish with its ref.
+        :return: every dish of the menu encoded for a prompt, built on first use.
+        """
+        encoded_menu = self._encoded.get(include_refs)
+        if encoded_menu is None:
+            encoded_menu = self._encoded[include_refs] = encode_menu(self, include_refs=include_refs)
+        return encoded_menu
+
+
+def get_compiled_menu(merchant_id: str, menu_data: Dict) -> CompiledMenu:
+    """
+    Return the compiled menu, built once per menu version and kept in the menu cache.
+    :param merchant_id: merchant identifier.
+    :param menu_data: menu returned by MenuFetcher.get_menu_by_id.
+    :return: compiled menu.
+    """
+    cache_key = ("compiled", merchant_id, menu_data.get('id'))
+    compiled = menu_cache.get(cache_key)
+    hit = compiled is not None and compiled.menu_data is menu_data
+    metrics.record_cache("CompiledMenu", hit)
+    if hit:
+        return compiled
+
+    def compile_menu() -> CompiledMenu:
+        with metrics.stage("CompileMenu"):
+            compiled_menu = CompiledMenu(menu_data)
+        menu_cache.set(cache_key, compiled_menu)
+        return compiled_menu
+
+    return _compile_flight.do((cache_key, id(menu_data)), compile_menu)
@@ -1,25 +1,356 @@
-from pymongo import MongoClient
-from typing import Dict, List, Optional
+from cache import TTLCache
+from singleflight import AsyncSingleFlight, SingleFlight
+from pymongo import ASCENDING, AsyncMongoClient, MongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+from typing import Dict, List, Optional, Tuple
 from bson import ObjectId
+import asyncio
+import metrics
 import os
+import threading
+import time
+
+# Configurazione del pool di connessioni (condiviso tra le invocazioni "warm" della Lambda)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "10"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+# Intervallo minimo (in secondi) tra due health check del client condiviso
+MONGO_HEALTH_CHECK_INTERVAL = float(os.getenv("MONGO_HEALTH_CHECK_INTERVAL", "30"))
+
+# Cache dei menu (chiavi: ("menus", merchant_id) e ("compiled", merchant_id, menu_id), vedi compiled_menu.py)
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "300"))
+MENU_CACHE_MAX_SIZE = int(os.getenv("MENU_CACHE_MAX_SIZE", "256"))
+menu_cache = TTLCache(max_size=MENU_CACHE_MAX_SIZE, ttl=MENU_CACHE_TTL)
+# Letture concorrenti dello stesso merchant (es. QR code su ogni tavolo) condividono un'unica query
+_menu_flight = SingleFlight("MenuFetch")
+_async_menu_flight = AsyncSingleFlight("MenuFetch")
+
+# Modalità di lettura del menu: "queries" (tre query in serie) o "aggregate" (una sola aggregazione $lookup,
+# MongoDB 5.0+). Se il server rifiuta l'aggregazione si torna alle query separate.
+FETCH_MODE_AGGREGATE = "aggregate"
+FETCH_MODE_QUERIES = "queries"
+MENU_FETCH_MODE = os.getenv("MENU_FETCH_MODE", FETCH_MODE_QUERIES)
+
+# Verifica degli indici all'avvio: "off", "verify" (log degli indici mancanti) o "create"
+MONGO_INDEXES_CHECK = os.getenv("MONGO_INDEXES_CHECK", "off")
+
+# Indici richiesti dalle query di MenuFetcher (categories e users sono letti per _id)
+REQUIRED_INDEXES = {
+    "menu_variants": [[("merchantID", ASCENDING)]],
+}
+
+# Campi delle categorie letti da prompt, costruzione delle varianti e post_process_suggestions
+CATEGORY_PROJECTION = {
+    "_id": 1,
+    "name": 1,
+    "variants": 1,
+    "items._id": 1,
+    "items.id": 1,
+    "items.name": 1,
+    "items.description": 1,
+    "items.ingredients._id": 1,
+    "items.ingredients.name": 1,
+    "items.allergens": 1,
+    "items.price": 1,
+    "items.variants": 1,
+}
+
+# Per ogni categoria: (ID varianti della categoria, ID varianti di ciascun item)
+VariantMembership = List[Tuple[Dict[str, None], List[Dict[str, None]]]]
+
+_client: Optional[MongoClient] = None
+_client_checked_at = 0.0
+_fetcher: Optional["MenuFetcher"] = None
+_indexes_checked = False
+_lock = threading.Lock()
+
+
+def _create_client() -> MongoClient:
+    """
+    Crea un nuovo MongoClient con la configurazione del pool.
+    :return: Client MongoDB.
+    """
+    return MongoClient(
+        os.getenv("MONGO_URI"),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        retryReads=True,
+    )
+
+
+def _is_healthy(client: MongoClient) -> bool:
+    """
+    Verifica che il client sia ancora in grado di raggiungere il server.
+    :param client: Client MongoDB.
+    :return: True se il ping ha successo.
+    """
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError as e:
+        print(f"MongoDB health check failed: {e}")
+        return False
+
+
+def _close_client_locked() -> None:
+    """
+    Chiude il client condiviso (da chiamare con _lock acquisito).
+    """
+    global _client, _fetcher
+
+    if _client is not None:
+        try:
+            _client.close()
+        except PyMongoError:
+            pass
+    _client = None
+    _fetcher = None
+
+
+def get_client() -> MongoClient:
+    """
+    Restituisce il MongoClient condiviso a livello di processo, creandolo alla prima chiamata.
+    Il client viene verificato con un ping al massimo ogni MONGO_HEALTH_CHECK_INTERVAL secondi
+    e ricreato se non risponde.
+    :return: Client MongoDB condiviso.
+    """
+    global _client, _client_checked_at
+
+    with _lock:
+        now = time.monotonic()
+        if _client is None:
+            _client = _create_client()
+            _client_checked_at = now
+        elif now - _client_checked_at >= MONGO_HEALTH_CHECK_INTERVAL:
+            _client_checked_at = now
+            if not _is_healthy(_client):
+                _close_client_locked()
+                _client = _create_client()
+        return _client
+
+
+def reset_client() -> None:
+    """
+    Chiude il client condiviso: la prossima chiamata a get_client() ne crea uno nuovo.
+    """
+    with _lock:
+        _close_client_locked()
+
+
+def get_menu_fetcher() -> "MenuFetcher":
+    """
+    Restituisce il MenuFetcher condiviso a livello di processo (riutilizzato tra le invocazioni).
+    :return: MenuFetcher che usa il client condiviso.
+    """
+    global _fetcher, _indexes_checked
+
+    client = get_client()
+    with _lock:
+        if _fetcher is None or _fetcher.client is not client:
+            _fetcher = MenuFetcher(client)
+        fetcher = _fetcher
+
+    if not _indexes_checked and MONGO_INDEXES_CHECK in ("verify", "create"):
+        _indexes_checked = True
+        try:
+            missing = ensure_indexes(fetcher.db, create=MONGO_INDEXES_CHECK == "create")
+            if missing:
+                print(f"Missing MongoDB indexes: {', '.join(missing)}")
+        except PyMongoError as e:
+            print(f"Error while checking MongoDB indexes: {e}")
+
+    return fetcher
+
+
+def invalidate_menu(merchant_id: Optional[str] = None) -> int:
+    """
+    Invalida i menu in cache di un merchant (o di tutti i merchant se merchant_id è None).
+    :param merchant_id: ID del merchant.
+    :return: Numero di elementi rimossi dalla cache.
+    """
+    if merchant_id is None:
+        return menu_cache.invalidate()
+    return menu_cache.invalidate_where(lambda key: key[1] == merchant_id)
+
+
+def with_items(category: Dict, items: List[Dict]) -> Dict:
+    """
+    Categoria con gli item filtrati di una variante. Se nessun item è stato escluso la categoria
+    viene riusata così com'è, condivisa da tutte le varianti invece di essere copiata per ciascuna.
+    :param category: Categoria con tutti gli item.
+    :param items: Item della categoria inclusi nella variante.
+    :return: Categoria della variante.
+    """
+    if "items" in category and len(items) == len(category["items"]):
+        return category
+    return {**category, "items": items}
+
+
+def menu_documents_pipeline(merchant_id: str) -> List[Dict]:
+    """
+    Pipeline di aggregazione (sulla collezione users) che legge in un solo round trip
+    gli ID delle categorie del merchant, le categorie proiettate e le varianti del menu.
+    :param merchant_id: ID del merchant.
+    :return: Pipeline di aggregazione.
+    """
+    return [
+        {"$match": {"_id": ObjectId(merchant_id)}},
+        {"$project": {
+            "categoryIds": {
+                "$map": {
+                    "input": {"$ifNull": ["$merchantInfo.categories", []]},
+                    "in": {"$toObjectId": "$$this"}
+                }
+            }
+        }},
+        {"$lookup": {
+            "from": "categories",
+            "localField": "categoryIds",
+            "foreignField": "_id",
+            "pipeline": [{"$project": CATEGORY_PROJECTION}],
+            "as": "categories"
+        }},
+        {"$lookup": {
+            "from": "menu_variants",
+            "pipeline": [{"$match": {"merchantID": merchant_id}}],
+            "as": "menuVariants"
+        }},
+    ]
+
+
+def parse_menu_documents(result: Optional[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Estrae categorie (nell'ordine di merchantInfo.categories) e varianti dal risultato di menu_documents_pipeline.
+    :param result: Documento restituito dall'aggregazione (None se il merchant non esiste).
+    :return: Tupla (categorie, varianti).
+    """
+    if not result:
+        return [], []
+
+    categories = sort_by_ids(result.get("categories", []), result.get("categoryIds", []))
+    return categories, result.get("menuVariants", [])
+
+
+def sort_by_ids(documents: List[Dict], ids: List) -> List[Dict]:
+    """
+    Ordina i documenti secondo l'ordine degli ID ($in non preserva l'ordine).
+    :param documents: Documenti con campo _id.
+    :param ids: ID nell'ordine desiderato.
+    :return: Documenti ordinati.
+    """
+    positions = {str(id): position for position, id in enumerate(ids)}
+    return sorted(documents, key=lambda document: positions.get(str(document.get("_id")), len(positions)))
+
+
+def get_variant_ids(entity: Dict) -> Dict[str, None]:
+    """
+    Restituisce gli ID delle varianti referenziate da una categoria o da un item.
+    :param entity: Categoria o item.
+    :return: ID delle varianti (dict usato come insieme ordinato).
+    """
+    return dict.fromkeys(variant["id"] for variant in entity.get("variants") or [] if variant)
+
+
+def ensure_indexes(db, create: bool = False) -> List[str]:
+    """
+    Verifica (ed eventualmente crea) gli indici richiesti da MenuFetcher.
+    :param db: Database MongoDB.
+    :param create: se True crea gli indici mancanti.
+    :return: Lista degli indici mancanti (prima della creazione).
+    """
+    missing = []
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = [index["key"] for index in collection.index_information().values()]
+        for keys in indexes:
+            if keys in existing:
+                continue
+            missing.append(f"{collection_name}.{','.join(field for field, _ in keys)}")
+            if create:
+                collection.create_index(keys)
+    return missing
+
 
 class MenuFetcher:
-    def __init__(self):
+    def __init__(self, client: Optional[MongoClient] = None, fetch_mode: Optional[str] = None):
         """
         Inizializza il client MongoDB e le collezioni necessarie.
+        :param client: Client MongoDB da usare (di default quello condiviso del processo).
+        :param fetch_mode: "aggregate" (una sola aggregazione) o "queries" (tre query separate).
         """
-        self.client = MongoClient(os.getenv("MONGO_URI"))
+        self.fetch_mode = fetch_mode or MENU_FETCH_MODE
+        self.client = client if client is not None else get_client()
         self.db = self.client[os.getenv("DATABASE_NAME")]
         self.categories_collection = self.db["categories"]  # Collezione delle categorie
         self.menu_variants_collection = self.db["menu_variants"]  # Collezione delle varianti del menu
         self.users_collection = self.db["users"]  # Collezione degli utenti (merchant)
 
-    def get_menu(self, merchant_id: str) -> List[Dict]:
+    def get_menu(self, merchant_id: str, use_cache: bool = True) -> List[Dict]:
         """
         Recupera il menu in base a MerchantID, gestendo le varianti.
+        I menu costruiti vengono salvati in cache (TTL + LRU) per merchant; le richieste concorrenti
+        dello stesso merchant attendono la lettura già in corso invece di ripeterla.
+        In caso di errore di connessione il client condiviso viene ricreato e la lettura ritentata una volta.
         :param merchant_id: ID del merchant.
+        :param use_cache: se False il menu viene sempre riletto dal database.
         :return: Lista di menu (uno per variante o un singolo menu se non ci sono varianti).
         """
+        cache_key = ("menus", merchant_id)
+        if not use_cache:
+            return self._fetch_menus(merchant_id)
+
+        menus = menu_cache.get(cache_key)
+        metrics.record_cache("Menu", menus is not None)
+        if menus is not None:
+            return menus
+        return _menu_flight.do(cache_key, lambda: self._fetch_menus(merchant_id))
+
+    def _fetch_menus(self, merchant_id: str) -> List[Dict]:
+        with metrics.stage("MenuFetch"):
+            try:
+                menus = self._get_menu(merchant_id)
+            except ConnectionFailure as e:
+                print(f"MongoDB connection error, reconnecting: {e}")
+                reset_client()
+                menus = get_menu_fetcher()._get_menu(merchant_id)
+
+        if menus:
+            menu_cache.set(("menus", merchant_id), menus)
+        return menus
+
+    def get_menu_by_id(self, merchant_id: str, menu_id: Optional[str]) -> Optional[Dict]:
+        """
+        Recupera un singolo menu (variante) del merchant.
+        :param merchant_id: ID del merchant.
+        :param menu_id: ID della variante; se assente o se esiste un solo menu viene restituito il primo.
+        :return: Menu selezionato, None se non trovato.
+        """
+        menus = self.get_menu(merchant_id)
+
+        if not menus:
+            return None
+
+        if len(menus) == 1 or not menu_id:
+            return menus[0]
+
+        return next((menu for menu in menus if menu.get('id') == menu_id), None)
+
+    def _get_menu(self, merchant_id: str) -> List[Dict]:
+        if self.fetch_mode == FETCH_MODE_AGGREGATE:
+            try:
+                # Utente, categorie e varianti in un'unica aggregazione
+                categories, menu_variants = self.get_menu_documents(merchant_id)
+                return self.build_menus(categories, menu_variants)
+            except OperationFailure as e:
+                self.disable_aggregate(e)
+
         # Recupera le categorie del merchant
         categories = self.get_categories_for_menu_by_user_id(merchant_id)
 
@@ -29,14 +360,38 @@ class MenuFetcher:
         # Recupera le varianti del menu
         menu_variants = self.get_variants_list(merchant_id)
 
+        return self.build_menus(categories, menu_variants)
+
+    def disable_aggregate(self, error: OperationFailure) -> None:
+        """
+        Passa alle query separate quando il server non supporta l'aggregazione
+        ($lookup con localField e pipeline richiede MongoDB 5.0+, oltre a $toObjectId).
+        :param error: errore restituito dal server.
+        """
+        print(f"Menu aggregation not supported by the server, using separate queries: {error}")
+        self.fetch_mode = FETCH_MODE_QUERIES
+
+    def build_menus(self, categories: List[Dict], menu_variants: List[Dict]) -> List[Dict]:
+        """
+        Costruisce i menu (uno per variante) a partire dalle categorie e dalle varianti del merchant.
+        :param categories: Lista di categorie.
+        :param menu_variants: Lista di varianti del menu.
+        :return: Lista di menu.
+        """
+        if not categories:
+            return []
+
+        # Indicizza le varianti di categorie e item in un solo passaggio
+        variant_ids, membership = self.get_variant_membership(categories)
+
         # Trova le varianti dalle categorie
-        variants_from_categories = self.get_variants_from_categories(categories, menu_variants)
+        variants_from_categories = self.get_variants_from_categories(categories, menu_variants, variant_ids)
 
         # Gestione delle varianti
         if len(variants_from_categories) >= 2:
             # Restituisci un menu per ogni variante
             return [
-                self.build_menu_for_variant(categories, variant)
+                self.build_menu_for_variant(categories, variant, membership)
                 for variant in variants_from_categories
             ]
         elif len(variants_from_categories) == 1:
@@ -44,20 +399,31 @@ class MenuFetcher:
             variant = variants_from_categories[0]
             other_variant = self.get_other_variant(menu_variants, variants_from_categories)
             return [
-                self.build_menu_for_variant(categories, variant),
+                self.build_menu_for_variant(categories, variant, membership),
                 self.build_menu_for_other_variant(categories, other_variant)
             ]
         else:
             # Restituisci un singolo menu senza varianti
             return [self.build_default_menu(categories)]
 
+    def get_menu_documents(self, merchant_id: str) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Recupera categorie e varianti del merchant con una sola aggregazione sulla collezione users.
+        Le categorie sono proiettate sui soli campi usati da prompt e post-processing
+        e restituite nell'ordine di merchantInfo.categories.
+        :param merchant_id: ID del merchant.
+        :return: Tupla (categorie, varianti).
+        """
+        result = next(self.users_collection.aggregate(menu_documents_pipeline(merchant_id)), None)
+        return parse_menu_documents(result)
+
     def get_categories_for_menu_by_user_id(self, merchant_id: str) -> List[Dict]:
         """
         Recupera le categorie per il menu in base a MerchantID.
         :param merchant_id: ID del merchant.
         :return: Lista di categorie.
         """
-        user = self.users_collection.find_one({"_id": ObjectId(merchant_id)})
+        user = self.users_collection.find_one({"_id": ObjectId(merchant_id)}, {"merchantInfo.categories": 1})
 
         if not user:
             return []
@@ -77,7 +443,7 @@ class MenuFetcher:
 
         # Recupera le categorie dal database
         categories = self.categories_collection.find({"_id": {"$in": [ObjectId(id) for id in category_ids]}})
-        return list(categories)
+        return sort_by_ids(list(categories), category_ids)
 
     def get_variants_list(self, merchant_id: str) -> List[Dict]:
         """
@@ -90,27 +456,47 @@ class MenuFetcher:
 
         return list(self.menu_variants_collection.find({"merchantID": merchant_id}))
 
-    def get_variants_from_categories(self, categories: List[Dict], menu_variants: List[Dict]) -> List[Dict]:
+    def get_variant_membership(self, categories: List[Dict]) -> Tuple[List[str], VariantMembership]:
         """
-        Estrae le varianti dalle categorie e dagli item.
+        Indicizza in un solo passaggio le varianti referenziate da categorie e item.
         :param categories: Lista di categorie.
-        :param menu_variants: Lista di varianti del menu.
-        :return: Lista di varianti.
+        :return: Tupla (ID delle varianti senza duplicati, nell'ordine in cui compaiono;
+                 per ogni categoria la coppia (ID varianti della categoria, ID varianti di ciascun item)).
         """
-        variants = []
+        variant_ids = {}
+        membership = []
         for category in categories:
-            if category.get("variants"):
-                variants.extend(category["variants"])
+            category_variant_ids = get_variant_ids(category)
+            variant_ids.update(category_variant_ids)
+
+            items_variant_ids = []
             for item in category.get("items", []):
-                if item.get("variants"):
-                    variants.extend(item["variants"])
+                item_variant_ids = get_variant_ids(item)
+                variant_ids.update(item_variant_ids)
+                items_variant_ids.append(item_variant_ids)
 
-        # Filtra e mappa le varianti
-        return [
-            next((mv for mv in menu_variants if mv["id"] == variant["id"]), None)
-            for variant in variants
-            if variant
-        ]
+            membership.append((category_variant_ids, items_variant_ids))
+
+        return list(variant_ids), membership
+
+    def get_variants_from_categories(self, categories: List[Dict], menu_variants: List[Dict],
+                                     variant_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Estrae le varianti dalle categorie e dagli item.
+        :param categories: Lista di categorie.
+        :param menu_variants: Lista di varianti del menu.
+        :param variant_ids: ID delle varianti già indicizzati con get_variant_membership (opzionale).
+        :return: Lista di varianti (senza duplicati e senza riferimenti a varianti inesistenti).
+        """
+        if variant_ids is None:
+            variant_ids, _ = self.get_variant_membership(categories)
+
+        # Indice id -> variante (a parità di id vale la prima, come nella ricerca lineare)
+        variants_by_id = {}
+        for menu_variant in menu_variants:
+            variants_by_id.setdefault(menu_variant.get("id"), menu_variant)
+
+        return [variants_by_id[variant_id] for variant_id in variant_ids if variant_id in variants_by_id]
 
     def get_other_variant(self, menu_variants: List[Dict], variants_from_categories: List[Dict]) -> Dict:
         """
@@ -119,31 +505,34 @@ class MenuFetcher:
         :param variants_from_categories: Lista di varianti dalle categorie.
         :return: Variante "Altro".
         """
-        variants_list = [mv for mv in menu_variants if not any(v["id"] == mv["id"] for v in variants_from_categories)]
-        return variants_list[0] if variants_list else {"id": "other", "name": "Altro"}
+        used_ids = {v["id"] for v in variants_from_categories}
+        return next((mv for mv in menu_variants if mv.get("id") not in used_ids), {"id": "other", "name": "Altro"})
 
-    def build_menu_for_variant(self, categories: List[Dict], variant: Dict) -> Dict:
+    def build_menu_for_variant(self, categories: List[Dict], variant: Dict,
+                               membership: Optional[VariantMembership] = None) -> Dict:
         """
         Costruisce il menu per una specifica variante.
         :param categories: Lista di categorie.
         :param variant: Variante selezionata.
+        :param membership: Varianti di categorie e item calcolate con get_variant_membership (opzionale).
         :return: Dati del menu per la variante.
         """
+        if membership is None:
+            _, membership = self.get_variant_membership(categories)
+
+        variant_id = variant["id"]
         return {
             "id": variant["id"],
             "name": variant["name"],
             "image": variant.get("image"),
             "description": variant.get("description"),
             "categories": [
-                {
-                    **category,
-                    "items": [
-                        item for item in category.get("items", [])
-                        if not item.get("variants") or any(v["id"] == variant["id"] for v in item["variants"])
-                    ]
-                }
-                for category in categories
-                if not category.get("variants") or any(v["id"] == variant["id"] for v in category["variants"])
+                with_items(category, [
+                    item for item, item_variant_ids in zip(category.get("items", []), items_variant_ids)
+                    if not item_variant_ids or variant_id in item_variant_ids
+                ])
+                for category, (category_variant_ids, items_variant_ids) in zip(categories, membership)
+                if not category_variant_ids or variant_id in category_variant_ids
             ]
         }
 
@@ -160,13 +549,10 @@ class MenuFetcher:
             "image": other_variant.get("image"),
             "description": other_variant.get("description"),
             "categories": [
-                {
-                    **category,
-                    "items": [
-                        item for item in category.get("items", [])
-                        if not item.get("variants") or len(item["variants"]) == 0
-                    ]
-                }
+                with_items(category, [
+                    item for item in category.get("items", [])
+                    if not item.get("variants") or len(item["variants"]) == 0
+                ])
                 for category in categories
                 if not category.get("variants") or len(category["variants"]) == 0
             ]
@@ -183,3 +569,138 @@ class MenuFetcher:
             "name": "Menu",
             "categories": categories
         }
+
+
+class AsyncMenuFetcher(MenuFetcher):
+    """
+    Versione asincrona di MenuFetcher (pymongo AsyncMongoClient): le query indipendenti vengono eseguite in parallelo.
+    La costruzione dei menu e la cache sono condivise con MenuFetcher.
+    """
+
+    def __init__(self, client: AsyncMongoClient, fetch_mode: Optional[str] = None):
+        """
+        Inizializza il client MongoDB asincrono e le collezioni necessarie.
+        :param client: Client MongoDB asincrono.
+        :param fetch_mode: "aggregate" (una sola aggregazione) o "queries" (query separate).
+        """
+        self.fetch_mode = fetch_mode or MENU_FETCH_MODE
+        self.client = client
+        self.db = self.client[os.getenv("DATABASE_NAME")]
+        self.categories_collection = self.db["categories"]
+        self.menu_variants_collection = self.db["menu_variants"]
+        self.users_collection = self.db["users"]
+
+    async def get_menu_async(self, merchant_id: str, use_cache: bool = True) -> List[Dict]:
+        """
+        Recupera il menu in base a MerchantID (vedi MenuFetcher.get_menu).
+        :param merchant_id: ID del merchant.
+        :param use_cache: se False il menu viene sempre riletto dal database.
+        :return: Lista di menu.
+        """
+        cache_key = ("menus", merchant_id)
+        if not use_cache:
+            return await self._fetch_menus_async(merchant_id)
+
+        menus = menu_cache.get(cache_key)
+        metrics.record_cache("Menu", menus is not None)
+        if menus is not None:
+            return menus
+        return await _async_menu_flight.do(cache_key, lambda: self._fetch_menus_async(merchant_id))
+
+    async def _fetch_menus_async(self, merchant_id: str) -> List[Dict]:
+        with metrics.stage("MenuFetch"):
+            try:
+                menus = await self._get_menu_async(merchant_id)
+            except ConnectionFailure as e:
+                print(f"MongoDB connection error, reconnecting: {e}")
+                await reset_async_client()
+                menus = await get_async_menu_fetcher()._get_menu_async(merchant_id)
+
+        if menus:
+            menu_cache.set(("menus", merchant_id), menus)
+        return menus
+
+    async def _get_menu_async(self, merchant_id: str) -> List[Dict]:
+        categories = menu_variants = None
+        if self.fetch_mode == FETCH_MODE_AGGREGATE:
+            try:
+                cursor = await self.users_collection.aggregate(menu_documents_pipeline(merchant_id))
+                results = await cursor.to_list(1)
+                categories, menu_variants = parse_menu_documents(results[0] if results else None)
+            except OperationFailure as e:
+                self.disable_aggregate(e)
+        if categories is None:
+            # Utente e varianti non dipendono l'uno dall'altro: lette in parallelo
+            user, menu_variants = await asyncio.gather(
+                self.users_collection.find_one({"_id": ObjectId(merchant_id)}, {"merchantInfo.categories": 1}),
+                self.menu_variants_collection.find({"merchantID": merchant_id}).to_list(None),
+            )
+            category_ids = (user or {}).get("merchantInfo", {}).get("categories", [])
+            categories = []
+            if category_ids:
+                categories = sort_by_ids(
+                    await self.categories_collection.find(
+                        {"_id": {"$in": [ObjectId(id) for id in category_ids]}}
+                    ).to_list(None),
+                    category_ids
+                )
+
+        return self.build_menus(categories, menu_variants)
+
+    async def get_menu_by_id_async(self, merchant_id: str, menu_id: Optional[str]) -> Optional[Dict]:
+        """
+        Recupera un singolo menu (variante) del merchant (vedi MenuFetcher.get_menu_by_id).
+        :param merchant_id: ID del merchant.
+        :param menu_id: ID della variante.
+        :return: Menu selezionato, None se non trovato.
+        """
+        menus = await self.get_menu_async(merchant_id)
+
+        if not menus:
+            return None
+
+        if len(menus) == 1 or not menu_id:
+            return menus[0]
+
+        return next((menu for menu in menus if menu.get('id') == menu_id), None)
+
+
+_async_fetcher: Optional[AsyncMenuFetcher] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_menu_fetcher() -> AsyncMenuFetcher:
+    """
+    Restituisce l'AsyncMenuFetcher condiviso, legato all'event loop corrente (ricreato se il loop cambia).
+    :return: AsyncMenuFetcher.
+    """
+    global _async_fetcher, _async_loop
+
+    loop = asyncio.get_running_loop()
+    if _async_fetcher is None or _async_loop is not loop:
+        client = AsyncMongoClient(
+            os.getenv("MONGO_URI"),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        )
+        _async_fetcher = AsyncMenuFetcher(client)
+        _async_loop = loop
+    return _async_fetcher
+
+
+async def reset_async_client() -> None:
+    """
+    Chiude il client asincrono condiviso: la prossima chiamata a get_async_menu_fetcher() ne crea uno nuovo.
+    """
+    global _async_fetcher
+
+    fetcher, _async_fetcher = _async_fetcher, None
+    if fetcher is not None:
+        try:
+            await fetcher.client.close()
+        except PyMongoError:
+            pass
@@ -1,20 +1,17 @@
-import os
 import json
-
-from fetch_menu import MenuFetcher
-from openai import OpenAI
-from dotenv import load_dotenv
-from typing import List, Optional, Literal, Dict, Union, Any
+import metrics
+
+from admission import RateLimited, retry_after_seconds
+from compiled_menu import CompiledMenu, get_compiled_menu
+from fetch_menu import get_menu_fetcher
+from llm_client import LLMError, chat_completion, primary_model, stream_completion
+from precomputed_questions import get_precomputed_response
+from response_cache import get_response_cache, make_key
+from streaming import JsonArrayStreamParser
+from typing import Iterator, List, Optional, Literal, Dict, Union, Any
 from pydantic import BaseModel, ValidationError
 
-load_dotenv()
-
-OPENAI_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-# OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-API_BASE_URL = "https://api.deepseek.com"
-# API_BASE_URL = "https://api.openai.com/v1"
-API_MODEL = "deepseek-chat"
-# API_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "You are a helpful assistant that generates user questions based on menu data."
 
 class Question(BaseModel):
     question: str
@@ -32,111 +29,147 @@ def generate_questions(merchant_id: str, menu_id: str, language: str,) -> Dict:
     :param language: language used for the output.
     :return: list of generated questions.
     """
-    # 1. Fetch menu from MongoDB
-    menu_fetcher = MenuFetcher()
-    menu_data = menu_fetcher.get_menu(merchant_id)
-
-    if not menu_data or len(menu_data) == 0:
-        return {"error": "Menu not found"}
+    # 1-3. Fetch, compile and prompt preparation
+    prepared = prepare_prompt(merchant_id, menu_id, language)
+
+    if 'error' in prepared:
+        return prepared
+
+    prompt = prepared['prompt']
+
+    # 4. Integration with the model (questions precomputed offline, else responses cached by prompt content)
+    cache_key = make_key(primary_model(), prompt)
+    model_response = get_precomputed_response(merchant_id, prepared['menu_id'], language, cache_key)
+    metrics.record_cache("Precomputed", model_response is not None)
+    if model_response is None:
+        try:
+            model_response = get_response_cache().get_or_compute(
+                cache_key,
+                lambda: chat_completion(SYSTEM_PROMPT, prompt, merchant_id=merchant_id),
+                is_valid=lambda content: 'error' not in post_process_questions(content)
+            )
+        except LLMError as e:
+            return {"error": "No response from model", "details": str(e)}
+
+    metrics.debug("Model response", model_response)
 
-    if len(menu_data) == 1 or not menu_id:
-        menu_data = menu_data[0]
-    else:
-        menu_data = next((menu for menu in menu_data if menu['_id'] == menu_id), None)
+    # 5. Post-process the generated questions
+    with metrics.stage("PostProcess"):
+        return post_process_questions(model_response)
 
-    # 2. Data cleaning
-    cleaned_data = clean_menu_data(menu_data)
+def stream_questions(merchant_id: str, menu_id: str, language: str) -> Iterator[Dict]:
+    """
+    Generate questions like generate_questions, yielding each validated question as soon as it is complete.
+    :param merchant_id: merchant identifier.
+    :param menu_id: menu identifier (variant ID).
+    :param language: language used for the output.
+    :return: iterator of events: {"question": ...}, then {"done": True} (or {"error": ...}).
+    """
+    prepared = prepare_prompt(merchant_id, menu_id, language)
 
-    print("\n<< Filtered menu data >>", cleaned_data)
+    if 'error' in prepared:
+        yield prepared
+        return
 
-    # 3. Preparation of the prompt
-    prompt = create_prompt(cleaned_data, language)
+    prompt = prepared['prompt']
+    response_cache = get_response_cache()
+    cache_key = make_key(primary_model(), prompt)
+    cached_response = get_precomputed_response(merchant_id, prepared['menu_id'], language, cache_key)
+    if cached_response is None:
+        cached_response, _ = response_cache.get(cache_key)
 
-    print("\n<< Prompt >>", prompt)
+    try:
+        chunks = [cached_response] if cached_response is not None else stream_completion(
+            SYSTEM_PROMPT, prompt, merchant_id=merchant_id
+        )
+        parser = JsonArrayStreamParser('questions')
+        content = []
+        count = 0
+
+        for chunk in chunks:
+            content.append(chunk)
+            for item in parser.feed(chunk):
+                try:
+                    question = Question.model_validate(item)
+                except ValidationError as e:
+                    print(f"Skipping invalid question {item}: {e}")
+                    continue
+                count += 1
+                yield {"question": question.model_dump()}
+    except RateLimited as e:
+        yield {"error": "Too many requests", "retry_after": retry_after_seconds(e.retry_after)}
+        return
+    except Exception as e:
+        print(f"Error while streaming from the model: {e}")
+        yield {"error": "No response from model"}
+        return
 
-    # 4. Integration with DeepSeek API
-    model_response = call_deepseek_api(prompt)
+    model_response = "".join(content)
+    metrics.debug("Model response", model_response)
 
-    print("\n<< Model response >>", model_response)
+    if cached_response is None and 'error' not in post_process_questions(model_response):
+        response_cache.set(cache_key, model_response)
 
-    # 5. Post-process the generated questions
-    return post_process_questions(model_response)
+    yield {"done": True} if count else {"error": "No response from model"}
 
-def clean_menu_data(menu_data: Dict) -> Dict:
+def prepare_prompt(merchant_id: str, menu_id: str, language: str) -> Dict:
     """
-    Extracts and cleans relevant data from the menu.
-    :param menu_data: JSON data of the menu.
-    :return: Cleaned data as a dictionary.
+    Fetch and compile the menu, then build the prompt.
+    :param merchant_id: merchant identifier.
+    :param menu_id: menu identifier (variant ID).
+    :param language: language used for the output.
+    :return: {"prompt": ..., "menu_id": ...} or {"error": ...}.
     """
-    cleaned_data = {
-        'dishes': []
-    }
-
-    for category in menu_data.get('categories', []):
-        for item in category.get('items', []):
-            ingredients = [
-                ingredient.get('name', '') for ingredient in item.get('ingredients', [])
-            ]
-            dish = {
-                'id': item.get('id'),
-                'name': item.get('name', ''),
-                'description': item.get('description', ''),
-                'ingredients': ingredients,
-                'allergens': item.get('allergens', []),
-                'price': item.get('price'),
-                'category': category.get('name')  # add the category name
-            }
-            cleaned_data['dishes'].append(dish)
-
-    return cleaned_data
-
-def create_prompt(cleaned_data: Dict, language: str) -> str:
+    # 1. Fetch menu from MongoDB
+    menu_fetcher = get_menu_fetcher()
+    menu_data = menu_fetcher.get_menu_by_id(merchant_id, menu_id)
+
+    return prepare_menu_prompt(merchant_id, menu_data, language)
+
+def prepare_menu_prompt(merchant_id: str, menu_data: Optional[Dict], language: str) -> Dict:
     """
-    Creates a prompt for the DeepSeek model based on the cleaned menu data
-    :param cleaned_data
+    Compile an already fetched menu and build the prompt.
+    :param merchant_id: merchant identifier.
+    :param menu_data: menu returned by MenuFetcher.get_menu_by_id.
     :param language: language used for the output.
-    :return: Prompt as string.
+    :return: {"prompt": ..., "menu_id": ...} or {"error": ...}.
     """
-    prompt = "Based on the following list of dishes, generate 3 user questions:\n"
+    if not menu_data:
+        return {"error": "Menu not found"}
 
-    for dish in cleaned_data['dishes']:
-        prompt += f"- {dish['name']}: {dish['description']}\n"
-        prompt += f"  Ingredients: {', '.join(dish['ingredients'])}\n"
-        prompt += f"  Allergens: {', '.join(dish['allergens'])}\n"
-    prompt += (
-        "\nCreate 3 questions to help the user choose dishes according to their preferences."
-        "\nEach question must include: 'question', 'type' (one of: single-selection (for questions with yes/no answer), multi-selection (for questions with multiple answers allowed), open-text (for questions without pre-defined answers to which the client can respond in an open way)), and if applicable, 'possible_answers'."
-        "\nRespond only with JSON (no markdown or explanations) wrapping questions array into 'questions' key."
-    )
-    prompt += f"\n\nLanguage of the questions and possible answers: {language}\n"
+    # 2. Compiled menu (cached per merchant and menu)
+    menu = get_compiled_menu(merchant_id, menu_data)
+
+    # 3. Preparation of the prompt
+    with metrics.stage("CreatePrompt"):
+        prompt = create_prompt(menu, language)
+
+    metrics.debug("Prompt", prompt)
 
-    return prompt
+    return {"prompt": prompt, "menu_id": menu_data.get('id')}
 
-def call_deepseek_api(prompt: str) -> Optional[str]:
+def create_prompt(menu: CompiledMenu, language: str) -> str:
     """
-    Call DeepSeek API to generate questions.
-    :param prompt: Prompt for the model.
-    :return: List of generated questions.
+    Creates a prompt for the DeepSeek model based on the compiled menu
+    :param menu: compiled menu.
+    :param language: language used for the output.
+    :return: Prompt as string.
     """
-    client = OpenAI(
-        api_key=OPENAI_API_KEY,
-        base_url=API_BASE_URL
-    )
+    encoded_menu = menu.encoded()
 
-    try:
-        response = client.chat.completions.create(
-            model=API_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates user questions based on menu data."},
-                {"role": "user", "content": prompt},
-            ],
-            response_format={ "type": "json_object" }
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Error while making call to the model: {e}")
-        return None
+    metrics.record("MenuDishes", encoded_menu.dish_count)
+    metrics.record("MenuOmittedDishes", encoded_menu.omitted_count)
+    metrics.record("MenuTokens", encoded_menu.tokens)
+    metrics.record("MenuBaselineTokens", encoded_menu.baseline_tokens)
 
+    return "".join([
+        "Based on the following list of dishes, generate 3 user questions:\n",
+        encoded_menu.text,
+        "\nCreate 3 questions to help the user choose dishes according to their preferences."
+        "\nEach question must include: 'question', 'type' (one of: single-selection (for questions with yes/no answer), multi-selection (for questions with multiple answers allowed), open-text (for questions without pre-defined answers to which the client can respond in an open way)), and if applicable, 'possible_answers'."
+        "\nRespond only with JSON (no markdown or explanations) wrapping questions array into 'questions' key.",
+        f"\n\nLanguage of the questions and possible answers: {language}\n",
+    ])
 
 def post_process_questions(content: Optional[str]) -> Union[
     Dict[str, str], Dict[str, List[Any]], Dict[str, str], Dict[str, Union[str, Any]]]:
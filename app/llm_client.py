@@ -0,0 +1,573 @@
+import asyncio
+import collections
+import contextvars
+import metrics
+import os
+import random
+import threading
+import time
+
+from admission import estimate_prompt_tokens, get_admission_controller
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from singleflight import AsyncSingleFlight, SingleFlight
+from streaming import stream_chat_completion
+from typing import TYPE_CHECKING, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+# Seconds a single model request may take
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+# Seconds a completion may take in total (retries, hedging and fallback included), below the API Gateway limit
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "25"))
+# Retries of a provider after timeouts, connection errors, 429 and 5xx
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+# Send a second identical request if the first one has not answered after this many seconds:
+# "0" disables hedging, "p95" uses the 95th percentile of the recent latencies of the provider
+LLM_HEDGE_AFTER = os.getenv("LLM_HEDGE_AFTER", "0")
+# Fall back to OpenAI (OPENAI_API_KEY) when DeepSeek fails
+LLM_FALLBACK = os.getenv("LLM_FALLBACK", "true").lower() in ("1", "true", "yes")
+# Consecutive failures opening the circuit of a provider, and seconds before a trial request is let through
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Latencies kept per provider for the "p95" hedging delay, and samples needed before hedging
+LATENCY_SAMPLES = 100
+MIN_HEDGE_SAMPLES = 20
+
+T = TypeVar("T")
+
+# Clients are reused across calls (and warm Lambda invocations) to keep HTTP connections alive.
+# openai is imported with the first client: requests served from a cache never load it.
+_clients: Dict[Tuple[str, str], "OpenAI"] = {}
+_async_clients: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, "AsyncOpenAI"]] = {}
+_providers: Optional[List["Provider"]] = None
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+# Identical prompts in flight at the same time share one model call
+_flight = SingleFlight("ModelCall")
+_async_flight = AsyncSingleFlight("ModelCall")
+
+
+class LLMError(Exception):
+    """
+    No provider returned a completion (errors, open circuits or deadline exceeded).
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures: requests are refused for `cooldown` seconds,
+    then a single trial request is let through and closes the circuit if it succeeds.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.trial = True
+            return True
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened_at is not None and not self.trial
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    def release(self) -> None:
+        """
+        Give back a trial request that was not made (e.g. no time left).
+        """
+        with self._lock:
+            self.trial = False
+
+
+class Provider:
+    """
+    OpenAI compatible provider, with its circuit breaker and recent latencies.
+    """
+
+    def __init__(self, name: str, api_key: Optional[str], base_url: str, model: str):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.breaker = CircuitBreaker()
+        self.latencies: Deque[float] = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        :return: seconds after which a hedged request is sent, None if hedging is disabled.
+        """
+        if LLM_HEDGE_AFTER == "p95":
+            latencies = sorted(self.latencies)
+            if len(latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            return latencies[int(len(latencies) * 0.95) - 1]
+        delay = float(LLM_HEDGE_AFTER)
+        return delay if delay > 0 else None
+
+
+def get_providers() -> List[Provider]:
+    """
+    Providers in order of preference, configured from the environment on first use: DeepSeek
+    (DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL), then OpenAI (OPENAI_API_KEY, OPENAI_BASE_URL,
+    OPENAI_MODEL) if LLM_FALLBACK is set and the key is present.
+    :return: list of providers.
+    """
+    global _providers
+
+    with _lock:
+        if _providers is None:
+            _providers = [Provider(
+                "deepseek",
+                os.getenv("DEEPSEEK_API_KEY"),
+                os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+                os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+            )]
+            if LLM_FALLBACK and os.getenv("OPENAI_API_KEY"):
+                _providers.append(Provider(
+                    "openai",
+                    os.getenv("OPENAI_API_KEY"),
+                    os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+                    os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+                ))
+        return _providers
+
+
+def reset_providers() -> None:
+    """
+    Forget the providers (and their circuit breakers): the next call reads the environment again.
+    """
+    global _providers
+
+    with _lock:
+        _providers = None
+
+
+def primary_model() -> str:
+    """
+    :return: model of the preferred provider, part of the response cache keys.
+    """
+    return get_providers()[0].model
+
+
+def get_client(api_key: Optional[str], base_url: str) -> "OpenAI":
+    """
+    Return the shared OpenAI compatible client for the given provider.
+    SDK retries are disabled: they are handled by chat_completion.
+    :param api_key: API key.
+    :param base_url: API base URL.
+    :return: OpenAI client.
+    """
+    key = (api_key or "", base_url)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from openai import OpenAI
+            client = _clients[key] = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=LLM_TIMEOUT)
+        return client
+
+
+def get_async_client(api_key: Optional[str], base_url: str) -> "AsyncOpenAI":
+    """
+    Return the shared async OpenAI compatible client for the given provider.
+    The client is bound to the running event loop, a new one is created if the loop changes.
+    :param api_key: API key.
+    :param base_url: API base URL.
+    :return: AsyncOpenAI client.
+    """
+    key = (api_key or "", base_url)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    with _lock:
+        entry = _async_clients.get(key)
+        if entry is None or (loop is not None and entry[0] is not loop):
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=LLM_TIMEOUT)
+            entry = _async_clients[key] = (loop, client)
+        return entry[1]
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    :return: True for timeouts, connection errors, 429 and 5xx.
+    """
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, or the Retry-After of the response when longer.
+    :param error: error of the failed attempt.
+    :param attempt: number of the failed attempt (0 for the first one).
+    :return: seconds to wait.
+    """
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    try:
+        retry_after = float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        retry_after = 0.0
+    return max(delay, min(retry_after, LLM_RETRY_MAX_DELAY))
+
+
+def _next_delay(provider: Provider, error: Exception, attempt: int, deadline_at: float) -> float:
+    """
+    Handle a failed attempt: return the delay before the next one, or raise LLMError if the provider is given up.
+    Errors that are not retryable (invalid request, wrong key...) are not counted by the circuit breaker.
+    """
+    if isinstance(error, LLMError):
+        provider.breaker.record_failure()
+        raise error
+    if not is_retryable(error):
+        raise LLMError(f"{provider.name}: {error}") from error
+
+    provider.breaker.record_failure()
+    delay = retry_delay(error, attempt)
+    if attempt >= LLM_MAX_RETRIES or provider.breaker.is_open() or time.monotonic() + delay >= deadline_at:
+        raise LLMError(f"{provider.name}: {error}") from error
+
+    metrics.record("ModelRetries", 1)
+    print(f"Retrying {provider.name} in {delay:.2f}s after error: {error}")
+    return delay
+
+
+def _call_provider(provider: Provider, call: Callable[[float], T], deadline_at: float) -> T:
+    """
+    Call a provider with retries, updating its circuit breaker and latencies.
+    :param call: function receiving the timeout of the attempt.
+    :param deadline_at: time.monotonic() after which no attempt is started.
+    :raises LLMError: if every attempt failed.
+    """
+    try:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            started_at = time.monotonic()
+            try:
+                result = call(min(LLM_TIMEOUT, remaining))
+            except Exception as e:
+                time.sleep(_next_delay(provider, e, attempt, deadline_at))
+                continue
+
+            provider.breaker.record_success()
+            provider.latencies.append(time.monotonic() - started_at)
+            return result
+    except BaseException:
+        # a trial request ended without a success or a counted failure (e.g. invalid request):
+        # give it back, or the circuit would stay open for the life of the container
+        provider.breaker.release()
+        raise
+
+    provider.breaker.release()
+    raise LLMError(f"{provider.name}: deadline exceeded")
+
+
+async def _async_call_provider(provider: Provider, call: Callable[[float], Awaitable[T]], deadline_at: float) -> T:
+    """
+    Async version of _call_provider.
+    """
+    try:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            started_at = time.monotonic()
+            try:
+                result = await call(min(LLM_TIMEOUT, remaining))
+            except Exception as e:
+                await asyncio.sleep(_next_delay(provider, e, attempt, deadline_at))
+                continue
+
+            provider.breaker.record_success()
+            provider.latencies.append(time.monotonic() - started_at)
+            return result
+    except BaseException:
+        provider.breaker.release()
+        raise
+
+    provider.breaker.release()
+    raise LLMError(f"{provider.name}: deadline exceeded")
+
+
+def _available_providers(deadline_at: float) -> Iterator[Tuple[Provider, float]]:
+    """
+    Providers whose circuit is closed (or due for a trial request), counting the fallbacks.
+    The time left is split between the remaining providers, so that retries of a slow provider
+    do not leave the fallback without time.
+    :param deadline_at: time.monotonic() of the deadline of the whole call.
+    :return: iterator of (provider, deadline of the provider).
+    """
+    providers = get_providers()
+    for position, provider in enumerate(providers):
+        if not provider.breaker.allow():
+            print(f"Skipping {provider.name}: circuit open")
+            continue
+        if position:
+            metrics.record("ModelFallbacks", 1)
+        now = time.monotonic()
+        yield provider, now + (deadline_at - now) / (len(providers) - position)
+
+
+def _messages(system_prompt: str, prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _content(provider: Provider, response) -> str:
+    metrics.record_usage(response.usage)
+    content = response.choices[0].message.content
+    if not content:
+        raise LLMError(f"{provider.name}: empty response")
+    return content
+
+
+def _complete(provider: Provider, system_prompt: str, prompt: str, timeout: float) -> str:
+    response = get_client(provider.api_key, provider.base_url).chat.completions.create(
+        model=provider.model,
+        messages=_messages(system_prompt, prompt),
+        response_format={ "type": "json_object" },
+        timeout=timeout,
+    )
+    return _content(provider, response)
+
+
+def _hedged_complete(provider: Provider, system_prompt: str, prompt: str, timeout: float) -> str:
+    """
+    Single model request, duplicated if the first one is slower than the hedging delay.
+    :return: content of the first successful response.
+    """
+    global _hedge_executor
+
+    delay = provider.hedge_delay()
+    if delay is None or delay >= timeout:
+        return _complete(provider, system_prompt, prompt, timeout)
+
+    with _lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+    def submit(timeout: float):
+        # each request runs in its own copy of the context, to record the usage in the current request metrics
+        return _hedge_executor.submit(contextvars.copy_context().run, _complete, provider, system_prompt, prompt,
+                                      timeout)
+
+    done, pending = wait({submit(timeout)}, timeout=delay)
+    if not done:
+        metrics.record("ModelHedges", 1)
+        pending.add(submit(timeout - delay))
+
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+async def _async_complete(provider: Provider, system_prompt: str, prompt: str, timeout: float) -> str:
+    response = await get_async_client(provider.api_key, provider.base_url).chat.completions.create(
+        model=provider.model,
+        messages=_messages(system_prompt, prompt),
+        response_format={ "type": "json_object" },
+        timeout=timeout,
+    )
+    return _content(provider, response)
+
+
+async def _async_hedged_complete(provider: Provider, system_prompt: str, prompt: str, timeout: float) -> str:
+    """
+    Async version of _hedged_complete: the slower request is cancelled.
+    """
+    delay = provider.hedge_delay()
+    if delay is None or delay >= timeout:
+        return await _async_complete(provider, system_prompt, prompt, timeout)
+
+    done, pending = await asyncio.wait({asyncio.ensure_future(_async_complete(provider, system_prompt, prompt, timeout))},
+                                       timeout=delay)
+    if not done:
+        metrics.record("ModelHedges", 1)
+        pending.add(asyncio.ensure_future(_async_complete(provider, system_prompt, prompt, timeout - delay)))
+
+    error = None
+    try:
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def chat_completion(system_prompt: str, prompt: str, deadline: float = LLM_DEADLINE,
+                    merchant_id: Optional[str] = None) -> str:
+    """
+    Call the chat completion API with a JSON response. Each provider is retried with jittered backoff
+    after timeouts, connection errors, 429 and 5xx (optionally hedging slow requests), then the next
+    provider is tried. Providers with an open circuit are skipped.
+    Concurrent calls with the same prompts share a single call.
+    :param system_prompt: system message.
+    :param prompt: user message.
+    :param deadline: max seconds for the whole call (admission wait included).
+    :param merchant_id: merchant of the request, the call goes through the admission control (see admission.py).
+    :return: content of the response.
+    :raises LLMError: if no provider answered.
+    :raises RateLimited: if the call was not admitted.
+    """
+    return _flight.do((system_prompt, prompt),
+                      lambda: _chat_completion(system_prompt, prompt, deadline, merchant_id))
+
+
+def _admit(system_prompt: str, prompt: str, deadline_at: float, merchant_id: Optional[str]) -> None:
+    # calls without a merchant (the offline precompute job, paced by its own limiter) are not limited
+    controller = get_admission_controller()
+    if controller is not None and merchant_id is not None:
+        controller.admit(merchant_id, estimate_prompt_tokens(system_prompt, prompt), deadline_at)
+
+
+async def _async_admit(system_prompt: str, prompt: str, deadline_at: float, merchant_id: Optional[str]) -> None:
+    controller = get_admission_controller()
+    if controller is not None and merchant_id is not None:
+        await controller.admit_async(merchant_id, estimate_prompt_tokens(system_prompt, prompt), deadline_at)
+
+
+def _chat_completion(system_prompt: str, prompt: str, deadline: float, merchant_id: Optional[str]) -> str:
+    deadline_at = time.monotonic() + deadline
+    _admit(system_prompt, prompt, deadline_at, merchant_id)
+    errors = []
+
+    with metrics.stage("ModelCall"):
+        for provider, provider_deadline_at in _available_providers(deadline_at):
+            try:
+                return _call_provider(
+                    provider, lambda timeout: _hedged_complete(provider, system_prompt, prompt, timeout),
+                    provider_deadline_at
+                )
+            except LLMError as e:
+                print(f"Error while making call to the model: {e}")
+                errors.append(str(e))
+
+    metrics.record("ModelErrors", 1)
+    raise LLMError("; ".join(errors) or "every provider circuit is open")
+
+
+async def async_chat_completion(system_prompt: str, prompt: str, deadline: float = LLM_DEADLINE,
+                                merchant_id: Optional[str] = None) -> str:
+    """
+    Async version of chat_completion, through the shared AsyncOpenAI clients.
+    :param system_prompt: system message.
+    :param prompt: user message.
+    :param deadline: max seconds for the whole call (admission wait included).
+    :param merchant_id: merchant of the request, the call goes through the admission control.
+    :return: content of the response.
+    :raises LLMError: if no provider answered.
+    :raises RateLimited: if the call was not admitted.
+    """
+    return await _async_flight.do((system_prompt, prompt),
+                                  lambda: _async_chat_completion(system_prompt, prompt, deadline, merchant_id))
+
+
+async def _async_chat_completion(system_prompt: str, prompt: str, deadline: float,
+                                 merchant_id: Optional[str]) -> str:
+    deadline_at = time.monotonic() + deadline
+    await _async_admit(system_prompt, prompt, deadline_at, merchant_id)
+    errors = []
+
+    with metrics.stage("ModelCall"):
+        for provider, provider_deadline_at in _available_providers(deadline_at):
+            try:
+                return await _async_call_provider(
+                    provider, lambda timeout: _async_hedged_complete(provider, system_prompt, prompt, timeout),
+                    provider_deadline_at
+                )
+            except LLMError as e:
+                print(f"Error while making call to the model: {e}")
+                errors.append(str(e))
+
+    metrics.record("ModelErrors", 1)
+    raise LLMError("; ".join(errors) or "every provider circuit is open")
+
+
+def stream_completion(system_prompt: str, prompt: str, deadline: float = LLM_DEADLINE,
+                      merchant_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Call the chat completion API in streaming mode. Retries and fallback apply until the first chunk
+    is received: later errors are raised to the caller, which has already sent part of the response.
+    :param system_prompt: system message.
+    :param prompt: user message.
+    :param deadline: max seconds before the first chunk (admission wait included).
+    :param merchant_id: merchant of the request, the call goes through the admission control.
+    :return: iterator of text chunks.
+    :raises LLMError: if no provider started streaming.
+    :raises RateLimited: if the call was not admitted.
+    """
+    deadline_at = time.monotonic() + deadline
+    _admit(system_prompt, prompt, deadline_at, merchant_id)
+    errors = []
+
+    for provider, provider_deadline_at in _available_providers(deadline_at):
+        def first_chunk(timeout: float, provider: Provider = provider) -> Tuple[str, Iterator[str]]:
+            client = get_client(provider.api_key, provider.base_url).with_options(timeout=timeout)
+            chunks = stream_chat_completion(client, provider.model, system_prompt, prompt)
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise LLMError(f"{provider.name}: empty response")
+            return chunk, chunks
+
+        try:
+            chunk, chunks = _call_provider(provider, first_chunk, provider_deadline_at)
+        except LLMError as e:
+            print(f"Error while making call to the model: {e}")
+            errors.append(str(e))
+            continue
+
+        yield chunk
+        yield from chunks
+        return
+
+    metrics.record("ModelErrors", 1)
+    raise LLMError("; ".join(errors) or "every provider circuit is open")
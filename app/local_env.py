@@ -0,0 +1,12 @@
+import os
+
+# Local development only: in Lambda the settings come from the function environment.
+# Every entry point imports this module first: the other modules read their settings when they are imported,
+# so a .env loaded later would be ignored.
+DEV_ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "dev", ".env")
+
+if not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    from dotenv import find_dotenv, load_dotenv
+
+    # .env of the working directory (or of a parent), else dev/.env of the repository
+    load_dotenv(find_dotenv(usecwd=True) or DEV_ENV_FILE)
@@ -1,13 +1,62 @@
+import local_env  # noqa: F401  (loads .env before the settings are read)
+import importlib
 import json
-from generate_questions import generate_questions
-from suggest_dishes import suggest_dishes
+import metrics
+import os
+
+from admission import RateLimited, retry_after_seconds
+
+# Serve the requests through the asyncio pipeline (async MongoDB and OpenAI clients)
+ASYNC_PIPELINE = os.getenv("ASYNC_PIPELINE", "false").lower() in ("1", "true", "yes")
+
+# Modules serving each route. They are imported on the first request of the route (not at init),
+# so OPTIONS preflights and invalid paths load no heavy dependency.
+ROUTE_MODULES = {
+    '/generate-questions': 'generate_questions',
+    '/suggest-dishes': 'suggest_dishes',
+    '/suggest-dishes-batch': 'suggest_dishes_batch',
+}
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",  # or replace with "http://localhost:3000" or your frontend domain
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Allow-Methods": "OPTIONS,POST"
+}
+
+def stream_events(path, body):
+    """
+    Return the stream of events for a streaming request ("stream": true in the body), None for an invalid path.
+    """
+    merchant_id = body.get('merchant_id', {})
+    menu_id = body.get('menu_id', {})
+    language = body.get('language', {})
+    user_preferences = body.get('user_preferences', {})
+
+    if path == '/generate-questions':
+        from generate_questions import stream_questions
+        return stream_questions(merchant_id, menu_id, language)
+    elif path == '/suggest-dishes':
+        from suggest_dishes import stream_suggestions
+        return stream_suggestions(merchant_id, menu_id, language, user_preferences)
+    return None
+
+def load_route(path):
+    """
+    Import the modules serving a route ahead of its first request (e.g. to warm up a container).
+    :return: imported module, None for an invalid path.
+    """
+    if path not in ROUTE_MODULES:
+        return None
+    return importlib.import_module('async_pipeline' if ASYNC_PIPELINE else ROUTE_MODULES[path])
 
 def lambda_handler(event, context):
-    cors_headers = {
-        "Access-Control-Allow-Origin": "*",  # or replace with "http://localhost:3000" or your frontend domain
-        "Access-Control-Allow-Headers": "Content-Type",
-        "Access-Control-Allow-Methods": "OPTIONS,POST"
-    }
+    with metrics.request(event.get('path') or "unknown") as request_metrics:
+        response = handle_event(event, context)
+        request_metrics.properties["StatusCode"] = response['statusCode']
+        return response
+
+def handle_event(event, context):
+    cors_headers = CORS_HEADERS
     try:
         # Handle preflight request
         if event.get("httpMethod") == "OPTIONS":
@@ -23,11 +72,40 @@ def lambda_handler(event, context):
         language = body.get('language', {})
         user_preferences = body.get('user_preferences', {})
 
+        # Streaming mode: the Lambda response is buffered, so the events are returned as NDJSON
+        # (use stream_server.py for a chunked HTTP response)
+        if body.get('stream'):
+            events = stream_events(event.get('path'), body)
+            if events is not None:
+                return {
+                    'statusCode': 200,
+                    'headers': {**cors_headers, 'Content-Type': 'application/x-ndjson'},
+                    'body': "".join(json.dumps(e) + "\n" for e in events)
+                }
+
         # Determina l'azione in base al percorso della richiesta
         if event.get('path') == '/generate-questions':
-            response = generate_questions(merchant_id, menu_id, language)
+            if ASYNC_PIPELINE:
+                from async_pipeline import async_generate_questions, run
+                response = run(async_generate_questions(merchant_id, menu_id, language))
+            else:
+                from generate_questions import generate_questions
+                response = generate_questions(merchant_id, menu_id, language)
         elif event.get('path') == '/suggest-dishes':
-            response = suggest_dishes(merchant_id, menu_id, language, user_preferences)
+            if ASYNC_PIPELINE:
+                from async_pipeline import async_suggest_dishes, run
+                response = run(async_suggest_dishes(merchant_id, menu_id, language, user_preferences))
+            else:
+                from suggest_dishes import suggest_dishes
+                response = suggest_dishes(merchant_id, menu_id, language, user_preferences)
+        elif event.get('path') == '/suggest-dishes-batch':
+            diners = body.get('diners', [])
+            if ASYNC_PIPELINE:
+                from async_pipeline import async_suggest_dishes_batch, run
+                response = run(async_suggest_dishes_batch(merchant_id, menu_id, language, diners))
+            else:
+                from suggest_dishes_batch import suggest_dishes_batch
+                response = suggest_dishes_batch(merchant_id, menu_id, language, diners)
         else:
             response = {
                 'statusCode': 400,
@@ -49,6 +127,15 @@ def lambda_handler(event, context):
             'body': json.dumps(response)
         }
 
+    except RateLimited as e:
+        # Chiamate al modello oltre i limiti (admission.py): il client riprova dopo Retry-After
+        retry_after = retry_after_seconds(e.retry_after)
+        return {
+            'statusCode': 429,
+            'headers': {**cors_headers, 'Retry-After': str(retry_after)},
+            'body': json.dumps({'error': 'Too many requests', 'retry_after': retry_after})
+        }
+
     except Exception as e:
         # Gestisci eventuali errori
         return {
@@ -0,0 +1,204 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# Metrics output: "emf" (CloudWatch Embedded Metric Format JSON lines on stdout), "memory" or "none"
+METRICS_EXPORTER = os.getenv("METRICS_EXPORTER", "emf")
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "MenuAdvisor")
+# Log the full payloads (cleaned menu, prompt, model response) of every request
+DEBUG_PAYLOADS = os.getenv("DEBUG_PAYLOADS", "false").lower() in ("1", "true", "yes")
+
+
+class RequestMetrics:
+    """
+    Metrics of a single request: stage durations (milliseconds, summed if a stage runs more than once),
+    values (tokens, menu size, cache hits...) and properties (merchant, menu...).
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.values: Dict[str, float] = {}
+        self.units: Dict[str, str] = {}
+        self.properties: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + milliseconds
+
+    def add_value(self, name: str, value: float, unit: str = "Count") -> None:
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+
+class EmfExporter:
+    """
+    Writes one CloudWatch Embedded Metric Format line per request, turned into metrics by CloudWatch Logs.
+    """
+
+    def __init__(self, namespace: str = METRICS_NAMESPACE, stream=None):
+        self.namespace = namespace
+        self.stream = stream
+
+    def export(self, request: RequestMetrics) -> None:
+        metrics = {f"{name}Ms": round(value, 3) for name, value in request.stages.items()}
+        definitions = [{"Name": name, "Unit": "Milliseconds"} for name in metrics]
+        metrics.update(request.values)
+        definitions += [{"Name": name, "Unit": request.units[name]} for name in request.values]
+
+        line = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["Endpoint"]],
+                    "Metrics": definitions,
+                }],
+            },
+            "Endpoint": request.endpoint,
+            **request.properties,
+            **metrics,
+        }
+        print(json.dumps(line, default=str), file=self.stream or sys.stdout, flush=True)
+
+
+class InMemoryExporter:
+    """
+    Keeps the metrics of every request, for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.requests: List[RequestMetrics] = []
+
+    def export(self, request: RequestMetrics) -> None:
+        self.requests.append(request)
+
+    def clear(self) -> None:
+        self.requests.clear()
+
+
+def _create_exporter(name: str):
+    if name == "emf":
+        return EmfExporter()
+    if name == "memory":
+        return InMemoryExporter()
+    return None
+
+
+_exporter = _create_exporter(METRICS_EXPORTER)
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+def set_exporter(exporter) -> None:
+    """
+    Replace the exporter (EmfExporter, InMemoryExporter, any object with export(request) or None).
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def current() -> Optional[RequestMetrics]:
+    """
+    :return: metrics of the request running in the current context, None outside of a request.
+    """
+    return _current.get()
+
+
+@contextmanager
+def request(endpoint: str) -> Iterator[RequestMetrics]:
+    """
+    Collect the metrics of a request and export them when it completes.
+    :param endpoint: endpoint name (metric dimension).
+    """
+    metrics = RequestMetrics(endpoint)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        metrics.add_stage("Total", metrics.total_ms())
+        if _exporter is not None:
+            try:
+                _exporter.export(metrics)
+            except Exception as e:
+                print(f"Error while exporting metrics: {e}")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a stage of the current request (no-op outside of a request).
+    :param name: stage name (e.g. "MenuFetch").
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_stage(name, (time.perf_counter() - started_at) * 1000)
+
+
+def record(name: str, value: float, unit: str = "Count") -> None:
+    """
+    Add a value to the current request (no-op outside of a request).
+    :param name: metric name (e.g. "PromptTokens").
+    :param value: value, summed with the previous ones of the same request.
+    :param unit: CloudWatch unit.
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_value(name, value, unit)
+
+
+def record_cache(name: str, hit: bool) -> None:
+    """
+    Count a cache hit or miss of the current request.
+    :param name: cache name (e.g. "Menu" records MenuCacheHit or MenuCacheMiss).
+    :param hit: True for a hit.
+    """
+    record(f"{name}CacheHit" if hit else f"{name}CacheMiss", 1)
+
+
+def record_usage(usage) -> None:
+    """
+    Record the token usage of a model response.
+    :param usage: usage of an OpenAI compatible response (None if not returned).
+    """
+    if usage is not None:
+        record("PromptTokens", usage.prompt_tokens or 0)
+        record("CompletionTokens", usage.completion_tokens or 0)
+
+
+def set_property(name: str, value: Any) -> None:
+    """
+    Attach a property (not a metric, e.g. the merchant ID) to the current request.
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.properties[name] = value
+
+
+def debug(label: str, payload: Any) -> None:
+    """
+    Log a full payload (menu, prompt, model response) only if DEBUG_PAYLOADS is set.
+    :param label: payload name.
+    :param payload: payload.
+    """
+    if DEBUG_PAYLOADS:
+        print(f"\n<< {label} >>", payload)
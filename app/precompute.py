@@ -0,0 +1,173 @@
+import local_env  # noqa: F401  (loads .env before the settings are read)
+import argparse
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from fetch_menu import get_menu_fetcher
+from generate_questions import SYSTEM_PROMPT, post_process_questions, prepare_menu_prompt
+from llm_client import LLMError, chat_completion, primary_model
+from precomputed_questions import get_precomputed_store
+from response_cache import make_key
+from typing import Dict, Iterator, List, Optional
+
+# Languages generated by default (comma separated)
+PRECOMPUTE_LANGUAGES = os.getenv("PRECOMPUTE_LANGUAGES", "it,en")
+# Max concurrent model calls
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "4"))
+# Max model calls per second (0 for no limit)
+PRECOMPUTE_RATE_LIMIT = float(os.getenv("PRECOMPUTE_RATE_LIMIT", "2"))
+# Max seconds per menu (retries and fallback included): no API Gateway limit applies offline
+PRECOMPUTE_DEADLINE = float(os.getenv("PRECOMPUTE_DEADLINE", "120"))
+
+
+class RateLimiter:
+    """
+    Spaces out the calls of every thread so that at most `rate` calls per second are started.
+    """
+
+    def __init__(self, rate: float):
+        """
+        :param rate: max calls per second (0 or less for no limit).
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def iter_merchant_ids(db, merchant_ids: Optional[List[str]] = None) -> Iterator[str]:
+    """
+    Merchants with at least one menu category (or only the given ones).
+    :param db: MongoDB database.
+    :param merchant_ids: optional merchant IDs to restrict the job to.
+    :return: iterator of merchant IDs.
+    """
+    if merchant_ids:
+        yield from merchant_ids
+        return
+
+    cursor = db["users"].find({"merchantInfo.categories.0": {"$exists": True}}, {"_id": 1})
+    for user in cursor:
+        yield str(user["_id"])
+
+
+def generate(store, rate_limiter: RateLimiter, job: Dict, deadline: float = PRECOMPUTE_DEADLINE) -> str:
+    """
+    Generate and store the questions of a single menu and language.
+    :return: "generated" or "failed".
+    """
+    rate_limiter.acquire()
+    try:
+        content = chat_completion(SYSTEM_PROMPT, job["prompt"], deadline=deadline)
+    except LLMError as e:
+        print(f"Failed {job['merchant_id']} / {job['menu_id']} / {job['language']}: {e}")
+        return "failed"
+    result = post_process_questions(content)
+    if 'error' in result:
+        print(f"Failed {job['merchant_id']} / {job['menu_id']} / {job['language']}: {result['error']}")
+        return "failed"
+
+    store.set(job["merchant_id"], job["menu_id"], job["language"], job["hash"], content)
+    print(f"Generated {job['merchant_id']} / {job['menu_id']} / {job['language']}")
+    return "generated"
+
+
+def precompute(languages: List[str], merchant_ids: Optional[List[str]] = None,
+               concurrency: int = PRECOMPUTE_CONCURRENCY, rate_limit: float = PRECOMPUTE_RATE_LIMIT,
+               force: bool = False, dry_run: bool = False, deadline: float = PRECOMPUTE_DEADLINE) -> Dict[str, int]:
+    """
+    Generate the questions of every menu (variant) of every merchant in every language.
+    Menus whose prompt hash is unchanged since the last run are skipped.
+    :param languages: output languages.
+    :param merchant_ids: optional merchant IDs to restrict the job to.
+    :param concurrency: max concurrent model calls.
+    :param rate_limit: max model calls per second.
+    :param force: regenerate also the unchanged menus.
+    :param dry_run: only report what would be generated.
+    :param deadline: max seconds per menu and language.
+    :return: counters (menus, skipped, generated, failed, and merchants whose menus could not be read).
+    """
+    store = get_precomputed_store()
+    rate_limiter = RateLimiter(rate_limit)
+    counters = {"menus": 0, "skipped": 0, "generated": 0, "failed": 0, "merchants_failed": 0}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = []
+        for merchant_id in iter_merchant_ids(get_menu_fetcher().db, merchant_ids):
+            # an invalid ID or a database error only skips the merchant (the fetcher changes after a reconnection)
+            try:
+                menus = get_menu_fetcher().get_menu(merchant_id, use_cache=False)
+            except Exception as e:
+                print(f"Failed merchant {merchant_id}: {e}")
+                counters["merchants_failed"] += 1
+                continue
+
+            for menu_data in menus:
+                counters["menus"] += 1
+                for language in languages:
+                    prepared = prepare_menu_prompt(merchant_id, menu_data, language)
+                    if 'error' in prepared:
+                        counters["failed"] += 1
+                        continue
+
+                    job = {
+                        "merchant_id": merchant_id,
+                        "menu_id": prepared['menu_id'],
+                        "language": language,
+                        "prompt": prepared['prompt'],
+                        "hash": make_key(primary_model(), prepared['prompt']),
+                    }
+                    stored = store.get(merchant_id, job["menu_id"], language)
+                    if not force and stored and stored.get("hash") == job["hash"]:
+                        counters["skipped"] += 1
+                        continue
+
+                    if dry_run:
+                        print(f"Would generate {merchant_id} / {job['menu_id']} / {language}")
+                        continue
+                    futures.append(executor.submit(generate, store, rate_limiter, job, deadline))
+
+        for future in futures:
+            try:
+                counters[future.result()] += 1
+            except Exception as e:
+                print(f"Error while generating questions: {e}")
+                counters["failed"] += 1
+
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the questions of every merchant menu.")
+    parser.add_argument("--languages", default=PRECOMPUTE_LANGUAGES,
+                        help="comma separated output languages")
+    parser.add_argument("--merchant", action="append", dest="merchants",
+                        help="merchant ID to precompute (repeatable, default: all merchants)")
+    parser.add_argument("--concurrency", type=int, default=PRECOMPUTE_CONCURRENCY)
+    parser.add_argument("--rate-limit", type=float, default=PRECOMPUTE_RATE_LIMIT,
+                        help="max model calls per second (0 for no limit)")
+    parser.add_argument("--deadline", type=float, default=PRECOMPUTE_DEADLINE,
+                        help="max seconds per menu and language, retries and fallback included")
+    parser.add_argument("--force", action="store_true", help="regenerate also the unchanged menus")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be generated")
+    args = parser.parse_args()
+
+    languages = [language.strip() for language in args.languages.split(",") if language.strip()]
+    counters = precompute(languages, args.merchants, args.concurrency, args.rate_limit, args.force, args.dry_run,
+                          args.deadline)
+    print(f"Precompute done: {counters}")
+
+
+if __name__ == "__main__":
+    main()
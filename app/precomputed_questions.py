@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+from fetch_menu import menu_cache
+from typing import Dict, Optional
+
+# Serve the questions generated offline by precompute.py before calling the model
+PRECOMPUTED_QUESTIONS = os.getenv("PRECOMPUTED_QUESTIONS", "false").lower() in ("1", "true", "yes")
+PRECOMPUTED_QUESTIONS_COLLECTION = os.getenv("PRECOMPUTED_QUESTIONS_COLLECTION", "precomputed_questions")
+
+
+class PrecomputedStore:
+    """
+    Questions generated offline, one document per merchant, menu and language.
+    Each document keeps the hash of the prompt it was generated from (menu content, language and model),
+    so a changed menu is never served stale and the batch job only regenerates what changed.
+    """
+
+    def __init__(self, collection):
+        """
+        :param collection: pymongo collection (or any compatible stand-in).
+        """
+        self.collection = collection
+
+    @staticmethod
+    def document_id(merchant_id: str, menu_id: Optional[str], language: str) -> str:
+        return f"{merchant_id}:{menu_id or ''}:{language}"
+
+    def get(self, merchant_id: str, menu_id: Optional[str], language: str) -> Optional[Dict]:
+        """
+        :return: stored document ({"hash", "response", ...}), None if missing.
+        """
+        return self.collection.find_one({"_id": self.document_id(merchant_id, menu_id, language)})
+
+    def set(self, merchant_id: str, menu_id: Optional[str], language: str, prompt_hash: str, response: str) -> None:
+        document_id = self.document_id(merchant_id, menu_id, language)
+        self.collection.replace_one({"_id": document_id}, {
+            "_id": document_id,
+            "merchantID": merchant_id,
+            "menuID": menu_id,
+            "language": language,
+            "hash": prompt_hash,
+            "response": response,
+            "updatedAt": time.time(),
+        }, upsert=True)
+
+
+_store: Optional[PrecomputedStore] = None
+_lock = threading.Lock()
+
+
+def get_precomputed_store() -> PrecomputedStore:
+    """
+    Return the process-wide store, backed by the PRECOMPUTED_QUESTIONS_COLLECTION collection.
+    :return: shared PrecomputedStore.
+    """
+    global _store
+
+    with _lock:
+        if _store is None:
+            from fetch_menu import get_client
+            _store = PrecomputedStore(get_client()[os.getenv("DATABASE_NAME")][PRECOMPUTED_QUESTIONS_COLLECTION])
+        return _store
+
+
+def get_precomputed_response(merchant_id: str, menu_id: Optional[str], language: str,
+                             prompt_hash: str) -> Optional[str]:
+    """
+    Return the precomputed model response of a menu, if generated from the same prompt.
+    The stored document is kept in the menu cache, so it is read from MongoDB at most once per menu version.
+    :param merchant_id: merchant identifier.
+    :param menu_id: menu identifier (variant ID).
+    :param language: language used for the output.
+    :param prompt_hash: make_key(primary_model(), prompt) of the live request.
+    :return: raw model response, None if disabled, missing or outdated.
+    """
+    if not PRECOMPUTED_QUESTIONS:
+        return None
+
+    cache_key = ("precomputed", merchant_id, menu_id, language)
+    document = menu_cache.get(cache_key)
+    if document is None:
+        try:
+            document = get_precomputed_store().get(merchant_id, menu_id, language) or {}
+        except Exception as e:
+            print(f"Error while reading the precomputed questions: {e}")
+            return None
+        menu_cache.set(cache_key, document)
+
+    if document.get("hash") != prompt_hash:
+        return None
+    return document.get("response")
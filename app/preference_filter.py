@@ -0,0 +1,205 @@
+import re
+import unicodedata
+
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Iterator, Set
+from pydantic import BaseModel
+
+# Canonical allergen -> words used in menus and answers (Italian and English, accents stripped)
+ALLERGEN_SYNONYMS = {
+    "gluten": ["glutine", "gluten", "grano", "frumento", "farina", "wheat", "flour", "celiachia", "celiaco", "celiac"],
+    "milk": ["latte", "lattosio", "latticini", "derivati del latte", "milk", "lactose", "dairy"],
+    "eggs": ["uova", "uovo", "egg", "eggs"],
+    "peanuts": ["arachidi", "arachide", "peanut", "peanuts"],
+    "nuts": ["frutta a guscio", "frutta secca", "noci", "nocciole", "mandorle", "pistacchi", "nuts", "tree nuts"],
+    "fish": ["pesce", "fish"],
+    "crustaceans": ["crostacei", "crostaceo", "crustacean", "crustaceans", "shellfish", "frutti di mare", "seafood"],
+    "molluscs": ["molluschi", "mollusco", "mollusc", "molluscs", "mollusk", "mollusks", "frutti di mare", "seafood"],
+    "soy": ["soia", "soy", "soya"],
+    "celery": ["sedano", "celery"],
+    "mustard": ["senape", "mustard"],
+    "sesame": ["sesamo", "sesame"],
+    "sulphites": ["solfiti", "anidride solforosa", "sulphites", "sulfites", "sulphur dioxide"],
+    "lupin": ["lupini", "lupino", "lupin"],
+}
+
+MEAT_INGREDIENTS = [
+    "carne", "manzo", "maiale", "pollo", "vitello", "agnello", "tacchino", "anatra", "coniglio", "cinghiale",
+    "prosciutto", "salame", "salsiccia", "pancetta", "guanciale", "speck", "bresaola", "mortadella", "lardo",
+    "wurstel", "ragu", "meat", "beef", "pork", "chicken", "veal", "lamb", "turkey", "duck", "ham", "bacon",
+    "sausage", "salami",
+]
+FISH_INGREDIENTS = [
+    "pesce", "tonno", "salmone", "acciughe", "alici", "baccala", "merluzzo", "orata", "branzino", "spigola",
+    "pesce spada", "gamberi", "gamberetti", "scampi", "vongole", "cozze", "calamari", "polpo", "seppie",
+    "fish", "tuna", "salmon", "anchovies", "anchovy", "cod", "shrimp", "prawns", "clams", "mussels", "squid",
+    "octopus",
+]
+ANIMAL_PRODUCT_INGREDIENTS = [
+    "formaggio", "mozzarella", "parmigiano", "pecorino", "ricotta", "burro", "panna", "miele",
+    "cheese", "butter", "cream", "honey",
+]
+
+ALLERGY_QUESTION_WORDS = ["allergia", "allergie", "allergico", "intolleranza", "intolleranze", "allergy",
+                          "allergies", "allergic", "intolerance", "intolerances"]
+VEGETARIAN_WORDS = ["vegetariano", "vegetariana", "vegetariani", "vegetarian"]
+VEGAN_WORDS = ["vegano", "vegana", "vegani", "vegan"]
+NEGATIVE_ANSWERS = {"no", "nessuna", "nessuno", "niente", "none", "nothing", "no allergies", "nessuna allergia"}
+POSITIVE_ANSWERS = {"si", "yes", "y", "certo", "sure"}
+# Words negating a diet mentioned after them in the same clause ("non sono vegetariano", "I'm not vegan")
+NEGATION_WORDS = {"no", "non", "not", "nor", "ne", "never", "mai"}
+# Words negating an allergy ("non ho allergie", "nessuna intolleranza"): "no" alone is kept, "no glutine" declares one
+ALLERGY_NEGATION_WORDS = NEGATION_WORDS | {"nessuna", "nessun", "nessuno", "none"}
+# Leading words of an allergy answer, stripped to keep the allergen ("sono allergico al kiwi" -> "kiwi")
+_ALLERGY_PREFIX = re.compile(
+    r"^(?:(?:io )?(?:sono|i am|i m|im) )?(?:allergic[oaie]?|intolleranti?|intolerant)"
+    r"(?: (?:a|al|allo|alla|ai|agli|alle|all|to))? "
+)
+
+
+class DietaryConstraints(BaseModel):
+    allergens: Set[str] = set()
+    # declared allergens that do not map to a canonical one (e.g. "kiwi")
+    allergen_terms: Set[str] = set()
+    excluded_ingredients: Set[str] = set()
+
+    def is_empty(self) -> bool:
+        return not self.allergens and not self.allergen_terms and not self.excluded_ingredients
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase, strip accents and collapse whitespace.
+    :param text: input text.
+    :return: normalized text.
+    """
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"\s+", " ", text.casefold()).strip()
+
+
+_WORD = re.compile(r"\w+")
+_CLAUSE = re.compile(r"[,;.:!?]|\b(?:but|ma|pero)\b")
+
+
+def _iter_matching_words(text: str, words: Iterable[str]) -> Iterator[str]:
+    # single words are looked up in the tokens of the text, phrases with a regular expression
+    tokens = None
+    for word in words:
+        if _WORD.fullmatch(word):
+            if tokens is None:
+                tokens = set(_WORD.findall(text))
+            if word in tokens:
+                yield word
+        elif re.search(rf"\b{re.escape(word)}\b", text):
+            yield word
+
+
+def matching_words(text: str, words: Iterable[str]) -> Set[str]:
+    """
+    Find the words (or phrases) contained in a normalized text as whole words.
+    :param text: normalized text.
+    :param words: normalized words or phrases.
+    :return: words found in the text.
+    """
+    return set(_iter_matching_words(text, words))
+
+
+def contains_any(text: str, words: Iterable[str]) -> bool:
+    """
+    Check if a normalized text contains one of the words (as whole words).
+    """
+    return next(_iter_matching_words(text, words), None) is not None
+
+
+def negates_allergy(clause: str) -> bool:
+    """
+    Check if a clause of a normalized allergy answer denies an allergy:
+    "not to milk", "non al latte", "non ho allergie", "I don't have any intolerance".
+    :param clause: normalized clause.
+    :return: True if the clause declares no allergen.
+    """
+    tokens = _WORD.findall(clause.replace("n't", " not"))
+    if tokens and tokens[0] in ("not", "non"):
+        return True
+    return bool(ALLERGY_NEGATION_WORDS.intersection(tokens)) and contains_any(clause, ALLERGY_QUESTION_WORDS)
+
+
+def declares_any(answer: str, words: Iterable[str]) -> bool:
+    """
+    Check if a normalized answer declares one of the words, ignoring negated mentions:
+    answers starting with a negative answer ("No, ...") and words preceded by a negation in the same clause.
+    :param answer: normalized answer.
+    :param words: normalized words.
+    :return: True if one of the words is declared.
+    """
+    clauses = _CLAUSE.split(answer.replace("n't", " not"))
+    if clauses[0].strip() in NEGATIVE_ANSWERS:
+        return False
+    for clause in clauses:
+        for word in words:
+            match = re.search(rf"\b{re.escape(word)}\b", clause)
+            if match and not NEGATION_WORDS.intersection(_WORD.findall(clause[:match.start()])):
+                return True
+    return False
+
+
+@lru_cache(maxsize=1024)
+def canonical_allergens(text: str) -> FrozenSet[str]:
+    """
+    Map a free-text allergen declaration to canonical allergen names.
+    Menus repeat the same few declarations, so the results are memoized.
+    :param text: allergen text (e.g. "Glutine, latte").
+    :return: canonical allergens found in the text.
+    """
+    text = normalize(text)
+    return frozenset(allergen for allergen, words in ALLERGEN_SYNONYMS.items() if contains_any(text, words))
+
+
+def parse_constraints(user_preferences: Dict) -> DietaryConstraints:
+    """
+    Extract hard constraints (declared allergies, vegetarian or vegan diet) from the user's answers.
+    Plain preferences such as "meat" or "fish" are left to the model.
+    :param user_preferences: User preferences (questions and answers).
+    :return: dietary constraints.
+    """
+    constraints = DietaryConstraints()
+
+    for preference in user_preferences.get('preferences', []):
+        question = normalize(preference.get('question', ''))
+        answer = preference.get('answer', '')
+        answers = answer if isinstance(answer, list) else [answer]
+        normalized_answers = [normalize(a) for a in answers]
+
+        if contains_any(question, ALLERGY_QUESTION_WORDS):
+            for normalized_answer in normalized_answers:
+                if normalized_answer in NEGATIVE_ANSWERS:
+                    continue
+                for clause in _CLAUSE.split(normalized_answer):
+                    if negates_allergy(clause):
+                        continue
+                    for term in re.split(r"/| e | and ", clause):
+                        term = re.sub(r"^(si|yes)\b\W*", "", term.strip())
+                        term = _ALLERGY_PREFIX.sub("", term).strip()
+                        if not term or term in NEGATIVE_ANSWERS or term in POSITIVE_ANSWERS:
+                            continue
+                        allergens = canonical_allergens(term)
+                        if allergens:
+                            constraints.allergens |= allergens
+                        else:
+                            constraints.allergen_terms.add(term)
+
+        affirmative = any(a in POSITIVE_ANSWERS for a in normalized_answers)
+        # a bare "yes" to "vegano o vegetariano?" only means vegetarian
+        vegan = any(declares_any(a, VEGAN_WORDS) for a in normalized_answers) or (
+            affirmative and contains_any(question, VEGAN_WORDS) and not contains_any(question, VEGETARIAN_WORDS))
+        vegetarian = vegan or any(declares_any(a, VEGETARIAN_WORDS) for a in normalized_answers) or (
+            affirmative and contains_any(question, VEGETARIAN_WORDS))
+
+        if vegetarian:
+            constraints.excluded_ingredients |= set(MEAT_INGREDIENTS) | set(FISH_INGREDIENTS)
+            constraints.allergens |= {"fish", "crustaceans", "molluscs"}
+        if vegan:
+            constraints.excluded_ingredients |= set(ANIMAL_PRODUCT_INGREDIENTS)
+            constraints.allergens |= {"milk", "eggs"}
+
+    return constraints
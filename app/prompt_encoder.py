@@ -0,0 +1,156 @@
+import os
+
+from collections import Counter
+from typing import TYPE_CHECKING, List, Optional
+from pydantic import BaseModel
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to an estimate
+    tiktoken = None
+
+if TYPE_CHECKING:
+    from compiled_menu import CompiledDish, CompiledMenu
+
+# Max tokens of the menu section of a prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+
+MENU_FORMAT = "Dishes (name: description | ingredients | allergen codes):"
+MENU_FORMAT_WITH_REFS = "Dishes ([code] name: description | ingredients | allergen codes):"
+
+_encoding = None
+
+
+class EncodedMenu(BaseModel):
+    text: str
+    tokens: int
+    dish_count: int
+    omitted_count: int
+    # tokens of the same dishes in the former verbose format (one labelled line per field)
+    baseline_tokens: int
+
+    def reduction(self) -> float:
+        """
+        :return: fraction of tokens saved compared to the verbose format.
+        """
+        return 1 - self.tokens / self.baseline_tokens if self.baseline_tokens else 0.0
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text with tiktoken if installed, else estimate them (4 characters per token).
+    :param text: text.
+    :return: number of tokens.
+    """
+    global _encoding
+
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def encode_dish(name: str, description: Optional[str], ingredients: List[str], allergen_codes: List[str],
+                ref: Optional[str] = None) -> str:
+    """
+    Render a dish as a single compact line, omitting empty fields.
+    :param name: dish name.
+    :param description: dish description.
+    :param ingredients: ingredient names.
+    :param allergen_codes: short codes of the dish allergens.
+    :param ref: dish ref, prefixed in brackets if given.
+    :return: dish line.
+    """
+    line = f"- [{ref}] {name}" if ref else f"- {name}"
+    if description:
+        line += f": {description}"
+    ingredients = [ingredient for ingredient in ingredients if ingredient]
+    if ingredients or allergen_codes:
+        line += f" | {', '.join(ingredients)}"
+    if allergen_codes:
+        line += f" | {','.join(allergen_codes)}"
+    return line
+
+
+def encode_verbose_dish(name: str, description: Optional[str], ingredients: List[str], allergens: List[str]) -> str:
+    """
+    Render a dish in the verbose format (one labelled line per field), used as baseline for the size report.
+    """
+    return (
+        f"- {name}: {description or ''}\n"
+        f"  Ingredients: {', '.join(i or '' for i in ingredients)}\n"
+        f"  Allergens: {', '.join(allergens)}\n"
+    )
+
+
+def encode_menu(menu: "CompiledMenu", dishes: Optional[List["CompiledDish"]] = None,
+                token_budget: Optional[int] = PROMPT_TOKEN_BUDGET, include_refs: bool = False) -> EncodedMenu:
+    """
+    Render the dishes in a compact form: an allergen legend with short codes,
+    category headers instead of per-dish categories and one line per dish.
+    Dish lines and their token counts are precomputed by the compiled menu, so only the selection is done here.
+    If the dishes exceed the token budget, they are picked round-robin across categories.
+    :param menu: compiled menu.
+    :param dishes: dishes to render, in menu order (default: every dish of the menu).
+    :param token_budget: max tokens of the menu section (None for no limit).
+    :param include_refs: prefix every dish with its ref (see compiled_menu.dish_ref), to let the model answer with refs.
+    :return: encoded menu with token counts.
+    """
+    if dishes is None:
+        dishes = menu.dishes
+
+    menu_format = MENU_FORMAT_WITH_REFS if include_refs else MENU_FORMAT
+    selected = dishes
+
+    if token_budget is not None:
+        line_tokens = [(dish.ref_line_tokens if include_refs else dish.line_tokens) + 1 for dish in dishes]
+        used_allergens = {allergen for dish in dishes for allergen in dish.allergens}
+        legend_tokens = count_tokens(menu_format) + sum(
+            tokens for allergen, tokens in menu.legend_tokens.items() if allergen in used_allergens
+        )
+        if legend_tokens + sum(line_tokens) > token_budget:
+            category_ranks = Counter()
+            order = []
+            for position, dish in enumerate(dishes):
+                order.append((category_ranks[dish.category], position))
+                category_ranks[dish.category] += 1
+
+            positions = []
+            included_categories = set()
+            used_tokens = legend_tokens
+            for _, position in sorted(order):
+                category = dishes[position].category
+                header_tokens = 0 if category in included_categories else menu.header_tokens[category]
+                if used_tokens + line_tokens[position] + header_tokens > token_budget:
+                    continue
+                used_tokens += line_tokens[position] + header_tokens
+                included_categories.add(category)
+                positions.append(position)
+            selected = [dishes[position] for position in sorted(positions)]
+
+    used_allergens = {allergen for dish in selected for allergen in dish.allergens}
+    legend = ", ".join(
+        f"{code}={allergen}" for allergen, code in menu.allergen_codes.items() if allergen in used_allergens
+    )
+
+    parts = [menu_format]
+    if legend:
+        parts.append(f"Allergen codes: {legend}")
+
+    categories = {}
+    for dish in selected:
+        categories.setdefault(dish.category, []).append(dish.ref_line if include_refs else dish.line)
+    for category, category_lines in categories.items():
+        if category:
+            parts.append(f"## {category}")
+        parts.extend(category_lines)
+
+    text = "\n".join(parts) + "\n"
+    return EncodedMenu(
+        text=text,
+        tokens=count_tokens(text),
+        dish_count=len(selected),
+        omitted_count=len(dishes) - len(selected),
+        baseline_tokens=sum(dish.verbose_tokens for dish in selected),
+    )
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import metrics
+import os
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+from singleflight import (SINGLEFLIGHT_LEASE, SINGLEFLIGHT_LEASE_COLLECTION, SINGLEFLIGHT_LEASE_MAX_WAIT, MongoLease,
+                         SingleFlight, wait_for)
+from typing import Any, Callable, Optional, Tuple
+
+# Seconds a cached model response is considered fresh
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+# Extra seconds during which a stale response is still served while it is refreshed in background
+LLM_CACHE_STALE_TTL = float(os.getenv("LLM_CACHE_STALE_TTL", "0"))
+LLM_CACHE_MAX_SIZE = int(os.getenv("LLM_CACHE_MAX_SIZE", "512"))
+# Persistent tier: "none", "sqlite" or "mongo"
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "none")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/llm_cache.sqlite3")
+LLM_CACHE_COLLECTION = os.getenv("LLM_CACHE_COLLECTION", "llm_response_cache")
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Build a content-addressed cache key.
+    :param parts: values identifying the request (e.g. model name and prompt).
+    :return: SHA-256 hex digest of the JSON encoded parts.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteStore:
+    """
+    Persistent tier backed by a local SQLite file.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, created_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, created_at)
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+class MongoStore:
+    """
+    Persistent tier backed by a MongoDB collection, shared by every container.
+    """
+
+    def __init__(self, collection):
+        """
+        :param collection: pymongo collection (or any compatible stand-in).
+        """
+        self.collection = collection
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        document = self.collection.find_one({"_id": key})
+        return (document["value"], document["createdAt"]) if document else None
+
+    def set(self, key: str, value: str, created_at: float) -> None:
+        self.collection.replace_one({"_id": key}, {"_id": key, "value": value, "createdAt": created_at}, upsert=True)
+
+    def delete(self, key: str) -> None:
+        self.collection.delete_one({"_id": key})
+
+
+class ResponseCache:
+    """
+    Two-tier cache of raw model responses: an in-process LRU and an optional persistent store.
+    """
+
+    def __init__(self, store=None, ttl: float = LLM_CACHE_TTL, stale_ttl: float = LLM_CACHE_STALE_TTL,
+                 max_size: int = LLM_CACHE_MAX_SIZE, lease: Optional[MongoLease] = None,
+                 lease_wait: float = SINGLEFLIGHT_LEASE_MAX_WAIT):
+        """
+        :param store: persistent tier (SQLiteStore, MongoStore or None).
+        :param ttl: seconds a response is fresh.
+        :param stale_ttl: extra seconds a stale response is served while being refreshed.
+        :param max_size: max entries of the in-process tier.
+        :param lease: optional cross-container lease: on a miss only its owner calls the model,
+                      the other containers wait for the response to appear in the store.
+        :param lease_wait: max seconds a container waits for the response of the lease owner.
+        """
+        self.store = store
+        self.lease = lease
+        self.lease_wait = lease_wait
+        self._flight = SingleFlight("LLMResponse")
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.memory = TTLCache(max_size=max_size, ttl=ttl + stale_ttl)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[Optional[str], bool]:
+        """
+        Look up a response in both tiers.
+        :param key: cache key.
+        :return: tuple (response or None, True if the response is still fresh).
+        """
+        entry = self.memory.get(key)
+        if entry is None and self.store is not None:
+            try:
+                entry = self.store.get(key)
+            except Exception as e:
+                print(f"Error while reading the response cache: {e}")
+            if entry is not None:
+                self.memory.set(key, entry)
+
+        if entry is None:
+            metrics.record_cache("LLMResponse", False)
+            return None, False
+
+        value, created_at = entry
+        age = time.time() - created_at
+        if age >= self.ttl + self.stale_ttl:
+            metrics.record_cache("LLMResponse", False)
+            return None, False
+        metrics.record_cache("LLMResponse", True)
+        return value, age < self.ttl
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store a response in both tiers.
+        :param key: cache key.
+        :param value: raw model response.
+        """
+        entry = (value, time.time())
+        self.memory.set(key, entry)
+        if self.store is not None:
+            try:
+                self.store.set(key, *entry)
+            except Exception as e:
+                print(f"Error while writing the response cache: {e}")
+
+    def invalidate(self, key: str) -> None:
+        """
+        Remove a response from both tiers.
+        :param key: cache key.
+        """
+        self.memory.invalidate(key)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[str]],
+                       is_valid: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        Return the cached response, computing (and caching) it on a miss.
+        Stale responses are returned immediately and refreshed in a background thread.
+        Concurrent misses of the same key share one computation (across containers too, with a lease).
+        :param key: cache key.
+        :param compute: function calling the model, returns None (or raises) on failure.
+        :param is_valid: optional check, invalid responses are returned but not cached.
+        :return: model response.
+        """
+        value, fresh = self.get(key)
+        if value is not None:
+            if not fresh:
+                self._refresh_in_background(key, compute, is_valid)
+            return value
+
+        return self._flight.do(key, lambda: self._compute(key, compute, is_valid))
+
+    def _compute(self, key: str, compute: Callable[[], Optional[str]],
+                 is_valid: Optional[Callable[[str], bool]]) -> Optional[str]:
+        leased = False
+        if self.lease is not None and self.store is not None:
+            try:
+                leased = self.lease.acquire(key)
+            except Exception as e:
+                # without the lease this container computes on its own
+                print(f"Error while acquiring the lease: {e}")
+                leased = None
+            if leased is False:
+                # another container is calling the model: wait for its response, then compute if it never comes
+                # (the owner failed and released the lease, or the wait exceeded lease_wait)
+                owner = self._lease_holder(key)
+                value = wait_for(lambda: self._stored(key), min(self.lease.ttl, self.lease_wait),
+                                 still_leased=lambda: owner is not None and self._lease_holder(key) == owner)
+                metrics.record_cache("Lease", value is not None)
+                if value is not None:
+                    return value
+
+        try:
+            value = compute()
+            if value is not None and (is_valid is None or is_valid(value)):
+                self.set(key, value)
+            return value
+        finally:
+            if leased:
+                try:
+                    self.lease.release(key)
+                except Exception as e:
+                    print(f"Error while releasing the lease: {e}")
+
+    def _lease_holder(self, key: str) -> Optional[str]:
+        try:
+            return self.lease.holder(key)
+        except Exception as e:
+            print(f"Error while reading the lease: {e}")
+            return None
+
+    def _stored(self, key: str) -> Optional[str]:
+        try:
+            entry = self.store.get(key)
+        except Exception as e:
+            print(f"Error while reading the response cache: {e}")
+            return None
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            return None
+        self.memory.set(key, entry)
+        return entry[0]
+
+    def _refresh_in_background(self, key: str, compute: Callable[[], Optional[str]],
+                               is_valid: Optional[Callable[[str], bool]]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                value = compute()
+                if value is not None and (is_valid is None or is_valid(value)):
+                    self.set(key, value)
+            except Exception as e:
+                # the stale value is kept until a refresh succeeds
+                print(f"Error while refreshing a cached response: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Return the process-wide response cache, configured from the LLM_CACHE_* environment variables.
+    :return: shared ResponseCache.
+    """
+    global _response_cache
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            store = None
+            lease = None
+            if LLM_CACHE_BACKEND == "sqlite":
+                store = SQLiteStore(LLM_CACHE_PATH)
+            elif LLM_CACHE_BACKEND == "mongo":
+                from fetch_menu import get_client
+                db = get_client()[os.getenv("DATABASE_NAME")]
+                store = MongoStore(db[LLM_CACHE_COLLECTION])
+                if SINGLEFLIGHT_LEASE:
+                    lease = MongoLease(db[SINGLEFLIGHT_LEASE_COLLECTION])
+            _response_cache = ResponseCache(store, lease=lease)
+        return _response_cache
@@ -0,0 +1,161 @@
+import math
+import os
+import re
+
+from collections import Counter
+from preference_filter import FISH_INGREDIENTS, MEAT_INGREDIENTS, NEGATIVE_ANSWERS, normalize
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    from compiled_menu import CompiledDish
+
+# Max number of dishes sent to the model (menus with fewer candidates are sent whole)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "40"))
+# Max estimated tokens of the dishes sent to the model
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "6000"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "con", "del", "della", "delle", "dei", "degli", "allo", "alla", "alle", "agli", "nel", "nella", "per",
+    "una", "uno", "che", "piatto", "piatti", "qualcosa", "preferisco", "vorrei",
+    "the", "and", "with", "for", "dish", "dishes", "something", "prefer", "would", "like",
+}
+
+# Answers matched to the ingredients they imply
+QUERY_EXPANSIONS = {
+    "carne": MEAT_INGREDIENTS,
+    "meat": MEAT_INGREDIENTS,
+    "pesce": FISH_INGREDIENTS,
+    "fish": FISH_INGREDIENTS,
+    "seafood": FISH_INGREDIENTS,
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into normalized terms (accents stripped, stopwords removed, light stemming).
+    :param text: input text.
+    :return: list of terms.
+    """
+    return [
+        token[:-1] if len(token) > 4 and token[-1] in "aeiou" else token
+        for token in re.findall(r"\w+", normalize(text))
+        if len(token) > 2 and token not in STOPWORDS
+    ]
+
+
+def estimate_tokens(dish: "CompiledDish") -> int:
+    """
+    Rough estimate (4 characters per token) of the prompt tokens used by a dish.
+    :param dish: compiled dish.
+    :return: estimated number of tokens.
+    """
+    length = len(dish.name or '') + len(dish.description or '')
+    length += sum(len(text or '') + 2 for text in dish.ingredients)
+    length += sum(len(text or '') + 2 for text in dish.allergens)
+    return length // 4 + 4
+
+
+def preference_query(user_preferences: Dict) -> List[str]:
+    """
+    Build the retrieval query from the user's answers (questions list every option, so they are ignored).
+    :param user_preferences: User preferences (questions and answers).
+    :return: query terms.
+    """
+    terms = []
+    for preference in user_preferences.get('preferences', []):
+        answer = preference.get('answer', '')
+        for text in answer if isinstance(answer, list) else [answer]:
+            text = normalize(text)
+            if not text or text in NEGATIVE_ANSWERS:
+                continue
+            terms.extend(tokenize(text))
+            for word, expansion in QUERY_EXPANSIONS.items():
+                if word in text.split():
+                    terms.extend(tokenize(" ".join(expansion)))
+    return terms
+
+
+class BM25Index:
+    """
+    BM25 index over the dishes of a compiled menu (name, category, description, ingredients).
+    """
+
+    def __init__(self, dishes: List["CompiledDish"]):
+        """
+        :param dishes: every dish of a compiled menu, in menu order.
+        """
+        self.dishes = dishes
+        self.term_frequencies = []
+        self.lengths = []
+        document_frequencies = Counter()
+
+        for dish in dishes:
+            # the name counts twice: it is the most specific field
+            terms = tokenize(dish.name or '') * 2
+            terms += tokenize(dish.category or '')
+            terms += tokenize(dish.description or '')
+            terms += tokenize(" ".join(ingredient or '' for ingredient in dish.ingredients))
+            frequencies = Counter(terms)
+            self.term_frequencies.append(frequencies)
+            self.lengths.append(len(terms))
+            document_frequencies.update(frequencies.keys())
+
+        count = len(dishes)
+        self.average_length = (sum(self.lengths) / count) if count else 0.0
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequencies.items()
+        }
+
+    def score(self, query: List[str], position: int) -> float:
+        """
+        BM25 score of an indexed dish.
+        :param query: query terms.
+        :param position: position of the dish in the menu.
+        :return: score.
+        """
+        frequencies = self.term_frequencies[position]
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / (self.average_length or 1))
+        score = 0.0
+        for term in set(query):
+            frequency = frequencies.get(term)
+            if frequency:
+                score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+        return score
+
+    def top_k(self, query: List[str], candidates: List["CompiledDish"], k: int = RETRIEVAL_TOP_K,
+              token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List["CompiledDish"]:
+        """
+        Select the candidates that best match the query, within k dishes and the token budget.
+        Ties (e.g. an empty query) are broken round-robin across categories to keep the selection varied.
+        :param query: query terms.
+        :param candidates: dishes to rank, a subset of the indexed ones.
+        :param k: max number of dishes.
+        :param token_budget: max estimated prompt tokens of the selected dishes.
+        :return: selected dishes, in menu order.
+        """
+        category_ranks = Counter()
+        ranked = []
+        for dish in candidates:
+            score = self.score(query, dish.position)
+            category_rank = category_ranks[dish.category]
+            category_ranks[dish.category] += 1
+            ranked.append((-score, category_rank, len(ranked), dish))
+        ranked.sort(key=lambda entry: entry[:3])
+
+        selected = []
+        used_tokens = 0
+        for _, _, order, dish in ranked:
+            if len(selected) >= k:
+                break
+            tokens = dish.estimated_tokens
+            if selected and used_tokens + tokens > token_budget:
+                continue
+            used_tokens += tokens
+            selected.append((order, dish))
+
+        return [dish for _, dish in sorted(selected, key=lambda entry: entry[0])]
+
@@ -0,0 +1,179 @@
+import asyncio
+import metrics
+import os
+import threading
+import time
+import uuid
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+# Share one in-flight menu fetch or model call between concurrent identical requests of a process
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "true").lower() in ("1", "true", "yes")
+# Extend the coalescing of the model calls to every container with a MongoDB lease (needs LLM_CACHE_BACKEND=mongo)
+SINGLEFLIGHT_LEASE = os.getenv("SINGLEFLIGHT_LEASE", "false").lower() in ("1", "true", "yes")
+SINGLEFLIGHT_LEASE_COLLECTION = os.getenv("SINGLEFLIGHT_LEASE_COLLECTION", "singleflight_leases")
+# Seconds a lease is held at most (a crashed owner is taken over after this), and between two polls of a waiter
+SINGLEFLIGHT_LEASE_TTL = float(os.getenv("SINGLEFLIGHT_LEASE_TTL", "30"))
+SINGLEFLIGHT_LEASE_POLL = float(os.getenv("SINGLEFLIGHT_LEASE_POLL", "0.25"))
+# Max seconds a container waits for the response of the lease owner, below the API Gateway timeout
+# so that it can still call the model itself
+SINGLEFLIGHT_LEASE_MAX_WAIT = float(os.getenv("SINGLEFLIGHT_LEASE_MAX_WAIT", "10"))
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key between threads: the first caller runs the function,
+    the others wait for it and receive the same result (or exception).
+    """
+
+    def __init__(self, name: str, enabled: bool = SINGLEFLIGHT):
+        """
+        :param name: metric prefix, followers are counted as <name>Coalesced.
+        :param enabled: if False every caller runs the function.
+        """
+        self.name = name
+        self.enabled = enabled
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        """
+        :param key: identity of the call (e.g. cache key).
+        :param function: function computing the result.
+        :return: result of the in-flight call with the same key, or of the function.
+        """
+        if not self.enabled:
+            return function()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.record(f"{self.name}Coalesced", 1)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Async version of SingleFlight: concurrent coroutines with the same key await a single task.
+    A cancelled waiter does not cancel the shared task.
+    """
+
+    def __init__(self, name: str, enabled: bool = SINGLEFLIGHT):
+        self.name = name
+        self.enabled = enabled
+        self._tasks: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Future] = {}
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        """
+        :param key: identity of the call.
+        :param function: coroutine function computing the result.
+        :return: result of the in-flight task with the same key, or of the function.
+        """
+        if not self.enabled:
+            return await function()
+
+        # tasks are bound to their event loop
+        task_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = self._tasks[task_key] = asyncio.ensure_future(function())
+            task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        else:
+            metrics.record(f"{self.name}Coalesced", 1)
+        return await asyncio.shield(task)
+
+
+class MongoLease:
+    """
+    Cross-container lock on a key, stored as a document with an expiry: the owner computes,
+    the other containers wait for the result to appear in a shared store.
+    An expired lease (crashed owner) is taken over by the next caller. A TTL index on "expiresAt"
+    keeps the collection small but is not required for correctness.
+    """
+
+    def __init__(self, collection, ttl: float = SINGLEFLIGHT_LEASE_TTL):
+        """
+        :param collection: pymongo collection (or any compatible stand-in).
+        :param ttl: seconds after which a lease expires.
+        """
+        self.collection = collection
+        self.ttl = ttl
+        self.owner = uuid.uuid4().hex
+
+    def acquire(self, key: str) -> bool:
+        """
+        :return: True if the lease was acquired, False if another container holds it.
+        """
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl)
+        try:
+            self.collection.insert_one({"_id": key, "owner": self.owner, "expiresAt": expires_at})
+            return True
+        except DuplicateKeyError:
+            result = self.collection.update_one(
+                {"_id": key, "expiresAt": {"$lt": now}},
+                {"$set": {"owner": self.owner, "expiresAt": expires_at}},
+            )
+            return result.modified_count == 1
+
+    def release(self, key: str) -> None:
+        self.collection.delete_one({"_id": key, "owner": self.owner})
+
+    def holder(self, key: str) -> Optional[str]:
+        """
+        :return: owner of the lease, None if the lease is released or expired.
+        """
+        document = self.collection.find_one({"_id": key, "expiresAt": {"$gte": datetime.now(timezone.utc)}})
+        return document["owner"] if document else None
+
+
+def wait_for(lookup: Callable[[], Optional[T]], timeout: float, interval: float = SINGLEFLIGHT_LEASE_POLL,
+             still_leased: Optional[Callable[[], bool]] = None) -> Optional[T]:
+    """
+    Poll until lookup returns a value, the timeout expires or the lease is no longer held.
+    :param lookup: function returning the value, None while missing.
+    :param timeout: max seconds to wait.
+    :param interval: seconds between two polls.
+    :param still_leased: optional check, False once the owner released (or lost) the lease: if the owner failed
+                         nothing will ever be stored, so there is no point in waiting.
+    :return: value, None on timeout or if the lease is gone without a value.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        value = lookup()
+        if value is not None or time.monotonic() >= deadline:
+            return value
+        if still_leased is not None and not still_leased():
+            # the owner stores its response before releasing the lease
+            return lookup()
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
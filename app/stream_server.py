@@ -0,0 +1,81 @@
+import local_env  # noqa: F401  (loads .env before the settings are read)
+import argparse
+import json
+import metrics
+
+from cache_watcher import start_watcher
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from main import CORS_HEADERS, stream_events
+from streaming import to_ndjson
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """
+    Serves /generate-questions and /suggest-dishes as NDJSON with chunked transfer encoding:
+    every question or dish is sent as soon as the model completes it.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            return self.send_json(400, {"error": "Malformed JSON body"})
+
+        events = stream_events(self.path, body)
+        if events is None:
+            return self.send_json(400, {"error": "Invalid path"})
+
+        self.send_response(200)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        with metrics.request(self.path) as request_metrics:
+            try:
+                for line in to_ndjson(events):
+                    if "FirstEvent" not in request_metrics.stages:
+                        request_metrics.add_stage("FirstEvent", request_metrics.total_ms())
+                    self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+                    self.wfile.flush()
+            except Exception as e:
+                line = (json.dumps({"error": str(e)}) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local streaming server for the Menu Advisor endpoints.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    start_watcher()
+    server = ThreadingHTTPServer((args.host, args.port), StreamHandler)
+    print(f"Streaming server listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import json
+import re
+
+from typing import Any, Iterator, List
+
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser of a JSON object streamed in chunks: returns the items of the array
+    under the given top-level key as soon as each item is complete.
+    """
+
+    def __init__(self, key: str):
+        """
+        :param key: key of the array (e.g. "questions").
+        """
+        self.key_pattern = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+        self.buffer = ""
+        self.position = 0
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Add a chunk of the response.
+        :param chunk: text chunk.
+        :return: items completed by this chunk.
+        """
+        items = []
+        if self.done:
+            return items
+
+        self.buffer += chunk
+
+        if not self.in_array:
+            match = self.key_pattern.search(self.buffer)
+            if not match:
+                return items
+            self.in_array = True
+            self.position = match.end()
+
+        buffer = self.buffer
+        for index in range(self.position, len(buffer)):
+            char = buffer[index]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 0:
+                        items.append(self._complete_item(index))
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 0:
+                    self.item_start = index
+            elif char in "{[":
+                if self.depth == 0:
+                    self.item_start = index
+                self.depth += 1
+            elif char in "}]":
+                if self.depth == 0:
+                    # end of the array
+                    self.done = True
+                    break
+                self.depth -= 1
+                if self.depth == 0:
+                    items.append(self._complete_item(index))
+
+        self.position = len(buffer)
+        return [item for item in items if item is not None]
+
+    def _complete_item(self, end: int) -> Any:
+        text = self.buffer[self.item_start:end + 1]
+        self.item_start = None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+def stream_chat_completion(client, model: str, system_prompt: str, prompt: str) -> Iterator[str]:
+    """
+    Call the chat completion API with stream=True and yield the content deltas.
+    :param client: OpenAI compatible client.
+    :param model: model name.
+    :param system_prompt: system message.
+    :param prompt: user message.
+    :return: iterator of text chunks.
+    """
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ],
+        response_format={ "type": "json_object" },
+        stream=True
+    )
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def to_ndjson(events: Iterator[dict]) -> Iterator[bytes]:
+    """
+    Encode stream events as newline-delimited JSON.
+    :param events: events to encode.
+    :return: iterator of encoded lines.
+    """
+    for event in events:
+        yield (json.dumps(event) + "\n").encode("utf-8")
@@ -1,30 +1,37 @@
-import os
 import json
+import metrics
 
-from fetch_menu import MenuFetcher
-from openai import OpenAI
-from dotenv import load_dotenv
-from typing import List, Dict, Optional, Union, Any
+from admission import RateLimited, retry_after_seconds
+from compiled_menu import CompiledDish, CompiledMenu, get_compiled_menu
+from fetch_menu import get_menu_fetcher
+from llm_client import LLMError, chat_completion, stream_completion
+from prompt_encoder import encode_menu
+from preference_filter import DietaryConstraints, parse_constraints
+from retrieval import RETRIEVAL_TOP_K, preference_query
+from streaming import JsonArrayStreamParser
+from suggestion_cache import get_suggestions, set_suggestions, suggestion_key
+from typing import Iterator, List, Dict, Optional, Union, Any
 from pydantic import BaseModel, field_validator, ValidationError
 
-load_dotenv()
+SYSTEM_PROMPT = "You are a helpful assistant who suggests dishes based on a menu and the user's preferences."
 
-OPENAI_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-# OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-API_BASE_URL = "https://api.deepseek.com"
-# API_BASE_URL = "https://api.openai.com/v1"
-API_MODEL = "deepseek-chat"
-# API_MODEL = "gpt-4o-mini"
+MAX_SUGGESTIONS = 5
 
 class DishSuggestion(BaseModel):
     suggested_dishes: List[str]
 
+    @field_validator('suggested_dishes', mode='before')
+    @classmethod
+    def coerce_to_strings(cls, v: Any) -> Any:
+        # the model sometimes returns the dish codes as numbers
+        return [str(value) for value in v] if isinstance(v, list) else v
+
     @field_validator('suggested_dishes')
     @classmethod
     def truncate_and_validate(cls, v: List[str]) -> List[str]:
         if len(v) < 1:
             raise ValueError("You must suggest at least one dish.")
-        return v[:5]
+        return v[:MAX_SUGGESTIONS]
 
 def suggest_dishes(merchant_id: str, menu_id: str, language: str, user_preferences: Dict) -> Dict:
     """
@@ -35,161 +42,222 @@ def suggest_dishes(merchant_id: str, menu_id: str, language: str, user_preferenc
     :param user_preferences: User preferences (questions and answers).
     :return: Full dish objects matching suggestions.
     """
-    # 1. Fetch menu from MongoDB
-    menu_fetcher = MenuFetcher()
-    menu_data = menu_fetcher.get_menu(merchant_id)
+    # 1-5. Fetch, compile, pre-filter, retrieval and prompt preparation
+    prepared = prepare_prompt(merchant_id, menu_id, language, user_preferences)
 
-    if not menu_data or len(menu_data) == 0:
-        return {"error": "Menu not found"}
+    if 'error' in prepared:
+        return prepared
 
-    if len(menu_data) == 1 or not menu_id:
-        menu_data = menu_data[0]
-    else:
-        menu_data = next((menu for menu in menu_data if menu['_id'] == menu_id), None)
+    if prepared['prompt'] is None:
+        return {"suggested_dishes": prepared['suggested_dishes']}
+
+    # 6. Integration with the model (DeepSeek, OpenAI as fallback)
+    try:
+        model_response = chat_completion(SYSTEM_PROMPT, prepared['prompt'], merchant_id=merchant_id)
+    except LLMError as e:
+        return {"error": "No response from model", "details": str(e)}
 
-    # 2. Data cleaning
-    cleaned_data = clean_menu_data(menu_data)
+    metrics.debug("Model response", model_response)
 
-    print("\n<< Filtered menu data >>", cleaned_data)
+    # 7. Post-process the suggested dishes
+    with metrics.stage("PostProcess"):
+        result = post_process_suggestions(prepared['menu'], model_response, prepared['constraints'])
+
+    if isinstance(result, dict) and 'suggested_dishes' in result:
+        set_suggestions(prepared['cache_key'], result['suggested_dishes'])
+    return result
+
+def stream_suggestions(merchant_id: str, menu_id: str, language: str, user_preferences: Dict) -> Iterator[Dict]:
+    """
+    Suggest dishes like suggest_dishes, yielding each resolved dish as soon as the model names it.
+    :param merchant_id: Merchant ID.
+    :param menu_id: Menu (variant) ID.
+    :param language: language used for the output.
+    :param user_preferences: User preferences (questions and answers).
+    :return: iterator of events: {"dish": ...}, then {"done": True} (or {"error": ...} when the response of the
+             model is not valid, after the dishes already resolved).
+    """
+    prepared = prepare_prompt(merchant_id, menu_id, language, user_preferences)
 
-    # 3. Preparation of the prompt
-    prompt = create_prompt(cleaned_data, user_preferences, language)
+    if 'error' in prepared:
+        yield prepared
+        return
 
-    print("\n<< Prompt >>", prompt)
+    if prepared['prompt'] is None:
+        for dish in prepared['suggested_dishes']:
+            yield {"dish": dish}
+        yield {"done": True}
+        return
 
-    # 4. Integration with DeepSeek API
-    model_response = call_deepseek_api(prompt)
+    parser = JsonArrayStreamParser('suggested_dishes')
+    content = []
+    count = 0
+    seen = set()
+    suggested_dishes = []
+    try:
+        for chunk in stream_completion(SYSTEM_PROMPT, prepared['prompt'], merchant_id=merchant_id):
+            content.append(chunk)
+            for name in parser.feed(chunk):
+                if count >= MAX_SUGGESTIONS or not isinstance(name, (str, int)):
+                    continue
+                count += 1
+                position = prepared['menu'].find(name)
+                if position is None or position in seen:
+                    continue
+                seen.add(position)
+                for dish in prepared['menu'].resolve([name], prepared['constraints']):
+                    suggested_dishes.append(dish)
+                    yield {"dish": dish}
+    except RateLimited as e:
+        yield {"error": "Too many requests", "retry_after": retry_after_seconds(e.retry_after)}
+        return
+    except Exception as e:
+        print(f"Error while streaming from the model: {e}")
+        yield {"error": "No response from model"}
+        return
 
-    print("\n<< Model response >>", model_response)
+    model_response = "".join(content)
+    metrics.debug("Model response", model_response)
 
-    # 5. Post-process the suggested dishes
-    return post_process_suggestions(menu_data, model_response)
+    # the dishes already sent are kept, but a truncated or invalid response is neither completed nor cached
+    result = post_process_suggestions(prepared['menu'], model_response, prepared['constraints'])
+    if not isinstance(result, dict) or 'error' in result or not suggested_dishes:
+        print(f"Invalid response from the model: {result.get('error') if isinstance(result, dict) else 'empty'}")
+        yield {"error": "Invalid response from model"}
+        return
 
+    set_suggestions(prepared['cache_key'], suggested_dishes)
+    yield {"done": True}
 
-def clean_menu_data(menu_data: Dict) -> Dict:
+def prepare_prompt(merchant_id: str, menu_id: str, language: str, user_preferences: Dict) -> Dict:
     """
-    Extracts and cleans relevant data from the menu.
-    :param menu_data: JSON data of the menu.
-    :return: Cleaned data as a dictionary.
+    Fetch, compile and pre-filter the menu, then build the prompt.
+    :param merchant_id: Merchant ID.
+    :param menu_id: Menu (variant) ID.
+    :param language: language used for the output.
+    :param user_preferences: User preferences (questions and answers).
+    :return: {"error": ...}, or a dict with "menu" (compiled), "constraints", "cache_key" and "prompt"
+             ("prompt" is None when the suggestions are resolved without the model, see "suggested_dishes").
     """
-    cleaned_data = {
-        'dishes': []
-    }
-
-    for category in menu_data.get('categories', []):
-        for item in category.get('items', []):
-            ingredients = [
-                ingredient.get('name', '') for ingredient in item.get('ingredients', [])
-            ]
-            dish = {
-                'id': item.get('id'),
-                'name': item.get('name', ''),
-                'description': item.get('description', ''),
-                'ingredients': ingredients,
-                'allergens': item.get('allergens', []),
-                'price': item.get('price'),
-                'category': category.get('name')  # add the category name
-            }
-            cleaned_data['dishes'].append(dish)
-
-    return cleaned_data
-
-def create_prompt(cleaned_data: Dict, user_preferences: Dict, language: str) -> str:
+    # 1. Fetch menu from MongoDB
+    menu_fetcher = get_menu_fetcher()
+    menu_data = menu_fetcher.get_menu_by_id(merchant_id, menu_id)
+
+    return prepare_menu_prompt(merchant_id, menu_data, language, user_preferences)
+
+def prepare_menu_prompt(merchant_id: str, menu_data: Optional[Dict], language: str, user_preferences: Dict) -> Dict:
     """
-    Creates a prompt for the DeepSeek model based on the cleaned menu data
-    :param cleaned_data
-    :param user_preferences: User preferences (questions and answers).
+    Compile and pre-filter an already fetched menu, then build the prompt.
+    :param merchant_id: Merchant ID.
+    :param menu_data: Menu returned by MenuFetcher.get_menu_by_id.
     :param language: language used for the output.
-    :return: Prompt as string.
+    :param user_preferences: User preferences (questions and answers).
+    :return: see prepare_prompt.
     """
-    prompt = "Based on the following menu and following user preferences:\n\n"
+    if not menu_data:
+        return {"error": "Menu not found"}
 
-    prompt += "Menu:\n"
-    for dish in cleaned_data['dishes']:
-        prompt += f"- Name: {dish['name']}"
-        prompt += f"  Description: {dish['description']}\n"
-        prompt += f"  Ingredients: {', '.join(dish['ingredients'])}\n"
-        prompt += f"  Allergens: {', '.join(dish['allergens'])}\n"
+    # 2. Compiled menu, shared with the post-processing (cached per merchant and menu)
+    menu = get_compiled_menu(merchant_id, menu_data)
 
-    prompt += "\nUser preferences:\n"
-    for preference in user_preferences.get('preferences', []):
-        prompt += f"- Question: {preference['question']}\n"
-        prompt += f"  Answer: {preference['answer']}\n"
+    # Suggestions already given for the same menu and the same answers
+    cache_key = suggestion_key(merchant_id, menu, language, user_preferences)
+    suggested_dishes = get_suggestions(cache_key)
+    if suggested_dishes is not None:
+        return {
+            "menu": menu,
+            "constraints": None,
+            "cache_key": cache_key,
+            "prompt": None,
+            "suggested_dishes": suggested_dishes
+        }
 
-    prompt += (
-        "\nSuggest up to 5 dish names that best suit the user's preferences."
-        "\nThe suggestions are an array of string in which the string is the name of the dish."
-        "\nRespond only with JSON (no markdown or explanations) wrapping suggestions array into 'suggested_dishes' key."
-    )
-    prompt += f"\n\nLanguage of the content: {language}\n"
+    # 3. Deterministic pre-filter of the dishes incompatible with declared allergies and diet
+    with metrics.stage("PreFilter"):
+        constraints = parse_constraints(user_preferences)
+        candidates = menu.compatible_dishes(constraints)
+    metrics.record("CandidateDishes", len(candidates))
 
-    return prompt
+    if len(candidates) <= MAX_SUGGESTIONS:
+        # No need to ask the model: every remaining dish is suggested
+        return {
+            "menu": menu,
+            "constraints": constraints,
+            "cache_key": cache_key,
+            "prompt": None,
+            "suggested_dishes": [dish.output for dish in candidates]
+        }
 
-def call_deepseek_api(prompt: str) -> Optional[str]:
+    # 4. Retrieval of the most relevant candidates, to cap the prompt size on large menus
+    if len(candidates) > RETRIEVAL_TOP_K:
+        with metrics.stage("Retrieval"):
+            candidates = menu.retrieval_index().top_k(preference_query(user_preferences), candidates)
+
+    # 5. Preparation of the prompt
+    with metrics.stage("CreatePrompt"):
+        prompt = create_prompt(menu, candidates, user_preferences, language)
+
+    metrics.debug("Prompt", prompt)
+
+    return {"menu": menu, "constraints": constraints, "cache_key": cache_key, "prompt": prompt}
+
+
+def create_prompt(menu: CompiledMenu, dishes: List[CompiledDish], user_preferences: Dict, language: str) -> str:
     """
-    Call DeepSeek API to generate suggestions.
-    :param prompt: Prompt for the model.
-    :return: List of suggested dishes.
+    Creates a prompt for the DeepSeek model based on the candidate dishes of the compiled menu
+    :param menu: compiled menu.
+    :param dishes: candidate dishes, in menu order.
+    :param user_preferences: User preferences (questions and answers).
+    :param language: language used for the output.
+    :return: Prompt as string.
     """
-    client = OpenAI(
-        api_key=OPENAI_API_KEY,
-        base_url=API_BASE_URL
+    if dishes is menu.dishes:
+        encoded_menu = menu.encoded(include_refs=True)
+    else:
+        encoded_menu = encode_menu(menu, dishes, include_refs=True)
+
+    metrics.record("MenuDishes", encoded_menu.dish_count)
+    metrics.record("MenuOmittedDishes", encoded_menu.omitted_count)
+    metrics.record("MenuTokens", encoded_menu.tokens)
+    metrics.record("MenuBaselineTokens", encoded_menu.baseline_tokens)
+
+    parts = [
+        "Based on the following menu and following user preferences:\n\n",
+        "Menu:\n",
+        encoded_menu.text,
+        "\nUser preferences:\n",
+    ]
+    for preference in user_preferences.get('preferences', []):
+        parts.append(f"- Question: {preference['question']}\n")
+        parts.append(f"  Answer: {preference['answer']}\n")
+
+    parts.append(
+        "\nSuggest up to 5 dishes that best suit the user's preferences."
+        "\nThe suggestions are an array of string in which the string is the code of the dish shown in brackets (e.g. \"d12\")."
+        "\nRespond only with JSON (no markdown or explanations) wrapping suggestions array into 'suggested_dishes' key."
     )
+    parts.append(f"\n\nLanguage of the content: {language}\n")
 
-    try:
-        response = client.chat.completions.create(
-            model=API_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant who suggests dishes based on a menu and the user's preferences."},
-                {"role": "user", "content": prompt},
-            ],
-            response_format={ "type": "json_object" }
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Error while making call to the model: {e}")
-        return None
+    return "".join(parts)
 
-def post_process_suggestions(menu_data: Dict, content: Optional[str]) -> Union[
+def post_process_suggestions(menu: CompiledMenu, content: Optional[str],
+                             constraints: Optional[DietaryConstraints] = None) -> Union[
     Union[Dict[str, str], List[Any], Dict[str, Union[str, Any]]], Any]:
     """
     Filter suggested dishes from the original menu.
-    :param menu_data: Menu data (JSON structure).
-    :param content: String with the names of the suggested dishes (formatted with newlines).
+    :param menu: compiled menu.
+    :param content: JSON string with the codes (or names) of the suggested dishes.
+    :param constraints: Dietary constraints, incompatible dishes are never returned.
     :return: List of complete dishes (with all original fields).
     """
-    suggested_dishes = []
-
     if not content:
-        return suggested_dishes
+        return []
 
     try:
         parsed = json.loads(content)
         validated = DishSuggestion.model_validate(parsed)
-        suggested_dish_names = validated.model_dump()['suggested_dishes']
-
-        for category in menu_data.get('categories', []):
-            for item in category.get('items', []):
-                if item.get('name') in suggested_dish_names:
-                    ingredients = []
-                    for ingredient in item.get('ingredients', []):
-                        ingredients.append({
-                            'id': str(ingredient.get('_id')),
-                            'name': ingredient.get('name')
-                        })
-
-                    # Add the dish with all the original fields
-                    suggested_dishes.append({
-                        'id': str(item.get('_id')),
-                        'name': item.get('name'),
-                        'description': item.get('description'),
-                        'ingredients': ingredients,
-                        'allergens': item.get('allergens', []),
-                        'price': item.get('price'),
-                        'categoryId': str(category.get('_id')),
-                        'categoryName': category.get('name')
-                    })
-        return { "suggested_dishes": suggested_dishes }
+        suggested_dishes = validated.model_dump()['suggested_dishes']
+        return { "suggested_dishes": menu.resolve(suggested_dishes, constraints) }
     except ValidationError as e:
         return {"error": "Schema validation failed", "details": str(e)}
     except json.JSONDecodeError:
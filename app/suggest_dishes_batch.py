@@ -0,0 +1,194 @@
+import json
+import metrics
+
+from compiled_menu import CompiledDish, CompiledMenu, dish_ref, get_compiled_menu
+from fetch_menu import get_menu_fetcher
+from llm_client import LLMError, chat_completion
+from prompt_encoder import encode_menu
+from preference_filter import parse_constraints
+from retrieval import RETRIEVAL_TOP_K, preference_query
+from suggest_dishes import MAX_SUGGESTIONS, DishSuggestion
+from typing import Any, List, Dict, Optional
+from pydantic import BaseModel, field_validator, ValidationError
+
+SYSTEM_PROMPT = "You are a helpful assistant who suggests dishes to each diner of a table based on a menu and their preferences."
+
+# Max number of diners served by a single request
+MAX_DINERS = 20
+
+class DinerSuggestion(BaseModel):
+    diner: int
+    suggested_dishes: List[str] = []
+
+    @field_validator('suggested_dishes', mode='before')
+    @classmethod
+    def coerce_to_strings(cls, v: Any) -> Any:
+        return DishSuggestion.coerce_to_strings(v)
+
+    @field_validator('suggested_dishes')
+    @classmethod
+    def truncate(cls, v: List[str]) -> List[str]:
+        # an empty list is allowed: the other diners of the table are still served
+        return v[:MAX_SUGGESTIONS]
+
+class BatchSuggestion(BaseModel):
+    diners: List[DinerSuggestion]
+
+def suggest_dishes_batch(merchant_id: str, menu_id: str, language: str, diners: List[Dict]) -> Dict:
+    """
+    Suggest dishes to every diner of a table with a single model call: the menu is fetched,
+    compiled and sent once, followed by the preferences of each diner.
+    :param merchant_id: Merchant ID.
+    :param menu_id: Menu (variant) ID.
+    :param language: language used for the output.
+    :param diners: List of {"id": optional diner identifier, "user_preferences": {...}}.
+    :return: {"diners": [{"id": ..., "suggested_dishes": [...]}, ...]}.
+    """
+    menu_fetcher = get_menu_fetcher()
+    menu_data = menu_fetcher.get_menu_by_id(merchant_id, menu_id)
+
+    prepared = prepare_batch_prompt(merchant_id, menu_data, language, diners)
+
+    if 'error' in prepared:
+        return prepared
+
+    model_response = None
+    if prepared['prompt'] is not None:
+        try:
+            model_response = chat_completion(SYSTEM_PROMPT, prepared['prompt'], merchant_id=merchant_id)
+        except LLMError as e:
+            return {"error": "No response from model", "details": str(e)}
+
+    metrics.debug("Model response", model_response)
+
+    with metrics.stage("PostProcess"):
+        return post_process_batch(prepared, model_response)
+
+def prepare_batch_prompt(merchant_id: str, menu_data: Optional[Dict], language: str, diners: List[Dict]) -> Dict:
+    """
+    Compile the menu, pre-filter the dishes of every diner and build the table prompt.
+    Diners left with 5 or fewer compatible dishes are resolved without the model.
+    :param merchant_id: Merchant ID.
+    :param menu_data: Menu returned by MenuFetcher.get_menu_by_id.
+    :param language: language used for the output.
+    :param diners: List of {"id": optional diner identifier, "user_preferences": {...}}.
+    :return: {"error": ...}, or a dict with "diners" (per diner state), "menu" and "prompt" (None if not needed).
+    """
+    if not diners or not isinstance(diners, list):
+        return {"error": "No diners"}
+
+    if len(diners) > MAX_DINERS:
+        return {"error": f"Too many diners (max {MAX_DINERS})"}
+
+    if not menu_data:
+        return {"error": "Menu not found"}
+
+    menu = get_compiled_menu(merchant_id, menu_data)
+
+    states = []
+    menu_positions = set()
+    for position, diner in enumerate(diners):
+        user_preferences = diner.get('user_preferences', {}) if isinstance(diner, dict) else {}
+        constraints = parse_constraints(user_preferences)
+        candidates = menu.compatible_dishes(constraints)
+        state = {
+            "id": diner.get('id', position + 1) if isinstance(diner, dict) else position + 1,
+            "number": position + 1,
+            "user_preferences": user_preferences,
+            "constraints": constraints,
+            "allowed_positions": {dish.position for dish in candidates},
+            "suggested_dishes": None,
+        }
+
+        if len(candidates) <= MAX_SUGGESTIONS:
+            state["suggested_dishes"] = [dish.output for dish in candidates]
+        else:
+            if len(candidates) > RETRIEVAL_TOP_K:
+                candidates = menu.retrieval_index().top_k(preference_query(user_preferences), candidates)
+            menu_positions.update(dish.position for dish in candidates)
+
+        states.append(state)
+
+    pending = [state for state in states if state["suggested_dishes"] is None]
+    if not pending:
+        return {"diners": states, "menu": menu, "prompt": None}
+
+    # The menu is sent once: the union of the candidates of every diner
+    dishes = [menu.dishes[position] for position in sorted(menu_positions)]
+    with metrics.stage("CreatePrompt"):
+        prompt = create_batch_prompt(menu, dishes, pending, language)
+
+    metrics.debug("Prompt", prompt)
+
+    return {"diners": states, "menu": menu, "prompt": prompt}
+
+def create_batch_prompt(menu: CompiledMenu, dishes: List[CompiledDish], diners: List[Dict], language: str) -> str:
+    """
+    Creates a prompt with the menu followed by the preferences of every diner.
+    :param menu: compiled menu.
+    :param dishes: dishes sent to the model, in menu order.
+    :param diners: per diner state (see prepare_batch_prompt).
+    :param language: language used for the output.
+    :return: Prompt as string.
+    """
+    encoded_menu = encode_menu(menu, dishes, include_refs=True)
+    menu_positions = {dish.position for dish in dishes}
+
+    metrics.record("MenuDishes", encoded_menu.dish_count)
+    metrics.record("MenuTokens", encoded_menu.tokens)
+    metrics.record("Diners", len(diners))
+
+    parts = [
+        "Based on the following menu and the preferences of each diner of a table:\n\n",
+        "Menu:\n",
+        encoded_menu.text,
+    ]
+    for diner in diners:
+        parts.append(f"\nDiner {diner['number']} preferences:\n")
+        for preference in diner['user_preferences'].get('preferences', []):
+            parts.append(f"- Question: {preference['question']}\n")
+            parts.append(f"  Answer: {preference['answer']}\n")
+        excluded = sorted(menu_positions - diner['allowed_positions'])
+        if excluded:
+            parts.append(f"  Not allowed (allergies or diet): {', '.join(map(dish_ref, excluded))}\n")
+
+    parts.append(
+        "\nFor each diner, suggest up to 5 dishes that best suit their preferences."
+        "\nThe suggestions are an array of string in which the string is the code of the dish shown in brackets (e.g. \"d12\")."
+        "\nRespond only with JSON (no markdown or explanations) wrapping into 'diners' key an array of objects"
+        " with 'diner' (the diner number) and 'suggested_dishes' (the suggestions array)."
+    )
+    parts.append(f"\n\nLanguage of the content: {language}\n")
+
+    return "".join(parts)
+
+def post_process_batch(prepared: Dict, content: Optional[str]) -> Dict:
+    """
+    Resolve the suggestions of every diner to complete dishes.
+    :param prepared: result of prepare_batch_prompt.
+    :param content: JSON string with the suggestions of every diner.
+    :return: {"diners": [{"id": ..., "suggested_dishes": [...]}, ...]}.
+    """
+    suggestions = {}
+
+    if prepared['prompt'] is not None:
+        if not content:
+            return {"error": "No response from model"}
+        try:
+            validated = BatchSuggestion.model_validate(json.loads(content))
+            for diner in validated.diners:
+                suggestions.setdefault(diner.diner, diner.suggested_dishes)
+        except ValidationError as e:
+            return {"error": "Schema validation failed", "details": str(e)}
+        except json.JSONDecodeError:
+            return {"error": "Malformed JSON in model response"}
+
+    menu = prepared['menu']
+    diners = []
+    for state in prepared['diners']:
+        suggested_dishes = state['suggested_dishes']
+        if suggested_dishes is None:
+            suggested_dishes = menu.resolve(suggestions.get(state['number'], []), state['constraints'])
+        diners.append({"id": state['id'], "suggested_dishes": suggested_dishes})
+
+    return {"diners": diners}
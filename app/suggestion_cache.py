@@ -0,0 +1,82 @@
+import metrics
+import os
+
+from cache import TTLCache
+from cache_watcher import register_invalidation_hook
+from compiled_menu import CompiledMenu
+from preference_filter import normalize
+from response_cache import make_key
+from typing import Dict, Hashable, List, Optional
+
+# Serve the suggestions of a preference profile already answered for the same menu without calling the model
+SUGGESTION_CACHE = os.getenv("SUGGESTION_CACHE", "true").lower() in ("1", "true", "yes")
+SUGGESTION_CACHE_TTL = float(os.getenv("SUGGESTION_CACHE_TTL", "3600"))
+SUGGESTION_CACHE_MAX_SIZE = int(os.getenv("SUGGESTION_CACHE_MAX_SIZE", "1024"))
+
+# Keys: ("suggestions", merchant_id, menu_id, menu content hash, language, preference signature)
+suggestion_cache = TTLCache(max_size=SUGGESTION_CACHE_MAX_SIZE, ttl=SUGGESTION_CACHE_TTL)
+
+
+def preference_signature(user_preferences: Dict) -> str:
+    """
+    Canonical form of a preference set: questions and answers are normalized (case, accents, whitespace)
+    and sorted, so profiles picked from the same possible answers share the signature.
+    :param user_preferences: User preferences (questions and answers).
+    :return: SHA-256 hex digest of the canonical preferences.
+    """
+    pairs = []
+    for preference in user_preferences.get('preferences', []):
+        answer = preference.get('answer', '')
+        answers = answer if isinstance(answer, list) else [answer]
+        pairs.append((normalize(preference.get('question', '')), sorted(normalize(text) for text in answers)))
+    return make_key(sorted(pairs))
+
+
+def suggestion_key(merchant_id: str, menu: CompiledMenu, language: str, user_preferences: Dict) -> Hashable:
+    """
+    :param merchant_id: Merchant ID.
+    :param menu: compiled menu.
+    :param language: language used for the output.
+    :param user_preferences: User preferences (questions and answers).
+    :return: cache key of the suggestions.
+    """
+    return ("suggestions", merchant_id, menu.id, menu.content_hash(), language,
+            preference_signature(user_preferences))
+
+
+def get_suggestions(key: Hashable) -> Optional[List[Dict]]:
+    """
+    :param key: see suggestion_key.
+    :return: cached suggested dishes, None if disabled or missing.
+    """
+    if not SUGGESTION_CACHE:
+        return None
+
+    suggested_dishes = suggestion_cache.get(key)
+    metrics.record_cache("Suggestions", suggested_dishes is not None)
+    return suggested_dishes
+
+
+def set_suggestions(key: Hashable, suggested_dishes: List[Dict]) -> None:
+    """
+    Cache the suggested dishes of a model response (empty results are not cached).
+    :param key: see suggestion_key.
+    :param suggested_dishes: resolved dishes.
+    """
+    if SUGGESTION_CACHE and suggested_dishes:
+        suggestion_cache.set(key, list(suggested_dishes))
+
+
+def invalidate_suggestions(merchant_id: Optional[str] = None) -> int:
+    """
+    Drop the cached suggestions of a merchant (or of every merchant if merchant_id is None).
+    A changed menu gets a new content hash anyway, this only releases the memory early.
+    :param merchant_id: Merchant ID.
+    :return: number of removed entries.
+    """
+    if merchant_id is None:
+        return suggestion_cache.invalidate()
+    return suggestion_cache.invalidate_where(lambda key: key[1] == merchant_id)
+
+
+register_invalidation_hook(invalidate_suggestions)
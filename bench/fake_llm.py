@@ -0,0 +1,156 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+QUESTIONS = {"questions": [
+    {"question": "Do you have any food allergies?", "type": "multi-selection",
+     "possible_answers": ["Gluten", "Lactose", "Nuts", "None"]},
+    {"question": "Are you vegetarian?", "type": "single-selection", "possible_answers": ["Yes", "No"]},
+    {"question": "What are you in the mood for?", "type": "open-text"},
+]}
+DISH_REF = re.compile(r"\[(d\d+)\]")
+
+
+def completion_content(prompt: str) -> str:
+    """
+    Deterministic answer: the fixed questions, or the first dish codes of the prompt
+    (one list per diner for the batch prompt).
+    """
+    if "'diners' key" in prompt:
+        refs = DISH_REF.findall(prompt)[:5]
+        diners = len(re.findall(r"^Diner \d+ preferences:", prompt, re.MULTILINE))
+        return json.dumps({"diners": [{"diner": number, "suggested_dishes": refs}
+                                      for number in range(1, diners + 1)]})
+    if "suggested_dishes" in prompt:
+        return json.dumps({"suggested_dishes": DISH_REF.findall(prompt)[:5]})
+    return json.dumps(QUESTIONS)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI compatible /chat/completions endpoint (plain and streaming) with a fixed latency
+    and usage estimated as 4 characters per token. A share of the requests can fail with
+    `error_status`, to exercise the retries, fallback and circuit breaker of llm_client.
+    """
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: without TCP_NODELAY every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 503
+    chunk_size = 16
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.server.count("requests")
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "".join(message["content"] for message in request["messages"])
+        content = completion_content(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        time.sleep(self.latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            data = json.dumps({"error": {"message": "Injected failure", "type": "server_error"}}).encode("utf-8")
+            self.send_response(self.error_status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(content), self.chunk_size):
+                self.write_chunk({"id": "bench", "object": "chat.completion.chunk", "created": 0,
+                                  "model": request["model"], "choices": [{
+                                      "index": 0, "delta": {"content": content[start:start + self.chunk_size]},
+                                      "finish_reason": None}]})
+            self.write_event(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        data = json.dumps({"id": "bench", "object": "chat.completion", "created": 0, "model": request["model"],
+                           "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                        "finish_reason": "stop"}],
+                           "usage": usage}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, payload):
+        self.write_event(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def write_event(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+
+class CountingHTTPServer(ThreadingHTTPServer):
+    """
+    Threading server that counts the accepted connections and the requests, to check
+    that the clients reuse their connections (keep-alive) under load.
+    """
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = {"connections": 0, "requests": 0}
+        self._counters_lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def process_request(self, request, client_address):
+        self.count("connections")
+        super().process_request(request, client_address)
+
+
+def start(latency: float = 0.0, host: str = "127.0.0.1", port: int = 0, error_rate: float = 0.0,
+          error_status: int = 503) -> Tuple[CountingHTTPServer, str]:
+    """
+    Start the fake server in a daemon thread.
+    :param latency: seconds to wait before answering.
+    :param host: host to bind.
+    :param port: port to bind (0 for a free one).
+    :param error_rate: share of the requests answered with error_status.
+    :param error_status: HTTP status of the failed requests (e.g. 429, 503).
+    :return: (server, base URL for the OpenAI client).
+    """
+    handler = type("Handler", (FakeLLMHandler,),
+                   {"latency": latency, "error_rate": error_rate, "error_status": error_status})
+    server = CountingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI compatible server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of the failed requests")
+    args = parser.parse_args()
+
+    handler = type("Handler", (FakeLLMHandler,),
+                   {"latency": args.latency, "error_rate": args.error_rate, "error_status": args.error_status})
+    print(f"Fake LLM listening on http://{args.host}:{args.port}")
+    CountingHTTPServer((args.host, args.port), handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
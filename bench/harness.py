@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+from typing import Dict, List
+
+from fake_llm import start
+from synthetic import load_merchant, make_merchant
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app")
+
+# Settings of the benchmarked process: in-memory metrics, no persistent cache, no external service,
+# no admission control (a single synthetic merchant would be throttled).
+# mongomock does not support $toObjectId, so the menus are read with the separate queries.
+ENVIRONMENT = {
+    "DATABASE_NAME": "bench",
+    "DEEPSEEK_API_KEY": "bench",
+    "LLM_FALLBACK": "false",
+    "MENU_FETCH_MODE": "queries",
+    "METRICS_EXPORTER": "memory",
+    "LLM_CACHE_BACKEND": "none",
+    "PRECOMPUTED_QUESTIONS": "false",
+    "MENU_CACHE_WATCHER": "false",
+    "DEBUG_PAYLOADS": "false",
+    "ADMISSION_CONTROL": "false",
+}
+
+
+class Harness:
+    """
+    The application wired to an in-memory MongoDB (mongomock) and to the fake LLM server.
+    Must be created before any application module is imported elsewhere.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, admission: bool = False):
+        """
+        :param latency: seconds the fake LLM waits before answering.
+        :param error_rate: share of the fake LLM requests that fail.
+        :param admission: limit the model calls with the admission control (ADMISSION_* settings).
+        """
+        for name, value in ENVIRONMENT.items():
+            os.environ[name] = value
+        if admission:
+            os.environ["ADMISSION_CONTROL"] = "true"
+        if APP_DIR not in sys.path:
+            sys.path.insert(0, APP_DIR)
+
+        import mongomock
+        import fetch_menu
+        import llm_client
+
+        self.client = mongomock.MongoClient()
+        self.db = self.client[ENVIRONMENT["DATABASE_NAME"]]
+        fetch_menu._create_client = lambda: self.client
+        fetch_menu._is_healthy = lambda client: True
+        fetch_menu.reset_client()
+
+        self.server, self.base_url = start(latency, error_rate=error_rate)
+        os.environ["DEEPSEEK_BASE_URL"] = self.base_url
+        llm_client.reset_providers()
+
+    def add_merchant(self, items: int, variants: int = 0, seed: int = 0) -> str:
+        """
+        Insert a synthetic merchant (see synthetic.make_merchant).
+        :return: merchant ID.
+        """
+        return load_merchant(self.db, make_merchant(items, variants, seed))
+
+    def menu_ids(self, merchant_id: str) -> List[str]:
+        import fetch_menu
+        return [menu["id"] for menu in fetch_menu.get_menu_fetcher().get_menu(merchant_id)]
+
+    def reset_caches(self) -> None:
+        """
+        Drop every in-process cache (menus, compiled menus, model responses and suggestions).
+        """
+        import fetch_menu
+        import response_cache
+        import suggestion_cache
+
+        fetch_menu.invalidate_menu()
+        response_cache.get_response_cache().memory.invalidate()
+        suggestion_cache.invalidate_suggestions()
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+def lambda_event(path: str, body: Dict) -> Dict:
+    """
+    API Gateway proxy event for lambda_handler.
+    """
+    return {"httpMethod": "POST", "path": path, "body": json.dumps(body)}
@@ -0,0 +1,417 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from harness import ENVIRONMENT, Harness, lambda_event
+from run import git_commit, percentile
+from synthetic import load_merchant, make_merchant, make_preferences
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Invocation endpoint of the Lambda runtime interface emulator (docker run -p 9000:8080 ...)
+INVOCATIONS_PATH = "/2015-03-31/functions/function/invocations"
+
+DEFAULT_MIX = "/generate-questions=3,/suggest-dishes=6,/suggest-dishes-batch=1"
+# Count metrics summed over the requests of an in-process run (cache hits, coalesced calls, retries...)
+COUNTER_SUFFIXES = (
+    "CacheHit", "CacheMiss", "Coalesced", "Retries", "Hedges", "Fallbacks", "Errors", "Queued", "Rejected"
+)
+
+
+def read_http_file(path: str) -> List[Dict]:
+    """
+    Parse the requests of a JetBrains/VS Code .http file (see api/) into API Gateway events.
+    """
+    with open(path) as file:
+        content = file.read()
+
+    events = []
+    for block in re.split(r"^###.*$", content, flags=re.MULTILINE):
+        match = re.search(r"^(GET|POST|PUT|DELETE|OPTIONS)\s+\S*?(/[\w\-/]*)\s*$", block, re.MULTILINE)
+        if not match:
+            continue
+        body_start = block.find("{", match.end())
+        body = json.loads(block[body_start:]) if body_start >= 0 else {}
+        events.append({"httpMethod": match.group(1), "path": match.group(2), "body": json.dumps(body)})
+    return events
+
+
+def read_events(path: str) -> List[Dict]:
+    """
+    Load recorded events: a .http file, or JSON lines of API Gateway proxy events
+    ({"httpMethod", "path", "body"} with body as a string or an object).
+    """
+    if path.endswith(".http"):
+        return read_http_file(path)
+
+    events = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if not isinstance(event.get("body"), str):
+                event["body"] = json.dumps(event.get("body") or {})
+            event.setdefault("httpMethod", "POST")
+            events.append(event)
+    return events
+
+
+class Traffic:
+    """
+    Synthetic traffic over a set of merchants: a weighted mix of endpoints, merchants picked with a
+    Zipf-like skew (a few busy restaurants) and preferences drawn from a small pool of profiles,
+    as diners answer the same generated questions.
+    """
+
+    def __init__(self, merchants: List[Tuple[str, List[str]]], mix: Dict[str, float], profiles: int,
+                 skew: float, diners: int, seed: int = 0):
+        """
+        :param merchants: (merchant ID, menu IDs) of every merchant.
+        :param mix: endpoint path -> weight.
+        :param profiles: number of distinct preference profiles.
+        :param skew: Zipf exponent of the merchant popularity (0 for uniform).
+        :param diners: max diners of a table (batch requests).
+        :param seed: random seed.
+        """
+        self.merchants = merchants
+        self.paths = list(mix)
+        self.path_weights = [mix[path] for path in self.paths]
+        self.merchant_weights = [1 / (rank + 1) ** skew for rank in range(len(merchants))]
+        self.profiles = [make_preferences(seed + index) for index in range(profiles)]
+        with open(os.path.join(ROOT_DIR, "dev", "preferences.json")) as file:
+            self.profiles.append(json.load(file))
+        self.diners = diners
+        self.rng = random.Random(seed)
+
+    def event(self) -> Dict:
+        path = self.rng.choices(self.paths, self.path_weights)[0]
+        merchant_id, menu_ids = self.rng.choices(self.merchants, self.merchant_weights)[0]
+        body = {"merchant_id": merchant_id, "menu_id": self.rng.choice(menu_ids), "language": "en"}
+        if path == "/suggest-dishes":
+            body["user_preferences"] = self.rng.choice(self.profiles)
+        elif path == "/suggest-dishes-batch":
+            body["diners"] = [{"id": str(number), "user_preferences": self.rng.choice(self.profiles)}
+                              for number in range(1, self.rng.randint(2, self.diners) + 1)]
+        return lambda_event(path, body)
+
+    def events(self, count: int) -> List[Dict]:
+        return [self.event() for _ in range(count)]
+
+
+def remap_events(events: List[Dict], merchants: List[Tuple[str, List[str]]]) -> List[Dict]:
+    """
+    Point recorded events at the synthetic merchants: every recorded merchant is mapped to one of them
+    (stable across events) and unknown menu IDs to one of its menus.
+    """
+    remapped = []
+    for event in events:
+        body = json.loads(event.get("body") or "{}")
+        if "merchant_id" in body:
+            digest = hashlib.sha256(str(body["merchant_id"]).encode("utf-8")).digest()
+            merchant_id, menu_ids = merchants[int.from_bytes(digest[:4], "big") % len(merchants)]
+            body["merchant_id"] = merchant_id
+            if body.get("menu_id") not in menu_ids:
+                body["menu_id"] = menu_ids[digest[4] % len(menu_ids)]
+        remapped.append({**event, "body": json.dumps(body)})
+    return remapped
+
+
+def in_process_target(harness: Harness) -> Callable[[Dict], int]:
+    """
+    Call main.lambda_handler in this process: every worker thread shares the caches, the connection pools
+    and the in-flight coalescing, like one long running server (stream_server.py, asgi.py).
+    """
+    import main
+
+    def invoke(event: Dict) -> int:
+        return main.lambda_handler(event, None)["statusCode"]
+    return invoke
+
+
+def http_target(url: str, timeout: float) -> Callable[[Dict], int]:
+    """
+    POST the events to the runtime interface emulator of the Lambda container image (see dev/Dockerfile).
+    The emulator runs one invocation at a time, like a single Lambda execution environment.
+    """
+    invocations_url = url.rstrip("/") + INVOCATIONS_PATH
+
+    def invoke(event: Dict) -> int:
+        request = urllib.request.Request(invocations_url, data=json.dumps(event).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                payload = json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code
+        return payload.get("statusCode", 502) if isinstance(payload, dict) else 502
+    return invoke
+
+
+class Recorder:
+    """
+    Collects the outcome of every request.
+    """
+
+    def __init__(self):
+        self.samples: List[Tuple[str, float, str]] = []
+        self._lock = threading.Lock()
+
+    def call(self, invoke: Callable[[Dict], int], event: Dict, started_at: Optional[float] = None) -> None:
+        """
+        :param invoke: target.
+        :param event: API Gateway event.
+        :param started_at: scheduled start (open loop), so the time spent waiting for a free worker is counted.
+        """
+        started_at = started_at or time.perf_counter()
+        try:
+            outcome = str(invoke(event))
+        except Exception as e:
+            outcome = type(e).__name__
+        latency = (time.perf_counter() - started_at) * 1000
+        with self._lock:
+            self.samples.append((event.get("path"), latency, outcome))
+
+
+def run_closed_loop(invoke: Callable[[Dict], int], events: Iterator[Dict], concurrency: int,
+                    deadline: float, recorder: Recorder) -> None:
+    """
+    Each of the workers sends its next request as soon as the previous one completes.
+    """
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                event = next(events, None)
+            if event is None:
+                return
+            recorder.call(invoke, event)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(invoke: Callable[[Dict], int], events: Iterator[Dict], rate: float, poisson: bool,
+                  max_in_flight: int, deadline: float, recorder: Recorder, seed: int = 0) -> None:
+    """
+    Requests start at the target rate whatever the latency (uniform or Poisson arrivals),
+    up to max_in_flight at a time; the latency includes the wait for a free worker.
+    """
+    rng = random.Random(seed)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        scheduled_at = time.perf_counter()
+        for event in events:
+            if scheduled_at >= deadline:
+                break
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(recorder.call, invoke, event, scheduled_at)
+            scheduled_at += rng.expovariate(rate) if poisson else 1 / rate
+
+
+def summarize(samples: List[Tuple[str, float, str]], elapsed: float) -> Dict:
+    """
+    :return: count, error rate, status codes, throughput and latency percentiles (milliseconds).
+    """
+    latencies = [latency for _, latency, _ in samples]
+    outcomes = Counter(outcome for _, _, outcome in samples)
+    errors = sum(count for outcome, count in outcomes.items() if outcome != "200")
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "outcomes": dict(outcomes),
+        "throughput_per_s": round(len(samples) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "p90_ms": round(percentile(latencies, 0.9), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "max_ms": round(max(latencies), 3) if latencies else None,
+    }
+
+
+def app_counters(exporter) -> Dict[str, float]:
+    """
+    Sum the cache, coalescing, retry and admission counters of the requests collected in process.
+    """
+    totals = defaultdict(float)
+    for request in exporter.requests:
+        for name, value in request.values.items():
+            if name.endswith(COUNTER_SUFFIXES):
+                totals[name] += value
+    return dict(sorted(totals.items()))
+
+
+def mongo_connections(db) -> Optional[Dict]:
+    """
+    :return: current and total created connections of the MongoDB server, None if not available.
+    """
+    try:
+        connections = db.command("serverStatus")["connections"]
+    except Exception:
+        return None
+    return {"current": connections.get("current"), "totalCreated": connections.get("totalCreated")}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        path, _, weight = part.partition("=")
+        weights[path.strip()] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay or synthesize API Gateway events against lambda_handler.")
+    parser.add_argument("--target", default="inprocess",
+                        help="'inprocess' (mongomock and the fake LLM in this process) or the URL of the Lambda "
+                             "runtime container (e.g. http://localhost:9000)")
+    parser.add_argument("--events", help="recorded events to replay: JSON lines of API Gateway events or a .http file")
+    parser.add_argument("--keep-ids", action="store_true",
+                        help="send the recorded merchant and menu IDs as they are instead of the synthetic ones")
+    parser.add_argument("--record", help="write the events sent to this JSON lines file, to replay them later")
+    parser.add_argument("--requests", type=int, default=1000, help="max requests")
+    parser.add_argument("--duration", type=float, default=60.0, help="max seconds")
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="requests sent one at a time before the measurement (cold start, caches)")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed loop workers (ignored with --rate)")
+    parser.add_argument("--rate", type=float, help="open loop: requests per second")
+    parser.add_argument("--arrivals", choices=["uniform", "poisson"], default="poisson", help="open loop arrivals")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="open loop: max concurrent requests")
+    parser.add_argument("--merchants", type=int, default=20, help="synthetic merchants")
+    parser.add_argument("--items", type=int, default=200, help="dishes per synthetic merchant")
+    parser.add_argument("--variants", type=int, default=2, help="menu variants per synthetic merchant")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights of the synthetic traffic")
+    parser.add_argument("--profiles", type=int, default=8, help="distinct preference profiles")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of the merchant popularity")
+    parser.add_argument("--diners", type=int, default=6, help="max diners of a batch request")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds the fake LLM waits before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the fake LLM requests that fail")
+    parser.add_argument("--admission", action="store_true",
+                        help="in process: limit the model calls with the admission control (ADMISSION_* settings)")
+    parser.add_argument("--mongo-uri", help="runtime container: MongoDB where the synthetic merchants are loaded")
+    parser.add_argument("--fake-llm-host", default="0.0.0.0", help="runtime container: fake LLM bind address")
+    parser.add_argument("--fake-llm-port", type=int, default=8765, help="runtime container: fake LLM port")
+    parser.add_argument("--timeout", type=float, default=30.0, help="runtime container: seconds per invocation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file (default: results/load-<commit>.json)")
+    args = parser.parse_args()
+
+    harness = None
+    exporter = None
+    db = None
+    fake_llm = None
+    merchants = []
+
+    if args.target == "inprocess":
+        harness = Harness(latency=args.latency, error_rate=args.error_rate, admission=args.admission)
+        fake_llm = harness.server
+        import metrics
+        exporter = metrics.InMemoryExporter()
+        metrics.set_exporter(exporter)
+        for index in range(args.merchants):
+            merchant_id = harness.add_merchant(args.items, args.variants, seed=args.seed + index)
+            merchants.append((merchant_id, harness.menu_ids(merchant_id)))
+        invoke = in_process_target(harness)
+    else:
+        from fake_llm import start
+        fake_llm, base_url = start(args.latency, args.fake_llm_host, args.fake_llm_port, args.error_rate)
+        print(f"Fake LLM listening on {base_url}: run the container with DEEPSEEK_BASE_URL pointing to it "
+              f"(e.g. http://host.docker.internal:{args.fake_llm_port}) and LLM_FALLBACK=false")
+        if args.mongo_uri:
+            from pymongo import MongoClient
+            db = MongoClient(args.mongo_uri)[os.getenv("DATABASE_NAME", ENVIRONMENT["DATABASE_NAME"])]
+            for index in range(args.merchants):
+                documents = make_merchant(args.items, args.variants, seed=args.seed + index)
+                if db["users"].find_one({"_id": documents["users"][0]["_id"]}) is None:
+                    load_merchant(db, documents)
+                menu_ids = [variant["id"] for variant in documents["menu_variants"]] or ["menu"]
+                merchants.append((str(documents["users"][0]["_id"]), menu_ids))
+        invoke = http_target(args.target, args.timeout)
+
+    if args.events:
+        events = read_events(args.events)
+        if not args.keep_ids:
+            if not merchants:
+                parser.error("--events against a container needs --mongo-uri or --keep-ids")
+            events = remap_events(events, merchants)
+        events = [events[index % len(events)] for index in range(args.warmup + args.requests)]
+    else:
+        if not merchants:
+            parser.error("synthetic traffic against a container needs --mongo-uri")
+        traffic = Traffic(merchants, parse_mix(args.mix), args.profiles, args.skew, args.diners, args.seed)
+        events = traffic.events(args.warmup + args.requests)
+
+    if args.record:
+        with open(args.record, "w") as file:
+            for event in events:
+                file.write(json.dumps(event) + "\n")
+
+    for event in events[:args.warmup]:
+        invoke(event)
+    events = events[args.warmup:]
+    if exporter is not None:
+        exporter.clear()
+
+    mongo_before = mongo_connections(db) if db is not None else None
+    recorder = Recorder()
+    started_at = time.perf_counter()
+    deadline = started_at + args.duration
+    if args.rate:
+        run_open_loop(invoke, iter(events), args.rate, args.arrivals == "poisson", args.max_in_flight, deadline,
+                      recorder, args.seed)
+    else:
+        run_closed_loop(invoke, iter(events), args.concurrency, deadline, recorder)
+    elapsed = time.perf_counter() - started_at
+
+    by_path = defaultdict(list)
+    for sample in recorder.samples:
+        by_path[sample[0]].append(sample)
+    report = {
+        "total": summarize(recorder.samples, elapsed),
+        "endpoints": {path: summarize(samples, elapsed) for path, samples in sorted(by_path.items())},
+        "connections": {"fake_llm": dict(fake_llm.counters)},
+    }
+    if db is not None:
+        report["connections"]["mongodb"] = {"before": mongo_before, "after": mongo_connections(db)}
+    if exporter is not None:
+        report["app_counters"] = app_counters(exporter)
+
+    for name, summary in [("total", report["total"]), *report["endpoints"].items()]:
+        print(f"{name:<24} {summary['requests']:>6} req  {summary['throughput_per_s'] or 0:>8.1f}/s  "
+              f"errors {summary['error_rate']:>6.1%}  p50 {summary['p50_ms'] or 0:>9.1f} ms  "
+              f"p90 {summary['p90_ms'] or 0:>9.1f} ms  p99 {summary['p99_ms'] or 0:>9.1f} ms  "
+              f"max {summary['max_ms'] or 0:>9.1f} ms  {summary['outcomes']}")
+    print(f"connections {report['connections']}")
+    if exporter is not None:
+        print(f"app counters {report['app_counters']}")
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({"commit": commit, "config": vars(args), **report}, file, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if harness is not None:
+        harness.close()
+    else:
+        fake_llm.shutdown()
+
+
+if __name__ == "__main__":
+    main()
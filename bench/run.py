@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from harness import Harness, lambda_event
+from synthetic import make_preferences
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_SIZES = "20,100,500,1000,5000"
+DEFAULT_VARIANTS = "0,4"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def measure(function: Callable[[], object], iterations: int, before: Optional[Callable[[], None]] = None) -> Dict:
+    """
+    Time a function, then run it once more under tracemalloc.
+    :param function: code to measure.
+    :param iterations: timed runs.
+    :param before: untimed code run before every call (e.g. dropping the caches).
+    :return: latency percentiles (milliseconds), throughput (calls per second) and peak allocated KiB.
+    """
+    latencies = []
+    for _ in range(iterations):
+        if before:
+            before()
+        started_at = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+    if before:
+        before()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "throughput_per_s": round(1000 * len(latencies) / sum(latencies), 1) if sum(latencies) else None,
+        "peak_alloc_kib": round(peak / 1024, 1),
+    }
+
+
+def request_tokens(exporter) -> Dict:
+    """
+    Token metrics of the last request collected by the in-memory exporter.
+    """
+    values = exporter.requests[-1].values if exporter.requests else {}
+    return {name: values[name] for name in ("MenuTokens", "PromptTokens", "CompletionTokens") if name in values}
+
+
+def bench_merchant(harness: Harness, items: int, variants: int, iterations: int) -> List[Dict]:
+    import generate_questions as questions
+    import main
+    import metrics
+    import suggest_dishes as suggestions
+    from compiled_menu import CompiledMenu, get_compiled_menu
+    from fetch_menu import get_menu_fetcher
+    from preference_filter import parse_constraints
+    from prompt_encoder import count_tokens
+    from suggestion_cache import invalidate_suggestions
+
+    merchant_id = harness.add_merchant(items, variants)
+    fetcher = get_menu_fetcher()
+    preferences = make_preferences(items)
+    exporter = metrics.InMemoryExporter()
+    metrics.set_exporter(exporter)
+
+    harness.reset_caches()
+    categories = fetcher.get_categories_for_menu_by_user_id(merchant_id)
+    menu_variants = fetcher.get_variants_list(merchant_id)
+    menus = fetcher.get_menu(merchant_id)
+    menu = max(menus, key=lambda m: sum(len(c.get("items", [])) for c in m["categories"]))
+    menu_id = menu["id"]
+    compiled = get_compiled_menu(merchant_id, menu)
+    questions_prompt = questions.create_prompt(compiled, "en")
+    prepared = suggestions.prepare_menu_prompt(merchant_id, menu, "en", preferences)
+    suggestions_content = json.dumps({"suggested_dishes": [dish.ref for dish in compiled.dishes[:5]]})
+    constraints = parse_constraints(preferences)
+
+    def handler(path: str, body: Dict) -> Callable[[], None]:
+        event = lambda_event(path, {"merchant_id": merchant_id, "menu_id": menu_id, "language": "en", **body})
+
+        def call():
+            response = main.lambda_handler(event, None)
+            assert response["statusCode"] == 200, response["body"]
+        return call
+
+    stages = {
+        "get_menu": (lambda: fetcher.get_menu(merchant_id, use_cache=False), None, None),
+        "build_menus": (lambda: fetcher.build_menus(categories, menu_variants), None, None),
+        "compile_menu": (lambda: CompiledMenu(menu), None, None),
+        "questions_prompt": (lambda: questions.create_prompt(compiled, "en"), None,
+                             {"PromptTokens": count_tokens(questions_prompt)}),
+        "suggest_prepare": (lambda: suggestions.prepare_menu_prompt(merchant_id, menu, "en", preferences), None,
+                            {"PromptTokens": count_tokens(prepared["prompt"]) if prepared.get("prompt") else 0}),
+        "post_process_suggestions": (lambda: suggestions.post_process_suggestions(
+            compiled, suggestions_content, constraints), None, None),
+        "lambda_generate_questions_cold": (handler("/generate-questions", {}), harness.reset_caches, "request"),
+        "lambda_generate_questions_warm": (handler("/generate-questions", {}), None, "request"),
+        "lambda_suggest_dishes_cold": (handler("/suggest-dishes", {"user_preferences": preferences}),
+                                       harness.reset_caches, "request"),
+        "lambda_suggest_dishes_warm": (handler("/suggest-dishes", {"user_preferences": preferences}),
+                                       invalidate_suggestions, "request"),
+        "lambda_suggest_dishes_repeat": (handler("/suggest-dishes", {"user_preferences": preferences}), None,
+                                         "request"),
+    }
+
+    results = []
+    for stage, (function, before, tokens) in stages.items():
+        function()  # warm up
+        result = {"items": items, "variants": variants, "menus": len(menus), "stage": stage,
+                  **measure(function, iterations, before)}
+        result["tokens"] = request_tokens(exporter) if tokens == "request" else (tokens or {})
+        results.append(result)
+        print(f"{items:>6} items {variants:>2} variants  {stage:<32} p50 {result['p50_ms']:>9.3f} ms  "
+              f"p99 {result['p99_ms']:>9.3f} ms  {result['throughput_per_s'] or 0:>9.1f}/s  "
+              f"peak {result['peak_alloc_kib']:>9.1f} KiB  {result['tokens']}")
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline_path: str) -> None:
+    """
+    Print the p50 change of every stage against a previous results file.
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    previous = {(r["items"], r["variants"], r["stage"]): r for r in baseline["results"]}
+
+    print(f"\nComparison with {baseline_path} ({baseline.get('commit')}):")
+    for result in results:
+        old = previous.get((result["items"], result["variants"], result["stage"]))
+        if old and old["p50_ms"]:
+            change = result["p50_ms"] / old["p50_ms"] - 1
+            print(f"{result['items']:>6} items {result['variants']:>2} variants  {result['stage']:<32} "
+                  f"p50 {old['p50_ms']:>9.3f} -> {result['p50_ms']:>9.3f} ms ({change:+.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the menu pipeline on synthetic merchants.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated number of items per merchant")
+    parser.add_argument("--variants", default=DEFAULT_VARIANTS, help="comma separated number of menu variants")
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs per stage")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake LLM waits before answering")
+    parser.add_argument("--output", help="results file (default: results/<commit>.json)")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    harness = Harness(latency=args.latency)
+    results = []
+    try:
+        for items in [int(size) for size in args.sizes.split(",")]:
+            for variants in [int(count) for count in args.variants.split(",")]:
+                results.extend(bench_merchant(harness, items, variants, args.iterations))
+    finally:
+        harness.close()
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "results": results,
+        }, file, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
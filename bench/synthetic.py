@@ -0,0 +1,88 @@
+import random
+
+from bson import ObjectId
+from typing import Dict, List
+
+INGREDIENTS = [
+    "pomodoro", "mozzarella", "basilico", "farina", "uova", "parmigiano", "guanciale", "pecorino", "pepe",
+    "salmone", "tonno", "gamberi", "vongole", "manzo", "pollo", "maiale", "prosciutto", "funghi", "zucchine",
+    "melanzane", "peperoni", "cipolla", "aglio", "olio", "burro", "panna", "latte", "riso", "patate", "rucola",
+    "noci", "pistacchio", "nocciole", "sesamo", "soia", "sedano", "senape", "limone", "zucchero", "cioccolato",
+]
+ALLERGENS = ["Glutine", "Latte", "Uova", "Pesce", "Crostacei", "Molluschi", "Frutta a guscio", "Sesamo",
+             "Soia", "Sedano", "Senape"]
+CATEGORY_NAMES = ["Antipasti", "Primi", "Secondi", "Contorni", "Pizze", "Dolci", "Bevande", "Vini"]
+ITEMS_PER_CATEGORY = 20
+
+
+def make_merchant(items: int, variants: int = 0, seed: int = 0) -> Dict[str, List[Dict]]:
+    """
+    Generate the documents of a synthetic merchant.
+    :param items: total number of dishes.
+    :param variants: number of menu variants (0 for a single menu); about half of the categories
+                     and a fifth of the dishes are restricted to a random subset of them.
+    :param seed: random seed, the same arguments always produce the same documents.
+    :return: {"users": [...], "categories": [...], "menu_variants": [...]}.
+    """
+    rng = random.Random(f"{items}-{variants}-{seed}")
+    merchant_id = ObjectId(f"{seed:08x}{items:08x}{variants:08x}")
+
+    menu_variants = [
+        {"_id": ObjectId(), "id": f"variant-{index}", "name": f"Variant {index}", "merchantID": str(merchant_id)}
+        for index in range(variants)
+    ]
+
+    def pick_variants() -> List[Dict]:
+        count = rng.randint(1, len(menu_variants))
+        return [{"id": variant["id"]} for variant in rng.sample(menu_variants, count)]
+
+    categories = []
+    for start in range(0, items, ITEMS_PER_CATEGORY):
+        position = len(categories)
+        category = {
+            "_id": ObjectId(),
+            "name": f"{CATEGORY_NAMES[position % len(CATEGORY_NAMES)]} {position // len(CATEGORY_NAMES) + 1}",
+            "variants": pick_variants() if menu_variants and rng.random() < 0.5 else [],
+            "items": [],
+        }
+        for number in range(start, min(start + ITEMS_PER_CATEGORY, items)):
+            ingredients = rng.sample(INGREDIENTS, rng.randint(2, 7))
+            category["items"].append({
+                "_id": ObjectId(),
+                "id": f"item-{number}",
+                "name": f"{rng.choice(ingredients).capitalize()} {number}",
+                "description": " ".join(rng.sample(INGREDIENTS, rng.randint(4, 12))).capitalize() + ".",
+                "ingredients": [{"_id": ObjectId(), "name": name} for name in ingredients],
+                "allergens": rng.sample(ALLERGENS, rng.randint(0, 3)),
+                "price": round(rng.uniform(3, 40), 2),
+                "variants": pick_variants() if menu_variants and rng.random() < 0.2 else [],
+            })
+        categories.append(category)
+
+    user = {"_id": merchant_id, "merchantInfo": {"categories": [str(category["_id"]) for category in categories]}}
+    return {"users": [user], "categories": categories, "menu_variants": menu_variants}
+
+
+def load_merchant(db, documents: Dict[str, List[Dict]]) -> str:
+    """
+    Insert the documents of a synthetic merchant.
+    :param db: MongoDB database (or mongomock).
+    :param documents: result of make_merchant.
+    :return: merchant ID.
+    """
+    for collection, collection_documents in documents.items():
+        if collection_documents:
+            db[collection].insert_many(collection_documents)
+    return str(documents["users"][0]["_id"])
+
+
+def make_preferences(seed: int = 0) -> Dict:
+    """
+    Deterministic user preferences with one allergy and one diet answer.
+    """
+    rng = random.Random(seed)
+    return {"preferences": [
+        {"question": "Do you have any food allergies?", "answer": rng.choice(ALLERGENS)},
+        {"question": "Are you vegetarian?", "answer": rng.choice(["Yes", "No"])},
+        {"question": "What are you in the mood for?", "answer": rng.choice(CATEGORY_NAMES)},
+    ]}
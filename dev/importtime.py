@@ -0,0 +1,62 @@
+import argparse
+import os
+import subprocess
+import sys
+
+from typing import Dict
+
+# Imported by every interpreter, not by the application
+STDLIB_BOOTSTRAP = {"site", "encodings", "_frozen_importlib_external", "io", "zipimport", "_signal", "main"}
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app")
+
+# What a cold start imports: the handler module (Lambda init), then the modules of the first request
+SCENARIOS = {
+    "init (import main)": "import main",
+    "init + /generate-questions": "import main; getattr(main, 'load_route', print)('/generate-questions')",
+    "init + /suggest-dishes": "import main; getattr(main, 'load_route', print)('/suggest-dishes')",
+    "init + /suggest-dishes + model client": "import main; getattr(main, 'load_route', print)('/suggest-dishes'); "
+                                             "import llm_client; llm_client.get_client('key', 'http://localhost')",
+}
+
+
+def importtime(code: str, python: str) -> Dict[str, int]:
+    """
+    Run code in a fresh interpreter with -X importtime.
+    :return: cumulative import time (microseconds) per top-level package, under "total" the whole run.
+    """
+    env = {**os.environ, "AWS_LAMBDA_FUNCTION_NAME": "importtime", "DATABASE_NAME": "importtime"}
+    result = subprocess.run([python, "-X", "importtime", "-c", code], cwd=APP_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    packages = {"total": 0}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        # the outermost import of a package includes its submodules and dependencies
+        packages[package] = max(packages.get(package, 0), int(cumulative))
+        if not name.startswith("  "):
+            packages["total"] += int(cumulative)
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start import time report (python -X importtime).")
+    parser.add_argument("--python", default=sys.executable)
+    parser.add_argument("--runs", type=int, default=5, help="runs per scenario, the median is reported")
+    parser.add_argument("--top", type=int, default=8, help="slowest top-level imports listed per scenario")
+    args = parser.parse_args()
+
+    print("| Scenario | Total import time (ms) | Slowest packages, including their dependencies (ms) |")
+    print("|---|---:|---|")
+    for scenario, code in SCENARIOS.items():
+        runs = sorted((importtime(code, args.python) for _ in range(args.runs)), key=lambda run: run["total"])
+        packages = runs[len(runs) // 2]
+        total = packages.pop("total")
+        slowest = sorted(((us, name) for name, us in packages.items() if name not in STDLIB_BOOTSTRAP), reverse=True)
+        listed = ", ".join(f"`{name}` {us / 1000:.1f}" for us, name in slowest[:args.top])
+        print(f"| {scenario} | {total / 1000:.1f} | {listed} |")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+# The application modules are imported like in the Lambda task root (app/ on the path)
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app")
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bench")
+for path in (APP_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from harness import ENVIRONMENT, Harness  # noqa: E402
+
+# Settings are read when the modules are imported: apply the benchmark ones before any test imports them
+os.environ.update(ENVIRONMENT)
+
+
+@pytest.fixture(scope="session")
+def harness():
+    """
+    The application wired to mongomock and to the fake LLM server (see bench/harness.py).
+    """
+    harness = Harness(latency=0.01)
+    yield harness
+    harness.close()
+
+
+_seeds = itertools.count()
+
+
+@pytest.fixture
+def add_merchant(harness):
+    """
+    Insert a new synthetic merchant: every call uses another seed, so the ids never clash across the tests.
+    """
+    def add(items, variants=0):
+        return harness.add_merchant(items, variants, seed=next(_seeds))
+    return add
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import admission
+import main
+
+from admission import AdmissionController, LocalLimiter
+
+
+def event(path, merchant_id, **body):
+    return {"httpMethod": "POST", "path": path, "body": json.dumps({"merchant_id": merchant_id, **body})}
+
+
+@pytest.fixture
+def merchant_id(harness, add_merchant, monkeypatch):
+    # one model call, then every call of the merchant is rejected (the wait would exceed max_wait)
+    limiter = LocalLimiter(merchant_rps=0.01, merchant_burst=1, merchant_tpm=0, global_rps=0, global_burst=0,
+                           global_tpm=0)
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL", True)
+    monkeypatch.setattr(admission, "_controller", AdmissionController(limiter, max_wait=1))
+    harness.reset_caches()
+    merchant_id = add_merchant(20)
+    # mongomock has no async client: the asyncio pipeline reads the menu from the shared menu cache
+    harness.menu_ids(merchant_id)
+    return merchant_id
+
+
+def assert_rate_limited(response):
+    assert response["statusCode"] == 429
+    retry_after = int(response["headers"]["Retry-After"])
+    assert retry_after >= 1
+    assert response["headers"]["Access-Control-Allow-Origin"] == "*"
+    assert json.loads(response["body"]) == {"error": "Too many requests", "retry_after": retry_after}
+
+
+@pytest.mark.parametrize("async_pipeline", [False, True])
+def test_generate_questions_rejected_with_429(merchant_id, monkeypatch, async_pipeline):
+    monkeypatch.setattr(main, "ASYNC_PIPELINE", async_pipeline)
+
+    response = main.lambda_handler(event("/generate-questions", merchant_id, language="it"), None)
+    assert response["statusCode"] == 200
+
+    # another language is another prompt: not served by the response cache
+    assert_rate_limited(main.lambda_handler(event("/generate-questions", merchant_id, language="en"), None))
+
+
+@pytest.mark.parametrize("async_pipeline", [False, True])
+def test_suggest_dishes_rejected_with_429(merchant_id, monkeypatch, async_pipeline):
+    monkeypatch.setattr(main, "ASYNC_PIPELINE", async_pipeline)
+
+    for answer in ("Pizza", "Pasta"):
+        response = main.lambda_handler(event(
+            "/suggest-dishes", merchant_id, language="it",
+            user_preferences={"preferences": [{"question": "Cosa preferisci?", "answer": answer}]}
+        ), None)
+
+    assert_rate_limited(response)
+
+
+def test_stream_reports_rate_limit(merchant_id):
+    main.lambda_handler(event("/generate-questions", merchant_id, language="it"), None)
+
+    response = main.lambda_handler(event("/generate-questions", merchant_id, language="en", stream=True), None)
+
+    events = [json.loads(line) for line in response["body"].splitlines()]
+    assert events[-1]["error"] == "Too many requests"
+    assert events[-1]["retry_after"] >= 1
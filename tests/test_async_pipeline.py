@@ -0,0 +1,67 @@
+import asyncio
+
+from collections import defaultdict
+
+import pytest
+
+from pymongo.errors import AutoReconnect
+
+import async_pipeline
+import fetch_menu
+
+from llm_client import LLMError
+
+
+def test_model_error_keeps_the_details(harness, add_merchant, monkeypatch):
+    harness.reset_caches()
+    merchant_id = add_merchant(20)
+    # mongomock has no async client: the asyncio pipeline reads the menu from the shared menu cache
+    menu_id = harness.menu_ids(merchant_id)[0]
+
+    async def failing_completion(*args, **kwargs):
+        raise LLMError("every provider failed")
+    monkeypatch.setattr(async_pipeline, "async_chat_completion", failing_completion)
+
+    result = asyncio.run(async_pipeline.async_generate_questions(merchant_id, menu_id, "it"))
+
+    assert result == {"error": "No response from model", "details": "every provider failed"}
+
+
+class ScriptedFetcher(fetch_menu.AsyncMenuFetcher):
+    def __init__(self, result):
+        super().__init__(defaultdict(lambda: defaultdict(dict)))  # database and collections are never read
+        self.result = result
+
+    async def _get_menu_async(self, merchant_id):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_async_fetch_reconnects_after_connection_failure(harness, monkeypatch):
+    harness.reset_caches()
+    menus = [{"id": "menu", "categories": []}]
+    resets = []
+
+    async def reset_async_client():
+        resets.append(True)
+    monkeypatch.setattr(fetch_menu, "reset_async_client", reset_async_client)
+    monkeypatch.setattr(fetch_menu, "get_async_menu_fetcher", lambda: ScriptedFetcher(menus))
+
+    result = asyncio.run(ScriptedFetcher(AutoReconnect("connection reset")).get_menu_async("merchant"))
+
+    assert result == menus
+    assert resets == [True]
+    assert fetch_menu.menu_cache.get(("menus", "merchant")) == menus
+
+
+def test_async_fetch_fails_after_second_connection_failure(harness, monkeypatch):
+    harness.reset_caches()
+
+    async def reset_async_client():
+        pass
+    monkeypatch.setattr(fetch_menu, "reset_async_client", reset_async_client)
+    monkeypatch.setattr(fetch_menu, "get_async_menu_fetcher", lambda: ScriptedFetcher(AutoReconnect("still down")))
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(ScriptedFetcher(AutoReconnect("connection reset")).get_menu_async("merchant"))
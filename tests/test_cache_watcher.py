@@ -0,0 +1,113 @@
+import itertools
+
+import pytest
+
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+import cache_watcher
+
+from cache_watcher import CacheWatcher
+
+_tokens = itertools.count()
+
+
+def change(collection, operation, document_id, **fields):
+    return {"_id": {"_data": next(_tokens)}, "ns": {"db": "test", "coll": collection},
+            "operationType": operation, "documentKey": {"_id": document_id}, **fields}
+
+
+class FakeStream:
+    """
+    Change stream returning the given changes, then failing with error (or stopping the watcher).
+    """
+
+    def __init__(self, watcher, changes, error=None):
+        self.watcher = watcher
+        self.changes = list(changes)
+        self.error = error
+        self.alive = True
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        if self.changes:
+            event = self.changes.pop(0)
+            self.resume_token = event["_id"]
+            return event
+        if self.error is not None:
+            raise self.error
+        self.watcher.stop()
+        return None
+
+
+class WatchedDatabase:
+    """
+    The mongomock database (which has no change streams) opening the given fake streams in order.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.streams = []
+        self.resumed_after = []
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    def watch(self, pipeline, resume_after=None, **kwargs):
+        self.resumed_after.append(resume_after)
+        return self.streams.pop(0)
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    """
+    Merchant IDs passed to invalidate_menu (None for every merchant) and to the invalidation hooks.
+    """
+    calls = {"menus": [], "hooks": []}
+    monkeypatch.setattr(cache_watcher, "invalidate_menu", lambda merchant_id=None: calls["menus"].append(merchant_id))
+    monkeypatch.setattr(cache_watcher, "_hooks", [])
+    monkeypatch.setattr(cache_watcher, "MENU_CACHE_WATCHER_RETRY", 0)
+    cache_watcher.register_invalidation_hook(calls["hooks"].append)
+    return calls
+
+
+def test_changes_invalidate_the_affected_merchants(harness, add_merchant, invalidated):
+    merchant_id, other_id = add_merchant(30), add_merchant(30)
+    category_ids = harness.db.users.find_one({"_id": ObjectId(merchant_id)})["merchantInfo"]["categories"]
+    other_category_ids = harness.db.users.find_one({"_id": ObjectId(other_id)})["merchantInfo"]["categories"]
+    db = WatchedDatabase(harness.db)
+    watcher = CacheWatcher(db, rebuild=False)
+    before_error = [
+        change("categories", "update", ObjectId(category_ids[0]), updateDescription={"updatedFields": {"x": 1}}),
+        change("categories", "insert", ObjectId()),
+        change("categories", "delete", ObjectId(other_category_ids[-1])),
+        change("menu_variants", "insert", ObjectId(), fullDocument={"merchantID": other_id}),
+    ]
+    db.streams = [
+        FakeStream(watcher, before_error, error=AutoReconnect("connection lost")),
+        FakeStream(watcher, [
+            change("menu_variants", "update", ObjectId(), fullDocument={"merchantID": merchant_id}),
+            change("users", "update", ObjectId(merchant_id),
+                   updateDescription={"updatedFields": {"merchantInfo.categories": []}, "removedFields": []}),
+            change("users", "update", ObjectId(other_id),
+                   updateDescription={"updatedFields": {"email": "x"}, "removedFields": []}),
+            change("users", "delete", ObjectId(other_id)),
+            change("menu_variants", "delete", ObjectId()),
+        ]),
+    ]
+
+    watcher.watch()
+
+    expected = [merchant_id, other_id, other_id, merchant_id, merchant_id, other_id, None]
+    # the first stream starts without a resume token: every cached menu may be stale
+    assert invalidated["menus"] == [None] + expected
+    assert invalidated["hooks"] == expected
+    # reopened after the error from the last change seen, without invalidating everything again
+    assert db.resumed_after == [None, before_error[-1]["_id"]]
+    assert not db.streams
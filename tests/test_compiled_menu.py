@@ -0,0 +1,50 @@
+import pytest
+
+from compiled_menu import CompiledDish, CompiledMenu
+from preference_filter import parse_constraints
+
+
+def dish(ingredients, allergens=()):
+    item = {"_id": "1", "name": "Dish", "ingredients": [{"name": name} for name in ingredients],
+            "allergens": list(allergens)}
+    return CompiledDish(0, item, {"_id": "c", "name": "Category"})
+
+
+def allergic_to(answer):
+    return parse_constraints({"preferences": [{"question": "Hai allergie?", "answer": answer}]})
+
+
+def test_declared_allergen_excludes_dish():
+    assert not dish(["Pasta"], ["Glutine"]).is_compatible(allergic_to("glutine"))
+
+
+def test_allergen_ingredient_excludes_undeclared_dish():
+    assert not dish(["Riso", "Latte intero"]).is_compatible(allergic_to("lattosio"))
+    assert not dish(["Insalata", "Noci"]).is_compatible(allergic_to("frutta a guscio"))
+
+
+def test_unrelated_dish_is_compatible():
+    assert dish(["Riso", "Zucchine"]).is_compatible(allergic_to("lattosio"))
+
+
+def menu(*names):
+    items = [{"_id": f"id{index}", "name": name} for index, name in enumerate(names)]
+    return CompiledMenu({"id": "menu", "categories": [{"_id": "c", "name": "Category", "items": items}]})
+
+
+@pytest.mark.parametrize("suggestion, position", [
+    ("d2", 1),
+    ("id2", 2),
+    ("spaghetti alla carbonara", 1),
+    ("Spagheti alla carbonara", 1),
+    ("Pizza 12", None),
+    ("Pizza 13", 2),
+    ("Pizza 1", None),
+    ("Tiramisù", None),
+])
+def test_find(suggestion, position):
+    assert menu("Pizza Margherita", "Spaghetti alla Carbonara", "Pizza 13", "Pizza 14").find(suggestion) == position
+
+
+def test_ambiguous_close_names_are_not_matched():
+    assert menu("Insalata mista", "Insalata misto").find("Insalata miste") is None
@@ -0,0 +1,82 @@
+from bson import ObjectId
+
+from fetch_menu import FETCH_MODE_AGGREGATE, FETCH_MODE_QUERIES, MenuFetcher
+
+
+class AggregatingUsers:
+    """
+    The users collection of mongomock, answering menu_documents_pipeline like MongoDB 5.0+ would
+    (mongomock supports neither $toObjectId nor $lookup with a pipeline). The lookups return the categories
+    in reverse storage order: only the sort of parse_menu_documents restores the merchantInfo order.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        match, project, categories_lookup, variants_lookup = (next(iter(stage.values())) for stage in pipeline)
+        user = self.db.users.find_one(match)
+        if user is None:
+            return iter([])
+
+        assert project["categoryIds"]["$map"]["in"] == {"$toObjectId": "$$this"}
+        category_ids = [ObjectId(id) for id in user.get("merchantInfo", {}).get("categories", [])]
+        categories = list(self.db[categories_lookup["from"]].find(
+            {categories_lookup["foreignField"]: {"$in": category_ids}}, categories_lookup["pipeline"][0]["$project"]
+        ))
+        variants = list(self.db[variants_lookup["from"]].find(variants_lookup["pipeline"][0]["$match"]))
+        return iter([{
+            "_id": user["_id"],
+            "categoryIds": category_ids,
+            categories_lookup["as"]: categories[::-1],
+            variants_lookup["as"]: variants,
+        }])
+
+
+def fetch(harness, merchant_id, fetch_mode):
+    fetcher = MenuFetcher(harness.client, fetch_mode=fetch_mode)
+    if fetch_mode == FETCH_MODE_AGGREGATE:
+        fetcher.users_collection = AggregatingUsers(harness.db)
+    return fetcher, fetcher.get_menu(merchant_id, use_cache=False)
+
+
+def test_aggregate_matches_queries(harness, add_merchant):
+    merchant_id = add_merchant(60, variants=3)
+    # a variant of another merchant is not joined
+    add_merchant(10, variants=1)
+
+    fetcher, menus = fetch(harness, merchant_id, FETCH_MODE_AGGREGATE)
+    _, expected = fetch(harness, merchant_id, FETCH_MODE_QUERIES)
+
+    assert fetcher.users_collection.pipelines and fetcher.fetch_mode == FETCH_MODE_AGGREGATE
+    assert len(menus) > 1
+    assert menus == expected
+
+
+def test_aggregate_keeps_merchant_category_order(harness, add_merchant):
+    merchant_id = add_merchant(60)
+    user = harness.db.users.find_one({"_id": ObjectId(merchant_id)})
+    category_ids = user["merchantInfo"]["categories"]
+    category_ids = category_ids[1:] + category_ids[:1]
+    harness.db.users.update_one({"_id": user["_id"]}, {"$set": {"merchantInfo.categories": category_ids}})
+
+    _, menus = fetch(harness, merchant_id, FETCH_MODE_AGGREGATE)
+
+    assert [category["_id"] for category in menus[0]["categories"]] == [ObjectId(id) for id in category_ids]
+
+
+def test_aggregate_unknown_merchant(harness):
+    assert fetch(harness, str(ObjectId()), FETCH_MODE_AGGREGATE)[1] == []
+
+
+def test_unsupported_aggregate_falls_back_to_queries(harness, add_merchant):
+    merchant_id = add_merchant(20)
+    # mongomock rejects $toObjectId like a server older than 4.0
+    fetcher = MenuFetcher(harness.client, fetch_mode=FETCH_MODE_AGGREGATE)
+
+    menus = fetcher.get_menu(merchant_id, use_cache=False)
+
+    assert fetcher.fetch_mode == FETCH_MODE_QUERIES
+    assert menus == fetch(harness, merchant_id, FETCH_MODE_QUERIES)[1]
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_client import CircuitBreaker, LLMError, Provider, _async_call_provider, _call_provider
+
+
+def open_breaker(provider):
+    provider.breaker = CircuitBreaker(failures=1, cooldown=0.01)
+    provider.breaker.record_failure()
+    assert not provider.breaker.allow()
+    time.sleep(0.02)
+    # the next request after the cooldown is the trial request
+    assert provider.breaker.allow()
+    assert not provider.breaker.allow()
+
+
+def invalid_request(timeout):
+    raise ValueError("400: invalid request")
+
+
+def test_breaker_opens_and_closes():
+    breaker = CircuitBreaker(failures=2, cooldown=0.01)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_non_retryable_error_releases_the_trial():
+    provider = Provider("test", "key", "http://127.0.0.1:1", "model")
+    open_breaker(provider)
+
+    with pytest.raises(LLMError):
+        _call_provider(provider, invalid_request, time.monotonic() + 5)
+
+    assert provider.breaker.allow()
+
+
+def test_non_retryable_error_releases_the_trial_async():
+    provider = Provider("test", "key", "http://127.0.0.1:1", "model")
+    open_breaker(provider)
+
+    async def call(timeout):
+        invalid_request(timeout)
+
+    with pytest.raises(LLMError):
+        asyncio.run(_async_call_provider(provider, call, time.monotonic() + 5))
+
+    assert provider.breaker.allow()
+
+
+def test_successful_trial_closes_the_circuit():
+    provider = Provider("test", "key", "http://127.0.0.1:1", "model")
+    open_breaker(provider)
+
+    assert _call_provider(provider, lambda timeout: "ok", time.monotonic() + 5) == "ok"
+
+    assert not provider.breaker.is_open()
+    assert provider.breaker.allow() and provider.breaker.allow()
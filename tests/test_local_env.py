@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import APP_DIR
+
+SETTINGS = {"DEBUG_PAYLOADS": "true", "MENU_CACHE_TTL": "5", "LLM_TIMEOUT": "3", "ADMISSION_CONTROL": "true"}
+
+
+def test_entry_point_loads_dotenv_before_the_settings(tmp_path):
+    (tmp_path / ".env").write_text("".join(f"{name}={value}\n" for name, value in SETTINGS.items()))
+    environment = {name: value for name, value in os.environ.items()
+                   if name not in SETTINGS and name != "AWS_LAMBDA_FUNCTION_NAME"}
+    environment["PYTHONPATH"] = os.path.abspath(APP_DIR)
+
+    code = (
+        "import json, main, metrics, fetch_menu, llm_client, admission; "
+        "print(json.dumps([metrics.DEBUG_PAYLOADS, fetch_menu.MENU_CACHE_TTL, llm_client.LLM_TIMEOUT, "
+        "admission.ADMISSION_CONTROL]))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=environment, check=True,
+                            capture_output=True, text=True).stdout
+
+    assert json.loads(output.splitlines()[-1]) == [True, 5.0, 3.0, True]
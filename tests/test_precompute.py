@@ -0,0 +1,10 @@
+import precompute
+
+
+def test_unreadable_merchant_is_skipped(harness, add_merchant):
+    merchant_id = add_merchant(20)
+
+    counters = precompute.precompute(["it"], ["not-an-object-id", merchant_id], dry_run=True)
+
+    assert counters["merchants_failed"] == 1
+    assert counters["menus"] == 1
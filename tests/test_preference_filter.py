@@ -0,0 +1,103 @@
+import pytest
+
+from preference_filter import FISH_INGREDIENTS, MEAT_INGREDIENTS, parse_constraints
+
+
+def constraints_for(question, answer):
+    return parse_constraints({"preferences": [{"question": question, "answer": answer}]})
+
+
+@pytest.mark.parametrize("answer", ["Vegetariano", "Sono vegetariana", "I am vegetarian", "Non vegano, ma vegetariano"])
+def test_vegetarian_answer(answer):
+    constraints = constraints_for("Segui una dieta particolare?", answer)
+
+    assert set(MEAT_INGREDIENTS) | set(FISH_INGREDIENTS) <= constraints.excluded_ingredients
+    assert {"fish", "crustaceans", "molluscs"} <= constraints.allergens
+    assert "milk" not in constraints.allergens
+
+
+def test_vegan_answer_implies_vegetarian():
+    constraints = constraints_for("Do you follow a diet?", "Vegan")
+
+    assert {"fish", "crustaceans", "molluscs", "milk", "eggs"} <= constraints.allergens
+    assert {"carne", "formaggio"} <= constraints.excluded_ingredients
+
+
+@pytest.mark.parametrize("answer", [
+    "No, I am not vegetarian",
+    "Non sono vegetariano",
+    "Non vegetariano",
+    "I'm not vegan",
+    "Né vegetariano né vegano",
+    "No",
+])
+def test_negated_diet_answer(answer):
+    assert constraints_for("Sei vegetariano o vegano?", answer).is_empty()
+
+
+def test_affirmative_answer_to_diet_question():
+    assert "carne" in constraints_for("Sei vegetariano?", "Sì").excluded_ingredients
+    assert constraints_for("Sei vegetariano?", "No").is_empty()
+
+
+def test_list_answer():
+    constraints = constraints_for("Hai allergie o intolleranze?", ["Glutine", "Lattosio", "kiwi"])
+
+    assert constraints.allergens == {"gluten", "milk"}
+    assert constraints.allergen_terms == {"kiwi"}
+    assert not constraints.excluded_ingredients
+
+
+def test_list_answer_with_diet():
+    constraints = constraints_for("Preferenze alimentari?", ["Piccante", "Vegetariano"])
+
+    assert "pollo" in constraints.excluded_ingredients
+
+
+def test_bare_yes_to_vegan_or_vegetarian_question_means_vegetarian():
+    constraints = constraints_for("Sei vegano o vegetariano?", "Sì")
+
+    assert "carne" in constraints.excluded_ingredients
+    assert "milk" not in constraints.allergens
+    assert "formaggio" not in constraints.excluded_ingredients
+
+
+@pytest.mark.parametrize("answer", [
+    "I am allergic to nuts but not to milk",
+    "Sono allergico alle noci, ma non al latte",
+    "Noci; non sono allergica al latte",
+])
+def test_negated_allergen_is_not_declared(answer):
+    constraints = constraints_for("Hai allergie o intolleranze?", answer)
+
+    assert constraints.allergens == {"nuts"}
+    assert not constraints.allergen_terms
+
+
+def test_allergy_phrase_is_stripped_from_unknown_allergen():
+    assert constraints_for("Hai allergie?", "Sono allergica al kiwi").allergen_terms == {"kiwi"}
+
+
+def test_no_prefix_still_declares_allergen():
+    assert constraints_for("Hai intolleranze?", "No glutine").allergens == {"gluten"}
+
+
+@pytest.mark.parametrize("answer, allergens", [
+    ("Frutti di mare", {"crustaceans", "molluscs"}),
+    ("seafood", {"crustaceans", "molluscs"}),
+    ("Farina", {"gluten"}),
+    ("flour", {"gluten"}),
+])
+def test_allergen_synonyms(answer, allergens):
+    assert constraints_for("Any allergies?", answer).allergens == allergens
+
+
+@pytest.mark.parametrize("answer", [
+    "Nessuna", "no allergies", ["No"], "Non ho allergie", "I don't have any allergies", "Nessuna intolleranza",
+])
+def test_no_allergies(answer):
+    assert constraints_for("Do you have any allergies?", answer).is_empty()
+
+
+def test_plain_preferences_are_left_to_the_model():
+    assert constraints_for("Preferisci carne o pesce?", "Carne").is_empty()
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import mongomock
+import pytest
+
+from response_cache import MongoStore, ResponseCache
+from singleflight import MongoLease
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["test"]
+
+
+def container(db, lease_wait=30):
+    # every container has its own in-process tier and lease owner, and shares the MongoDB collections
+    return ResponseCache(MongoStore(db["responses"]), lease=MongoLease(db["leases"], ttl=6), lease_wait=lease_wait)
+
+
+def is_valid(value):
+    return value != "invalid"
+
+
+def run_leader(cache, compute):
+    started = threading.Event()
+
+    def leader_compute():
+        started.set()
+        return compute()
+
+    def run():
+        try:
+            cache.get_or_compute("key", leader_compute, is_valid=is_valid)
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    return thread
+
+
+def test_follower_gets_the_response_of_the_leader(db):
+    release = threading.Event()
+    leader = run_leader(container(db), lambda: release.wait() and "leader")
+
+    threading.Timer(0.3, release.set).start()
+    assert container(db).get_or_compute("key", lambda: "follower") == "leader"
+    leader.join()
+
+
+@pytest.mark.parametrize("leader_result", ["error", "invalid"])
+def test_follower_stops_waiting_when_the_leader_fails(db, leader_result):
+    release = threading.Event()
+
+    def leader_compute():
+        release.wait()
+        if leader_result == "error":
+            raise RuntimeError("model call failed")
+        return "invalid"
+
+    leader = run_leader(container(db), leader_compute)
+    threading.Timer(0.3, release.set).start()
+
+    started_at = time.monotonic()
+    value = container(db).get_or_compute("key", lambda: "follower", is_valid=is_valid)
+    elapsed = time.monotonic() - started_at
+    leader.join()
+
+    assert value == "follower"
+    # the lease ttl is 6 seconds: the follower computes as soon as the leader gives the lease back
+    assert elapsed < 2
+
+
+def test_follower_wait_is_capped(db):
+    release = threading.Event()
+    leader = run_leader(container(db), lambda: release.wait() and "leader")
+
+    started_at = time.monotonic()
+    assert container(db, lease_wait=0.5).get_or_compute("key", lambda: "follower") == "follower"
+    assert time.monotonic() - started_at < 2
+
+    release.set()
+    leader.join()
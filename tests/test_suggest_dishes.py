@@ -0,0 +1,47 @@
+import pytest
+
+import suggest_dishes
+
+PREFERENCES = {"preferences": [{"question": "Cosa preferisci?", "answer": "Qualcosa di leggero"}]}
+
+
+@pytest.fixture
+def stream(harness, add_merchant, monkeypatch):
+    """
+    Stream the suggestions for a new merchant, with the given chunks as the response of the model.
+    :return: function(chunks) -> (events, cached suggestions or None).
+    """
+    harness.reset_caches()
+    merchant_id = add_merchant(20)
+    menu_id = harness.menu_ids(merchant_id)[0]
+    cached = []
+    monkeypatch.setattr(suggest_dishes, "set_suggestions", lambda key, dishes: cached.append(dishes))
+
+    def run(chunks):
+        monkeypatch.setattr(suggest_dishes, "stream_completion", lambda *args, **kwargs: iter(chunks))
+        events = list(suggest_dishes.stream_suggestions(merchant_id, menu_id, "it", PREFERENCES))
+        return events, (cached[0] if cached else None)
+    return run
+
+
+def test_complete_response_is_cached(stream):
+    events, cached = stream(['{"suggested_dishes": ', '["d1", ', '"d2"]}'])
+
+    dishes = [event["dish"] for event in events if "dish" in event]
+    assert len(dishes) == 2
+    assert events[-1] == {"done": True}
+    assert cached == dishes
+
+
+@pytest.mark.parametrize("chunks", [
+    ['{"suggested_dishes": ', '["d1", ', '"d2"'],
+    ['{"suggested_dishes": []}'],
+    ['{"suggested_dishes": ["missing"]}'],
+    ['not json'],
+])
+def test_invalid_response_ends_with_error(stream, chunks):
+    events, cached = stream(chunks)
+
+    assert events[-1] == {"error": "Invalid response from model"}
+    assert {"done": True} not in events
+    assert cached is None